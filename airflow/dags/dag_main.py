@@ -5,9 +5,8 @@ from airflow.operators.python import PythonOperator
 #from airflow.utils.dates import days_ago
 from airflow.utils.task_group import TaskGroup 
 
-from tasks.bronze import google_sheet_to_minio_etl
-from tasks.silver import transform_and_load_silver
-from tasks.gold import transform_and_load_gold  
+# Callables leves: bronze, silver e gold (pandas, pyarrow, boto3, gspread...) só são importados na execução da tarefa
+from tasks.tarefas import google_sheets_to_minio_etl, transform_and_load_silver, transform_and_load_gold
 
 default_args = {
     'owner': 'Kenji',
@@ -35,14 +34,32 @@ def main_dag():
     access_key = 'minioadmin'
     secret_key = 'minio@1234!'
     sheet_id = '18HOS_6TuNxBlMaVITJgllR0W9Y2eB609KnsFdNs-neI'  # ID da planilha do google sheets
+    planilhas = {sheet_id: google_sheets}  # Abas de cada planilha, lidas com um único cliente autorizado
+    etl_kwargs = {
+        'load_method': 'executemany',  # Carga no MariaDB: 'executemany', 'values' ou 'infile'
+        'batch_size': 1000,
+        'incremental': False,  # True processa apenas as linhas alteradas desde a última execução
+        'publish_mode': 'swap',  # Publicação das cargas completas no MariaDB: 'swap', 'merge' ou 'upsert'
+        'streaming': False,  # True processa as cargas completas em lotes de memória limitada (backfills grandes)
+    }
+    # Motor das transformações de cada saída silver/gold: 'pandas' ou 'arrow' (pyarrow.compute), com saídas idênticas
+    engines = {
+        'slv_acordos': 'pandas',
+        'gld_acordos': 'pandas',
+        'gld_hier': 'pandas',
+        'gld_pais': 'pandas',
+        'gld_org': 'pandas',
+        'gld_contagens': 'pandas',
+        'gld_dim_local': 'pandas',
+    }
 
     with TaskGroup("group_task_sheets", tooltip="Tasks processadas do google sheets para minio, salvando em .parquet") as group_task_sheets:
-        for sheets_name in google_sheets:
-            PythonOperator(
-                task_id=f'task_sheets_{sheets_name}',
-                python_callable=google_sheet_to_minio_etl,
-                op_args=[sheet_id, sheets_name, bucket_name, endpoint_url, access_key, secret_key]
-            )
+        PythonOperator(
+            task_id='task_sheets',
+            python_callable=google_sheets_to_minio_etl,  # Leitura em lote das abas e gravação em paralelo
+            op_args=[planilhas, bucket_name, endpoint_url, access_key, secret_key],
+            op_kwargs=etl_kwargs
+        )
     with TaskGroup("slv_task_acordos", tooltip="Tasks de transformação e carga da camada silver") as slv_task_acordos:
         silver = {
             'slv_acordos': 'Geral',
@@ -55,7 +72,8 @@ def main_dag():
                          f"{sheet_name}/brz_{sheet_name}.parquet",
                          endpoint_url,
                          access_key,
-                         secret_key]
+                         secret_key],
+                op_kwargs={**etl_kwargs, 'engine': engines[slv_name]}
             )
 
     with TaskGroup("gld_task_acordos", tooltip="Tasks de transformação e carga da camada gold") as gld_task_acordos:
@@ -64,6 +82,8 @@ def main_dag():
             'gld_hier': 'slv_acordos',
             'gld_pais': 'slv_acordos',
             'gld_org': 'slv_acordos',
+            'gld_contagens': 'slv_acordos',  # Rollup de acordos por ano, local, tipo de acordo e tipo de parceiro
+            'gld_dim_local': 'slv_acordos',  # Dimensão hierárquica continente > região > local
         }
         for gld_name, slv_name in gold.items():
             PythonOperator(
@@ -73,7 +93,8 @@ def main_dag():
                          f"{bucket2_name}/{slv_name}.parquet",
                          endpoint_url,
                          access_key,
-                         secret_key]
+                         secret_key],
+                op_kwargs={**etl_kwargs, 'targets': [gld_name], 'engine': engines[gld_name]}  # Cada tarefa constrói e carrega apenas a sua saída
             )
 
     group_task_sheets >> slv_task_acordos >> gld_task_acordos
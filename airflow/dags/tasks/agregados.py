@@ -0,0 +1,134 @@
+import logging
+
+import pandas as pd
+
+from tasks.cdc import COLUNA_CHAVE, META_SNAPSHOT, hash_colunas, mesclar
+from tasks.loader import bulk_load, DEFAULT_BATCH_SIZE
+from tasks.metricas import ETAPA_CARGA_DB, etapa
+from tasks.storage import try_read_parquet, write_parquet
+
+logger = logging.getLogger(__name__)
+
+# Colunas técnicas dos rollups da camada gold: chave determinística do grupo (hash dos valores das colunas agrupadas,
+# estável entre cargas) e número de linhas da silver no grupo
+COLUNA_GRUPO = '_grupo'
+COLUNA_CONTAGEM = 'acordos'
+
+
+def membros_key(key):
+    """Chave da associação linha da silver -> grupo de um rollup (gold/x.parquet -> gold/x_membros.parquet)."""
+    return key[:-len('.parquet')] + '_membros.parquet' if key.endswith('.parquet') else key + '_membros'
+
+
+def _estavel(df, grupos):
+    # O ano chega como int32 ou, com datas nulas, float64: Int64 deixa o valor (e o hash do grupo) igual nos dois casos
+    return df.assign(**{c: df[c].astype('Int64') for c in grupos if pd.api.types.is_float_dtype(df[c])})
+
+
+def grupos_das_linhas(df, grupos):
+    """Chave do grupo (COLUNA_GRUPO) de cada linha, com os valores das colunas agrupadas."""
+    linhas = _estavel(df[grupos], grupos)
+    linhas.insert(0, COLUNA_GRUPO, hash_colunas(linhas, grupos))
+    return linhas
+
+
+def _totalizar(linhas, grupos, contagem):
+    # Soma as contagens por grupo, com os valores das colunas agrupadas ordenados para uma saída estável
+    totais = (linhas.assign(**{COLUNA_CONTAGEM: contagem})
+              .groupby(COLUNA_GRUPO, sort=False)
+              .agg({**{c: 'first' for c in grupos}, COLUNA_CONTAGEM: 'sum'})
+              .reset_index())
+    totais[COLUNA_CONTAGEM] = totais[COLUNA_CONTAGEM].astype('int64')
+    return totais.sort_values(grupos, kind='stable', na_position='last').reset_index(drop=True)
+
+
+def contar(df, grupos):
+    """Rollup completo: número de linhas de `df` por combinação de `grupos`, com a chave de cada grupo."""
+    return _totalizar(grupos_das_linhas(df, grupos), grupos, 1)
+
+
+def somar(parciais, grupos):
+    """Junta rollups parciais (ex.: de lotes do modo streaming) somando as contagens dos mesmos grupos."""
+    linhas = pd.concat(parciais, ignore_index=True)
+    return _totalizar(linhas, grupos, linhas[COLUNA_CONTAGEM].to_numpy())
+
+
+def membros(df, grupos):
+    """Associação de cada linha da silver (COLUNA_CHAVE) ao seu grupo, mantida para as atualizações incrementais."""
+    return pd.DataFrame({COLUNA_CHAVE: df[COLUNA_CHAVE].to_numpy(dtype='uint64'),
+                         COLUNA_GRUPO: grupos_das_linhas(df, grupos)[COLUNA_GRUPO].to_numpy()})
+
+
+def atualizar(base, membros_anteriores, novos, chaves, grupos):
+    """
+    Atualiza o rollup `base` com as linhas alteradas da silver, sem reagrupar a silver inteira: as linhas das `chaves`
+    saem dos grupos em que estavam (segundo `membros_anteriores`) e as linhas `novos` (com COLUNA_CHAVE) entram nos
+    seus.
+
+    Retorna (rollup, alterados, membros): o rollup completo, os grupos afetados com a nova contagem (0 para os que
+    ficaram vazios) e a nova associação linha -> grupo.
+    """
+    saidas = membros_anteriores[membros_anteriores[COLUNA_CHAVE].isin(pd.Series(chaves, dtype='uint64'))]
+    entradas = grupos_das_linhas(novos, grupos)
+    variacao = pd.concat([
+        pd.Series(-1, index=saidas[COLUNA_GRUPO].to_numpy(), dtype='int64'),
+        pd.Series(1, index=entradas[COLUNA_GRUPO].to_numpy(), dtype='int64'),
+    ]).groupby(level=0).sum()
+
+    # Valores das colunas agrupadas: os do rollup anterior e, para grupos novos, os das linhas que entraram
+    valores = pd.concat([_estavel(base[[COLUNA_GRUPO] + grupos], grupos), entradas], ignore_index=True)
+    valores = valores.drop_duplicates(COLUNA_GRUPO).set_index(COLUNA_GRUPO)
+    totais = base.set_index(COLUNA_GRUPO)[COLUNA_CONTAGEM].add(variacao, fill_value=0).astype('int64')
+
+    afetados = totais[totais.index.isin(variacao.index)]
+    alterados = _totalizar(valores.reindex(afetados.index).reset_index(), grupos, afetados.to_numpy())
+    rollup = _totalizar(valores.reindex(totais.index[totais > 0]).reset_index(), grupos, totais[totais > 0].to_numpy())
+    novos_membros = pd.DataFrame({COLUNA_CHAVE: novos[COLUNA_CHAVE].to_numpy(dtype='uint64'),
+                                  COLUNA_GRUPO: entradas[COLUNA_GRUPO].to_numpy()})
+    return rollup, alterados, mesclar(membros_anteriores, novos_membros, chaves)
+
+
+def ler_membros(minio_client, bucket_name, key, snapshot):
+    """Membros do snapshot de id `snapshot` do rollup, ou None se não existirem ou forem de outro snapshot."""
+    lido = try_read_parquet(minio_client, bucket_name, membros_key(key), with_metadata=True)
+    if lido is None:
+        return None
+    df, metadata = lido
+    if metadata.get(META_SNAPSHOT) != snapshot:
+        logging.info(f"Membros de '{key}' não correspondem ao snapshot {snapshot}; rollup recalculado por completo")
+        return None
+    return df
+
+
+def write_membros(minio_client, df, bucket_name, key, snapshot):
+    write_parquet(minio_client, df, bucket_name, membros_key(key), metadata={META_SNAPSHOT: snapshot})
+
+
+def aplicar_contagens(connection, tabela, alterados, completo=False, metodo='executemany',
+                      batch_size=DEFAULT_BATCH_SIZE, confirmar=True):
+    """
+    Sincroniza a tabela de um rollup com os grupos `alterados` (com as dimensões já trocadas pelas chaves): grupos que
+    ficaram vazios são removidos e os demais recebem a contagem nova por upsert na chave do grupo. Com completo=True,
+    a tabela é esvaziada antes e `alterados` é o rollup inteiro. Remoções e upserts formam uma única transação; com
+    confirmar=False o commit fica com o chamador. Retorna o número de grupos gravados.
+    """
+    vazios = alterados.loc[alterados[COLUNA_CONTAGEM] <= 0, COLUNA_GRUPO]
+    chaves = [int(c) for c in vazios]
+    try:
+        with etapa(ETAPA_CARGA_DB), connection.cursor() as cursor:
+            if completo:
+                cursor.execute(f"DELETE FROM `{tabela}`")
+            for inicio in range(0, len(chaves), batch_size):
+                lote = chaves[inicio:inicio + batch_size]
+                cursor.execute(f"DELETE FROM `{tabela}` WHERE {COLUNA_GRUPO} IN ({', '.join(['%s'] * len(lote))})",
+                               lote)
+        gravados = alterados[alterados[COLUNA_CONTAGEM] > 0]
+        n = bulk_load(connection, tabela, gravados, metodo=metodo, batch_size=batch_size, on_duplicate_update=True,
+                      confirmar=False)
+        if confirmar:
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    logging.info(f"Rollup {tabela} atualizado: {n} grupos gravados, {len(chaves)} removidos")
+    return n
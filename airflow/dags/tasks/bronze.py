@@ -1,129 +1,330 @@
-import gspread
-from google.oauth2.service_account import Credentials
+import contextvars
 import pandas as pd
-import boto3
-import io
 import logging
-from airflow.providers.mysql.hooks.mysql import MySqlHook
+from concurrent.futures import ThreadPoolExecutor
+
+from tasks.loader import DEFAULT_BATCH_SIZE
+from tasks.publicacao import PublicacaoEmLotes, publicar_tabela, validar_modo
+from tasks.storage import LINHAS_POR_LOTE, get_client, write_parquet, try_read_parquet
+from tasks.snapshots import EscritorSnapshot, gravar_snapshot, manifest_key, publicar_snapshot, snapshot_atual
+from tasks.cache import STATUS_EM_DIA, em_dia, linhagem_planilha, versao_codigo
+from tasks.dimensoes import como_categorias
+from tasks.metricas import ETAPA_TRANSFORMACAO, etapa, instrumentar
+from tasks.conexoes import conexao
+from tasks.esquema import garantir_tabela
+from tasks.sheets import CacheRespostas, ler_planilhas, revisoes
+from tasks.cdc import (COLUNA_CHAVE, COLUNA_OPERACAO, OP_DELETE, CHAVES_PLANILHA, META_SNAPSHOT, fingerprint, diff,
+                       montar_delta, write_delta, fingerprints_key, aplicar_delta_tabela, validar_streaming)
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def google_sheet_to_minio_etl(sheet_id, sheet_name, bucket_name, endpoint_url, access_key, secret_key):
-    # Configuração do cliente MinIO
-    minio_client = boto3.client(
-        's3',
-        endpoint_url=endpoint_url,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key
-    )
-
-    def get_google_sheet_data(sheet_id, sheet_name):
-        try:
-            scope = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
-            creds = Credentials.from_service_account_file('/opt/airflow/config_airflow/credentials.json', scopes=scope)
-            client = gspread.authorize(creds)
-            sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
-            try:
-                data = sheet.get_all_records()
-            except gspread.exceptions.GSpreadException as e:
-                if 'A linha de cabeçalho na planilha não é única.' in str(e):
-                    logging.warning(f"Erro ao usar get_all_records() (cabeçalhos duplicados): {e}")
-                    expected_headers = {
-                        'Geral': ['Data de Celebração', 'Parceiro', 'Tipo de Parceiro', 'Continente', 'Região', 'Local de Assinatura', 'Tipo de Acordo', 'Título', 'Objetivo', 'Recursos', 'Tipo de Documento', 'Vigência', 'Link']
-                    }.get(sheet_name, None)
-                    if expected_headers:
-                        data = sheet.get_all_records(expected_headers=expected_headers)
-                    else:
-                        raise
-            if not data:
-                raise ValueError(f"Nenhum dado foi retornado para a planilha {sheet_name}")
-
-            df = pd.DataFrame(data)
-            return df
-        except Exception as e:
-            logging.error(f"Erro ao obter dados da planilha do Google: {e}")
-            raise
-
-    def normalize_column_names(df):
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-        return df
-    
-    def transform_columns(df):
-        
-        if 'data_de_celebração' in df.columns:
-            df['data_de_celebração'] = pd.to_datetime(df['data_de_celebração'], errors='coerce', format='%d/%m/%Y')
-        if 'vigência' in df.columns:
-            df['vigência'] = pd.to_datetime(df['vigência'], errors='coerce', format='%d/%m/%Y')
-        if 'titulo' in df.columns:
-            df['titulo'] = df['titulo'].astype(str)  
-            df['titulo'] = df['titulo'].str.strip()
-            df['titulo'] = df['titulo'].str[:255]  
-            
-        return df
-    
-    def handle_missing_values(df):
-        df = df.fillna(value=pd.NA)  
-        return df
+# Abas processadas em paralelo (transformação, parquet no MinIO e carga no MariaDB)
+MAX_ABAS_PARALELAS = 4
 
-    try:
-        df = get_google_sheet_data(sheet_id, sheet_name)
+
+def normalize_column_names(df):
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    return df
+
+
+def transform_columns(df):
+
+    if 'data_de_celebração' in df.columns:
+        df['data_de_celebração'] = pd.to_datetime(df['data_de_celebração'], errors='coerce', format='%d/%m/%Y')
+    if 'vigência' in df.columns:
+        df['vigência'] = pd.to_datetime(df['vigência'], errors='coerce', format='%d/%m/%Y')
+    if 'titulo' in df.columns:
+        df['titulo'] = df['titulo'].astype(str)
+        df['titulo'] = df['titulo'].str.strip()
+        df['titulo'] = df['titulo'].str[:255]
+
+    return df
+
+
+def handle_missing_values(df):
+    df = df.fillna(value=pd.NA)
+    return df
+
+
+def _create_table_sql(sheet_name, colunas):
+    return f"""
+            CREATE TABLE IF NOT EXISTS brz_{sheet_name} (
+                {', '.join([f'{col} TEXT' if col.lower() in ['título', 'objetivo'] else (f'{col} DATE' if col.lower() == 'data_de_celebração' else f'{col} VARCHAR(255)') for col in colunas if col != COLUNA_CHAVE])}
+            )
+            """
+
+
+def _transformar(df, sheet_name):
+    with etapa(ETAPA_TRANSFORMACAO, linhas=len(df)):
         df = normalize_column_names(df)
         logging.info(f"Dados da planilha {sheet_name} normalizados com sucesso")
         df = transform_columns(df)
         logging.info(f"Dados da planilha {sheet_name} transformados com sucesso")
         df = handle_missing_values(df)
         logging.info(f"Dados nulos da planilha {sheet_name} tratados com sucesso")
+        return como_categorias(df)
+
+
+def _abas_pendentes(minio_client, bucket_name, planilhas, revisoes_planilhas, incremental, force):
+    """
+    Separa as abas cuja camada bronze já foi produzida a partir da mesma revisão da planilha, com o mesmo código e os
+    mesmos parâmetros (linhagem no manifesto do snapshot). Retorna ({sheet_id: [abas a processar]}, {aba: metadata});
+    abas de planilhas sem revisão conhecida são sempre processadas, sem metadata.
+    """
+    versao = versao_codigo()
+    pendentes, metadados = {}, {}
+    for sheet_id, abas in planilhas.items():
+        revisao = revisoes_planilhas.get(sheet_id)
+        for sheet_name in abas:
+            metadata = None
+            if revisao is not None:
+                metadata = linhagem_planilha(sheet_id, sheet_name, revisao, versao, incremental=incremental)
+                key = manifest_key(f"{sheet_name}/brz_{sheet_name}.parquet")
+                if not force and em_dia(minio_client, bucket_name, key, metadata):
+                    logging.info(f"Aba {sheet_name} já está atualizada em relação à revisão {revisao} da planilha "
+                                 f"{sheet_id}; nada a processar")
+                    continue
+            pendentes.setdefault(sheet_id, []).append(sheet_name)
+            metadados[sheet_name] = metadata
+    return pendentes, metadados
+
 
-        parquet_buffer = io.BytesIO()
-        df.to_parquet(parquet_buffer, index=False)
-        parquet_buffer.seek(0)
-        minio_client.put_object(Bucket=bucket_name, Key=f"{sheet_name}/brz_{sheet_name}.parquet", Body=parquet_buffer.getvalue())
+def _ler_pendentes(minio_client, bucket_name, planilhas, incremental, force, streaming):
+    # Revisões das planilhas (metadados do Drive), abas pendentes e leitura delas, com as respostas brutas da API
+    # guardadas por revisão no bucket da bronze. Retorna também as abas que não puderam ser lidas, com o erro de cada
+    # uma ({(sheet_id, aba): exceção}), para que não interrompam as demais
+    revisoes_planilhas = revisoes(planilhas)
+    pendentes, metadados = _abas_pendentes(minio_client, bucket_name, planilhas, revisoes_planilhas, incremental,
+                                           force)
+    erros = {}
+    if not pendentes:
+        return {}, metadados, erros
+    try:
+        dados = ler_planilhas(pendentes, linhas_por_lote=LINHAS_POR_LOTE if streaming else None,
+                              revisoes=revisoes_planilhas, cache=CacheRespostas(minio_client, bucket_name), erros=erros)
     except Exception as e:
-        logging.error(f"Erro ao processar a planilha {sheet_name}: {e}")
+        logging.error(f"Erro ao obter dados da planilha do Google: {e}")
         raise
+    return dados, metadados, erros
+
 
-    # Conectar ao MariaDB e escrever os dados
-    mysql_hook = MySqlHook(mysql_conn_id='local_mariadb')
-    connection = mysql_hook.get_conn()
+def _ler_fingerprints(minio_client, bucket_name, key):
+    """
+    Fingerprints do snapshot bronze atual e o id dele, ou (None, None) se não existirem ou forem de outro snapshot
+    (ex.: a carga no MariaDB falhou depois da publicação): nesse caso o delta volta a ser a planilha inteira.
+    """
+    atual = snapshot_atual(minio_client, bucket_name, key)
+    lido = try_read_parquet(minio_client, bucket_name, fingerprints_key(key), with_metadata=True)
+    if atual is None or lido is None:
+        return None, None
+    fingerprints, metadata = lido
+    if metadata.get(META_SNAPSHOT) != atual['id']:
+        logging.info(f"Fingerprints de '{key}' não correspondem ao snapshot atual {atual['id']}; delta completo")
+        return None, None
+    return fingerprints, atual['id']
 
+
+def processar_aba(df, sheet_name, bucket_name, minio_client, load_method='executemany', batch_size=DEFAULT_BATCH_SIZE,
+                  incremental=False, publish_mode='swap', metadata=None):
+    """
+    Transforma os dados brutos de uma aba e salva a camada bronze no MinIO e no MariaDB. O snapshot é publicado depois
+    da carga no MariaDB, com a linhagem `metadata` apenas se a carga tiver sido concluída (senão a aba é processada de
+    novo na próxima execução, mesmo sem alterações na planilha). No modo incremental, o delta (com os ids do
+    snapshot anterior e do novo) é gravado depois da publicação, e os fingerprints do novo snapshot só depois da
+    carga.
+    """
     try:
-        with connection.cursor() as cursor:
-            # Criar a tabela se não existir
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS brz_{sheet_name} (
-                {', '.join([f'{col} TEXT' if col.lower() in ['título', 'objetivo'] else (f'{col} DATE' if col.lower() == 'data_de_celebração' else f'{col} VARCHAR(255)') for col in df.columns])}
-            )
-            """
-            cursor.execute(create_table_sql)
+        df = _transformar(df, sheet_name)
+
+        key = f"{sheet_name}/brz_{sheet_name}.parquet"
+        if incremental:
+            fingerprints = fingerprint(df, CHAVES_PLANILHA.get(sheet_name))
+            df[COLUNA_CHAVE] = fingerprints[COLUNA_CHAVE]
+            anterior, id_anterior = _ler_fingerprints(minio_client, bucket_name, key)
+            if anterior is None:
+                # Primeira execução incremental (ou fingerprints defasados): o delta é a planilha inteira
+                novos, chaves = df, None
+            else:
+                delta = diff(anterior, fingerprints)
+                chaves = delta[COLUNA_CHAVE]
+                novos = df[df[COLUNA_CHAVE].isin(delta.loc[delta[COLUNA_OPERACAO] != OP_DELETE, COLUNA_CHAVE])]
+            delta = montar_delta(novos, chaves, anterior)
+
+        # Novo snapshot particionado pela data da execução, publicado após a carga no MariaDB
+        entrada = gravar_snapshot(minio_client, df, bucket_name, key)
+    except Exception as e:
+        logging.error(f"Erro ao processar a planilha {sheet_name}: {e}")
+        raise
+
+    # Escrever os dados no MariaDB com uma conexão do pool do processo
+    carregado = False
+    try:
+        with conexao() as connection:
+            # Criar a tabela se não existir (verificada uma vez por processo)
+            garantir_tabela(connection, f"brz_{sheet_name}", _create_table_sql(sheet_name, df.columns))
             logging.info(f"Tabela brz_{sheet_name} verificada/criada no MariaDB")
 
-            # Inserir ou atualizar dados na tabela
-            for index, row in df.iterrows():
-                # Atualizar dados se já existir
-                update_sql = f"""
-                UPDATE brz_{sheet_name}
-                SET {', '.join([f'{col} = %s' for col in df.columns])}
-                WHERE {df.columns[0]} = %s
-                """
-                cursor.execute(update_sql, tuple(row.tolist()) + (row[df.columns[0]],))
-
-                # Inserir novos dados se não existir
-                insert_sql = f"""
-                INSERT INTO brz_{sheet_name} ({', '.join(df.columns)})
-                VALUES ({', '.join(['%s'] * len(df.columns))})
-                ON DUPLICATE KEY UPDATE {', '.join([f'{col} = VALUES({col})' for col in df.columns])}
-                """
-                cursor.execute(insert_sql, tuple(row))
-
-            connection.commit()
+            if incremental:
+                # Aplicar somente as linhas alteradas desde o último snapshot
+                aplicar_delta_tabela(connection, f"brz_{sheet_name}", novos, chaves, metodo=load_method, batch_size=batch_size)
+            else:
+                # Publicar a carga completa conforme o modo (troca atômica por padrão)
+                publicar_tabela(connection, f"brz_{sheet_name}", df, modo=publish_mode, metodo=load_method,
+                                batch_size=batch_size)
             logging.info(f"Dados inseridos/atualizados na tabela brz_{sheet_name} no MariaDB")
 
+        carregado = True
+
     except Exception as e:
         logging.error(f"Erro ao conectar ao MariaDB ou inserir dados: {e}")
 
-    finally:
-        if connection:
-            connection.close()
-    logging.info("Processo ETL concluído com sucesso.")
\ No newline at end of file
+    # O manifesto passa a apontar para o novo snapshot
+    publicar_snapshot(minio_client, bucket_name, key, entrada, metadata=metadata if carregado else None)
+    if incremental:
+        write_delta(minio_client, delta, bucket_name, key, completo=chaves is None, base=id_anterior,
+                    snapshot=entrada['id'])
+        if carregado:
+            # Os fingerprints só avançam depois que o MariaDB recebeu o delta
+            write_parquet(minio_client, fingerprints, bucket_name, fingerprints_key(key),
+                          metadata={META_SNAPSHOT: entrada['id']})
+    logging.info(f"Aba {sheet_name} processada com sucesso.")
+
+
+def processar_aba_em_lotes(lotes, sheet_name, bucket_name, minio_client, load_method='executemany',
+                           batch_size=DEFAULT_BATCH_SIZE, publish_mode='swap', metadata=None):
+    """
+    Como processar_aba, no modo streaming: cada lote de linhas da aba é transformado, acrescentado ao snapshot bronze e
+    enviado à carga do MariaDB antes do próximo. O snapshot e a tabela só são publicados após o último lote. Uma falha
+    no MariaDB é registrada no log e interrompe apenas a carga no banco, como no processamento completo (e o snapshot
+    é publicado sem a linhagem `metadata`).
+    """
+    tabela = f"brz_{sheet_name}"
+    key = f"{sheet_name}/brz_{sheet_name}.parquet"
+    with conexao() as connection, EscritorSnapshot(minio_client, bucket_name, key, metadata=metadata) as escritor:
+        publicacao = None
+        for numero, lote in enumerate(lotes):
+            lote = _transformar(lote, sheet_name)
+            escritor.escrever(lote)
+            try:
+                if numero == 0:
+                    garantir_tabela(connection, tabela, _create_table_sql(sheet_name, lote.columns))
+                    publicacao = PublicacaoEmLotes(connection, tabela, modo=publish_mode, metodo=load_method,
+                                                   batch_size=batch_size).iniciar()
+                if publicacao is not None:
+                    publicacao.carregar(lote)
+            except Exception as e:
+                logging.error(f"Erro ao conectar ao MariaDB ou inserir dados: {e}")
+                if publicacao is not None:
+                    publicacao.abortar()
+                publicacao = None
+                escritor.metadata = None
+
+        # A tabela é publicada antes da troca do manifesto do snapshot (ao sair do bloco)
+        if publicacao is not None:
+            try:
+                publicacao.concluir()
+                logging.info(f"Dados inseridos/atualizados na tabela {tabela} no MariaDB")
+            except Exception as e:
+                logging.error(f"Erro ao conectar ao MariaDB ou inserir dados: {e}")
+                escritor.metadata = None
+    logging.info(f"Aba {sheet_name} processada em lotes com sucesso ({escritor.linhas} linhas).")
+
+
+@instrumentar('bronze')
+def google_sheet_to_minio_etl(sheet_id, sheet_name, bucket_name, endpoint_url, access_key, secret_key,
+                              load_method='executemany', batch_size=DEFAULT_BATCH_SIZE, incremental=False,
+                              publish_mode='swap', streaming=False, force=False):
+    """
+    Extrai a aba da planilha do Google, salva a camada bronze no MinIO e no MariaDB.
+
+    Antes da leitura, a revisão da planilha é consultada nos metadados do Drive: se a camada bronze da aba já foi
+    produzida a partir dessa revisão (com o mesmo código e parâmetros), a tarefa termina sem ler a planilha. Os valores
+    lidos da API ficam guardados no MinIO por revisão (ver sheets.CacheRespostas), então force=True reprocessa a aba
+    sem nova leitura enquanto a planilha não muda.
+
+    Com incremental=True, cada linha recebe uma chave e um fingerprint do conteúdo normalizado; os fingerprints do
+    snapshot anterior ficam no MinIO e apenas as linhas inseridas, atualizadas e removidas são publicadas no arquivo
+    delta (brz_<aba>_delta.parquet) e aplicadas no MariaDB.
+
+    Cargas completas são publicadas no MariaDB conforme `publish_mode`: 'swap' (staging + RENAME TABLE atômico),
+    'merge' (mescla pelo hash determinístico das linhas) ou 'upsert' (INSERT direto, como antes). O modo incremental
+    continua aplicando o delta na própria tabela.
+
+    Com streaming=True (apenas cargas completas), a aba é processada em lotes de LINHAS_POR_LOTE linhas, sem montar
+    o DataFrame inteiro (ver processar_aba_em_lotes).
+    """
+    validar_modo(publish_mode)
+    validar_streaming(streaming, incremental)
+    # Cliente MinIO compartilhado pelo processo worker
+    minio_client = get_client(endpoint_url, access_key, secret_key)
+    dados, metadados, erros = _ler_pendentes(minio_client, bucket_name, {sheet_id: [sheet_name]}, incremental, force,
+                                             streaming)
+    if erros:
+        raise erros[(sheet_id, sheet_name)]
+    if not dados:
+        return STATUS_EM_DIA
+    df = dados[(sheet_id, sheet_name)]
+    if streaming:
+        processar_aba_em_lotes(df, sheet_name, bucket_name, minio_client, load_method=load_method,
+                               batch_size=batch_size, publish_mode=publish_mode, metadata=metadados[sheet_name])
+    else:
+        processar_aba(df, sheet_name, bucket_name, minio_client, load_method=load_method, batch_size=batch_size,
+                      incremental=incremental, publish_mode=publish_mode, metadata=metadados[sheet_name])
+    logging.info("Processo ETL concluído com sucesso.")
+
+
+@instrumentar('bronze')
+def google_sheets_to_minio_etl(planilhas, bucket_name, endpoint_url, access_key, secret_key,
+                               load_method='executemany', batch_size=DEFAULT_BATCH_SIZE, incremental=False,
+                               publish_mode='swap', max_workers=MAX_ABAS_PARALELAS, streaming=False, force=False):
+    """
+    Extrai várias abas de uma ou mais planilhas ({sheet_id: [abas]}) com um único cliente autorizado e leituras em
+    lote, e processa as abas em paralelo como google_sheet_to_minio_etl.
+
+    Os nomes das abas definem as chaves no MinIO e as tabelas no MariaDB, então precisam ser únicos entre as
+    planilhas. Uma aba com erro, na leitura (ex.: aba vazia) ou no processamento, não interrompe as demais; a tarefa
+    falha ao final listando as abas com erro.
+    Com streaming=True, cada aba é processada em lotes (ver processar_aba_em_lotes). Abas já atualizadas em relação à
+    revisão atual da sua planilha não são lidas nem processadas (ver google_sheet_to_minio_etl); se nenhuma aba mudou,
+    a tarefa retorna STATUS_EM_DIA.
+    """
+    validar_modo(publish_mode)
+    validar_streaming(streaming, incremental)
+    abas = [aba for lista in planilhas.values() for aba in lista]
+    repetidas = sorted({aba for aba in abas if abas.count(aba) > 1})
+    if repetidas:
+        raise ValueError(f"Abas repetidas entre as planilhas: {repetidas}")
+
+    # Cliente MinIO compartilhado pelo processo worker
+    minio_client = get_client(endpoint_url, access_key, secret_key)
+    dados, metadados, erros_leitura = _ler_pendentes(minio_client, bucket_name, planilhas, incremental, force,
+                                                     streaming)
+    if not dados and not erros_leitura:
+        return STATUS_EM_DIA
+
+    # As abas que não puderam ser lidas entram nos erros da tarefa; as demais são processadas normalmente
+    erros = {sheet_name: e for (sheet_id, sheet_name), e in erros_leitura.items()}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Cada aba roda em uma cópia do contexto para que as métricas cheguem ao coletor da tarefa
+        if streaming:
+            futuros = {
+                sheet_name: executor.submit(contextvars.copy_context().run, processar_aba_em_lotes, lotes, sheet_name,
+                                            bucket_name, minio_client, load_method, batch_size, publish_mode,
+                                            metadados[sheet_name])
+                for (sheet_id, sheet_name), lotes in dados.items()
+            }
+        else:
+            futuros = {
+                sheet_name: executor.submit(contextvars.copy_context().run, processar_aba, df, sheet_name, bucket_name,
+                                            minio_client, load_method, batch_size, incremental, publish_mode,
+                                            metadados[sheet_name])
+                for (sheet_id, sheet_name), df in dados.items()
+            }
+        for sheet_name, futuro in futuros.items():
+            try:
+                futuro.result()
+            except Exception as e:
+                erros[sheet_name] = e
+    if erros:
+        raise RuntimeError(f"Falha ao processar as abas {sorted(erros)}: {erros}")
+    logging.info(f"Processo ETL concluído com sucesso para {len(dados)} abas.")
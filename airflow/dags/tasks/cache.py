@@ -0,0 +1,80 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+from urllib.parse import quote
+
+from tasks.storage import head
+
+logger = logging.getLogger(__name__)
+
+STATUS_EM_DIA = 'skipped: up to date'
+
+# Chaves dos metadados de linhagem gravados em cada objeto de saída (x-amz-meta-*)
+META_ENTRADAS = 'linhagem-entradas'
+META_VERSAO = 'linhagem-versao-codigo'
+META_PARAMETROS = 'linhagem-parametros'
+
+# Versão registrada na linhagem para uma entrada que não existe (ex.: o delta de uma carga incremental ainda não
+# gravado): uma saída com uma entrada ausente nunca é considerada em dia
+ENTRADA_AUSENTE = 'ausente'
+
+
+@functools.lru_cache(maxsize=None)
+def versao_codigo():
+    """
+    Versão do código que gera uma saída: hash do nome e do conteúdo de todos os módulos do pacote tasks. Uma camada
+    depende de helpers espalhados pelo pacote (storage, loader, esquema, dimensoes...), então qualquer alteração nele
+    invalida as saídas em cache, em vez de depender de uma lista de arquivos que precisaria ser mantida à mão.
+    """
+    pacote = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256()
+    for nome in sorted(os.listdir(pacote)):
+        if nome.endswith('.py'):
+            sha.update(nome.encode())
+            with open(os.path.join(pacote, nome), 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()[:16]
+
+
+def etag(minio_client, bucket_name, key):
+    """ETag atual do objeto (hash de conteúdo calculado pelo MinIO), ou None se o objeto não existir."""
+    atual = head(minio_client, bucket_name, key)
+    return None if atual is None else atual['ETag'].strip('"')
+
+
+def _metadados(entradas, versao, parametros):
+    return {
+        META_ENTRADAS: quote(';'.join(entradas), safe='/@;'),
+        META_VERSAO: versao,
+        META_PARAMETROS: quote(json.dumps(parametros, sort_keys=True, default=str), safe=''),
+    }
+
+
+def linhagem(minio_client, entradas, versao, **parametros):
+    """
+    Monta os metadados de linhagem de uma saída a partir das entradas [(bucket, key), ...], da versão do código e dos
+    parâmetros que alteram o resultado. Os valores são codificados para caber nos metadados ASCII do S3. Entradas que
+    não existem são registradas como ENTRADA_AUSENTE.
+    """
+    return _metadados([f'{b}/{k}@{etag(minio_client, b, k) or ENTRADA_AUSENTE}' for b, k in entradas], versao,
+                      parametros)
+
+
+def linhagem_planilha(sheet_id, sheet_name, revisao, versao, **parametros):
+    """Como linhagem, para uma saída produzida de uma aba do Google Sheets na revisão `revisao` da planilha."""
+    return _metadados([f'sheets/{sheet_id}/{sheet_name}@{revisao}'], versao, parametros)
+
+
+def em_dia(minio_client, bucket_name, key, metadata):
+    """
+    True se o objeto de saída já existe e foi produzido pelas mesmas entradas, código e parâmetros. Uma linhagem com
+    entradas ausentes nunca está em dia.
+    """
+    if any(e.endswith(f'@{ENTRADA_AUSENTE}') for e in metadata.get(META_ENTRADAS, '').split(';')):
+        return False
+    atual = head(minio_client, bucket_name, key)
+    if atual is None:
+        return False
+    return all(atual.get('Metadata', {}).get(chave) == valor for chave, valor in metadata.items())
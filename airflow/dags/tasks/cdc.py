@@ -0,0 +1,342 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from tasks.loader import bulk_load, DEFAULT_BATCH_SIZE
+from tasks.storage import try_read_parquet, write_parquet
+from tasks.snapshots import read_snapshot, snapshot_atual
+from tasks.metricas import ETAPA_CARGA_DB, ETAPA_DDL, etapa
+from tasks.esquema import uma_vez
+
+logger = logging.getLogger(__name__)
+
+# Colunas técnicas do modo incremental
+COLUNA_CHAVE = '_chave'
+COLUNA_HASH = '_hash'
+COLUNA_OPERACAO = '_operacao'
+OP_INSERT, OP_UPDATE, OP_DELETE = 'I', 'U', 'D'
+
+# Metadados do objeto delta: carga completa (sem snapshot anterior), id do snapshot sobre o qual o delta foi
+# calculado e id do snapshot que ele produz. Um consumidor só aplica o delta se a sua própria base foi produzida a
+# partir de META_BASE e se META_SNAPSHOT ainda é o snapshot atual da entrada; caso contrário, recarrega tudo
+META_COMPLETO = 'cdc-completo'
+META_BASE = 'cdc-base'
+META_SNAPSHOT = 'cdc-snapshot'
+
+# Colunas que identificam uma linha de cada aba; sem entrada, a posição da linha na planilha é usada como chave
+CHAVES_PLANILHA = {
+    'Geral': ['data_de_celebração', 'parceiro', 'título'],
+}
+
+
+def validar_streaming(streaming, incremental):
+    """O modo incremental já processa apenas o delta; o modo streaming (em lotes) se aplica às cargas completas."""
+    if streaming and incremental:
+        raise ValueError("streaming=True só se aplica a cargas completas (incremental=False)")
+
+
+def delta_key(key):
+    """Chave do arquivo delta correspondente a um snapshot (ex.: Geral/brz_Geral.parquet -> Geral/brz_Geral_delta.parquet)."""
+    return key[:-len('.parquet')] + '_delta.parquet' if key.endswith('.parquet') else key + '_delta'
+
+
+def fingerprints_key(key):
+    return key[:-len('.parquet')] + '_fingerprints.parquet' if key.endswith('.parquet') else key + '_fingerprints'
+
+
+def conteudo_key(key):
+    """Chave do hash do conteúdo das linhas de entrada de uma camada (silver/x.parquet -> silver/x_conteudo.parquet)."""
+    return key[:-len('.parquet')] + '_conteudo.parquet' if key.endswith('.parquet') else key + '_conteudo'
+
+
+def _normalizar(df):
+    # Representação textual estável das colunas, usada apenas para o cálculo dos hashes
+    return df.astype(object).where(df.notna(), '').astype(str).apply(lambda col: col.str.strip())
+
+
+def hash_colunas(df, colunas=None):
+    """Hash (uint64) do conteúdo normalizado das `colunas` (por padrão, todas) de cada linha."""
+    valores = df if colunas is None else df[colunas]
+    return pd.util.hash_pandas_object(_normalizar(valores), index=False).to_numpy(dtype='uint64')
+
+
+def chave_ocorrencia(chave_base, ocorrencia):
+    """Combina o hash de cada linha com o número da sua ocorrência, para que linhas repetidas tenham chaves distintas."""
+    pares = pd.DataFrame({'chave': np.asarray(chave_base, dtype='uint64'),
+                          'ocorrencia': np.asarray(ocorrencia, dtype='int64')})
+    return pd.util.hash_pandas_object(pares, index=False).to_numpy(dtype='uint64')
+
+
+class ContadorHashes:
+    """
+    Contagem dos hashes de linha já vistos ao longo de vários lotes (modo streaming), em dois arrays numpy ordenados:
+    16 bytes por hash distinto, em vez das linhas inteiras. Hashes de 64 bits podem colidir, com probabilidade
+    desprezível para os volumes da planilha (da ordem de n²/2^65).
+    """
+
+    def __init__(self):
+        self._hashes = np.empty(0, dtype='uint64')
+        self._contagens = np.empty(0, dtype='int64')
+
+    def ocorrencias(self, hashes):
+        """
+        Número de vezes que cada hash já apareceu, nos lotes anteriores e antes no próprio lote (0 na primeira
+        ocorrência). Os hashes do lote passam a contar para os próximos.
+        """
+        hashes = np.asarray(hashes, dtype='uint64')
+        serie = pd.Series(hashes)
+        ocorrencia = serie.groupby(serie).cumcount().to_numpy(dtype='int64', copy=True)
+        if len(self._hashes):
+            posicao = np.minimum(np.searchsorted(self._hashes, hashes), len(self._hashes) - 1)
+            vistos = self._hashes[posicao] == hashes
+            ocorrencia += np.where(vistos, self._contagens[posicao], 0)
+
+        unicos, contagens = np.unique(hashes, return_counts=True)
+        self._hashes, inverso = np.unique(np.concatenate([self._hashes, unicos]), return_inverse=True)
+        self._contagens = np.bincount(inverso, weights=np.concatenate([self._contagens, contagens])).astype('int64')
+        return ocorrencia
+
+
+def deduplicar(df, contador, colunas=None):
+    """Como drop_duplicates, mas também entre lotes: descarta as linhas cujo hash o `contador` já viu."""
+    return df[contador.ocorrencias(hash_colunas(df, colunas)) == 0]
+
+
+def fingerprint(df, key_columns=None):
+    """
+    Calcula, para cada linha, a chave (`_chave`) e o hash do conteúdo normalizado (`_hash`).
+
+    A chave é o hash das `key_columns` combinado com o número da ocorrência, para que linhas repetidas tenham chaves
+    distintas; sem `key_columns`, a posição da linha é usada.
+    """
+    if key_columns:
+        chave_base = pd.Series(hash_colunas(df, key_columns))
+        chave = chave_ocorrencia(chave_base.values, chave_base.groupby(chave_base).cumcount().values)
+    else:
+        chave = np.arange(len(df), dtype='uint64')
+    return pd.DataFrame({
+        COLUNA_CHAVE: chave,
+        COLUNA_HASH: hash_colunas(df),
+    }, index=df.index)
+
+
+def diff(anterior, atual):
+    """
+    Compara os fingerprints de dois snapshots e retorna um DataFrame (`_chave`, `_operacao`) com as chaves inseridas,
+    atualizadas e removidas.
+    """
+    comparacao = anterior.merge(atual, on=COLUNA_CHAVE, how='outer', suffixes=('_anterior', '_atual'), indicator=True)
+    operacao = pd.Series(pd.NA, index=comparacao.index, dtype='object')
+    operacao[comparacao['_merge'] == 'right_only'] = OP_INSERT
+    operacao[comparacao['_merge'] == 'left_only'] = OP_DELETE
+    alteradas = (comparacao['_merge'] == 'both') & (comparacao[f'{COLUNA_HASH}_anterior'] != comparacao[f'{COLUNA_HASH}_atual'])
+    operacao[alteradas] = OP_UPDATE
+    comparacao[COLUNA_OPERACAO] = operacao
+    return comparacao.loc[operacao.notna(), [COLUNA_CHAVE, COLUNA_OPERACAO]].reset_index(drop=True)
+
+
+def montar_delta(novos, chaves, base):
+    """
+    Monta o delta de saída de uma camada: `novos` (linhas inseridas/atualizadas, com `_chave`) recebem I ou U conforme
+    existam em `base`; chaves alteradas sem linha nova viram D.
+    """
+    delta = novos.copy()
+    existentes = base[COLUNA_CHAVE] if base is not None else pd.Series([], dtype='uint64')
+    delta[COLUNA_OPERACAO] = delta[COLUNA_CHAVE].isin(existentes).map({True: OP_UPDATE, False: OP_INSERT})
+    removidas = pd.Series(chaves, dtype='uint64') if chaves is not None else pd.Series([], dtype='uint64')
+    removidas = removidas[~removidas.isin(novos[COLUNA_CHAVE])]
+    if len(removidas):
+        # Inteiros passam a anuláveis (int32 -> Int32) para que as linhas D, sem valores, não os convertam em float
+        delta = delta.astype({c: str(t).capitalize() for c, t in delta.dtypes.items()
+                              if c != COLUNA_CHAVE and pd.api.types.is_integer_dtype(t)})
+        delta = pd.concat([delta, pd.DataFrame({COLUNA_CHAVE: removidas.values, COLUNA_OPERACAO: OP_DELETE})],
+                          ignore_index=True)
+    return delta
+
+
+def mesclar(base, novos, chaves):
+    """Aplica ao snapshot `base` as linhas `novos`, descartando antes as linhas cujas chaves mudaram."""
+    if base is None or chaves is None:
+        return novos.reset_index(drop=True)
+    mantidas = base[~base[COLUNA_CHAVE].isin(pd.Series(chaves, dtype='uint64'))]
+    return pd.concat([mantidas, novos], ignore_index=True)
+
+
+def sem_duplicadas(base, conteudo_anterior, novos, chaves, colunas):
+    """
+    Deduplicação do modo incremental, com o mesmo resultado do drop_duplicates de uma carga completa: de cada grupo
+    de linhas de entrada com o mesmo conteúdo (hash de `colunas`), a camada mantém só a de menor `_chave`.
+
+    `conteudo_anterior` (`_chave`, `_hash`) guarda o hash de todas as linhas de entrada, inclusive as duplicadas que
+    ficaram fora da `base`: quando a linha mantida de um grupo sai ou muda, outra do grupo passa a representá-lo com
+    o conteúdo que já estava na base. Com chaves=None (recarga total), `novos` é a entrada inteira.
+
+    Retorna (linhas, chaves, conteudo): as linhas a gravar, todas as chaves da camada afetadas (removidas ou gravadas,
+    como no delta) e o novo conteúdo, para a próxima execução.
+    """
+    vazio = pd.DataFrame({COLUNA_CHAVE: pd.Series([], dtype='uint64'), COLUNA_HASH: pd.Series([], dtype='uint64')})
+    anterior = vazio if chaves is None or conteudo_anterior is None else conteudo_anterior
+    entradas = pd.DataFrame({COLUNA_CHAVE: novos[COLUNA_CHAVE].to_numpy(dtype='uint64'),
+                             COLUNA_HASH: hash_colunas(novos, colunas)})
+    conteudo = mesclar(anterior, entradas, chaves)
+
+    mantidas_antes = anterior.groupby(COLUNA_HASH)[COLUNA_CHAVE].min()
+    mantidas = conteudo.groupby(COLUNA_HASH)[COLUNA_CHAVE].min()
+    if chaves is None:
+        linhas = novos[novos[COLUNA_CHAVE].isin(mantidas)]
+        return linhas.reset_index(drop=True), None, conteudo
+
+    # Linhas gravadas: as que passaram a representar um grupo e as alteradas que continuam representando o seu
+    alteradas = pd.Series(chaves, dtype='uint64')
+    gravadas = mantidas[~mantidas.isin(mantidas_antes) | mantidas.isin(alteradas)]
+    das_novas = novos[novos[COLUNA_CHAVE].isin(gravadas)]
+    # Representantes sem linha nova mantêm o conteúdo do grupo, que está na base sob a chave do representante anterior
+    herdadas = gravadas[~gravadas.isin(novos[COLUNA_CHAVE])]
+    herdadas = (base.set_index(COLUNA_CHAVE).loc[mantidas_antes.reindex(herdadas.index).to_numpy()]
+                .assign(**{COLUNA_CHAVE: herdadas.to_numpy()}).reset_index(drop=True)[novos.columns])
+    linhas = pd.concat([das_novas, herdadas], ignore_index=True) if len(herdadas) else das_novas.reset_index(drop=True)
+    removidas = mantidas_antes[~mantidas_antes.isin(mantidas)]
+    afetadas = pd.concat([removidas, gravadas], ignore_index=True).drop_duplicates().to_numpy(dtype='uint64')
+    return linhas, afetadas, conteudo
+
+
+def ler_conteudo(minio_client, bucket_name, key, snapshot):
+    """Conteúdo das linhas de entrada do snapshot de id `snapshot` da camada, ou None se não existir ou for de outro."""
+    lido = try_read_parquet(minio_client, bucket_name, conteudo_key(key), with_metadata=True)
+    if lido is None:
+        return None
+    df, metadata = lido
+    if metadata.get(META_SNAPSHOT) != snapshot:
+        logging.info(f"Conteúdo de '{key}' não corresponde ao snapshot {snapshot}; camada recarregada por completo")
+        return None
+    return df
+
+
+def write_conteudo(minio_client, df, bucket_name, key, snapshot):
+    write_parquet(minio_client, df, bucket_name, conteudo_key(key), metadata={META_SNAPSHOT: snapshot})
+
+
+def write_delta(minio_client, delta, bucket_name, key, completo, metadata=None, base=None, snapshot=None):
+    """Grava o delta do snapshot `key`, calculado sobre o snapshot de id `base` e que produz o de id `snapshot`."""
+    write_parquet(minio_client, delta, bucket_name, delta_key(key),
+                  metadata={**(metadata or {}), META_COMPLETO: 'true' if completo else 'false',
+                            META_BASE: base or '', META_SNAPSHOT: snapshot or ''})
+    logging.info(f"Delta de '{key}' salvo: {delta[COLUNA_OPERACAO].value_counts().to_dict()}")
+
+
+def ler_delta(minio_client, bucket_name, key, columns=None, snapshot=None):
+    """
+    Lê o delta publicado para o snapshot `key`. Retorna (linhas, chaves, base): as linhas inseridas/atualizadas, todas
+    as chaves afetadas e o id do snapshot sobre o qual o delta foi calculado. Retorna (None, None, None) quando não há
+    delta utilizável: inexistente, de uma carga completa, sem base registrada ou, com `snapshot`, que não produz esse
+    snapshot (ex.: o produtor publicou outro snapshot depois do delta lido). `columns` restringe as colunas lidas.
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + [COLUNA_CHAVE, COLUNA_OPERACAO]))
+    lido = try_read_parquet(minio_client, bucket_name, delta_key(key), with_metadata=True, columns=columns)
+    if lido is None:
+        return None, None, None
+    delta, metadata = lido
+    if metadata.get(META_COMPLETO) == 'true' or not metadata.get(META_BASE):
+        return None, None, None
+    if snapshot is not None and metadata.get(META_SNAPSHOT) != snapshot:
+        logging.info(f"Delta de '{key}' não corresponde ao snapshot atual {snapshot} "
+                     f"(produz {metadata.get(META_SNAPSHOT) or 'desconhecido'})")
+        return None, None, None
+    linhas = delta[delta[COLUNA_OPERACAO] != OP_DELETE].drop(columns=[COLUNA_OPERACAO])
+    # Sem as linhas D, os inteiros anuláveis de montar_delta voltam ao tipo original, como na carga completa
+    linhas = linhas.astype({c: str(t).lower() for c, t in linhas.dtypes.items()
+                            if isinstance(t, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(t)
+                            and not linhas[c].isna().any()})
+    return linhas, delta[COLUNA_CHAVE], metadata[META_BASE]
+
+
+def ler_base(minio_client, bucket_name, key, origem=None, coluna=COLUNA_CHAVE):
+    """
+    Snapshot atual de uma camada e o seu id, ou (None, None) se não existir, não tiver a coluna de identificação
+    `coluna` (snapshots gerados no modo completo não têm `_chave`) ou, com `origem`, não tiver sido produzido a
+    partir do snapshot `origem` da entrada, que é a base sobre a qual o delta a aplicar foi calculado.
+    """
+    entrada = snapshot_atual(minio_client, bucket_name, key)
+    if entrada is None:
+        return None, None
+    if origem is not None and entrada.get('origem') != origem:
+        logging.info(f"Snapshot {entrada['id']} de '{key}' foi produzido a partir de "
+                     f"{entrada.get('origem') or 'origem desconhecida'}, e não da base {origem} do delta")
+        return None, None
+    base = read_snapshot(minio_client, bucket_name, key, snapshot=entrada['id'])
+    if coluna is not None and coluna not in base.columns:
+        return None, None
+    return base, entrada['id']
+
+
+def ler_entrada(minio_client, bucket_name, key, base_bucket, base_key, columns=None):
+    """
+    Lê a entrada de uma camada no modo incremental.
+
+    Retorna (linhas, chaves, base, id_base, origem): as linhas inseridas/atualizadas do delta de `key`, todas as
+    chaves do delta, o snapshot anterior da própria camada (`base_key`) e o seu id, e o id do snapshot atual da
+    entrada, que a camada registra como `origem` do snapshot que produz. O delta só é usado se produz o snapshot
+    atual da entrada e foi calculado sobre o snapshot do qual a base foi produzida; senão (primeira execução, delta
+    completo ou defasado, base de outra origem ou sem `_chave`) retorna o snapshot atual de `key` inteiro com
+    chaves=None e base=None, indicando recarga total. `columns` restringe as colunas lidas (a `_chave` é sempre lida).
+    """
+    atual = snapshot_atual(minio_client, bucket_name, key)
+    origem = atual['id'] if atual is not None else None
+    linhas, chaves, base_delta = (ler_delta(minio_client, bucket_name, key, columns=columns, snapshot=origem)
+                                  if origem is not None else (None, None, None))
+    base, id_base = (ler_base(minio_client, base_bucket, base_key, origem=base_delta) if chaves is not None
+                     else (None, None))
+    if base is None:
+        logging.info(f"Sem snapshot incremental anterior compatível em '{base_key}'; processando '{key}' por completo")
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + [COLUNA_CHAVE]))
+        return read_snapshot(minio_client, bucket_name, key, columns=columns, snapshot=origem), None, None, None, origem
+
+    logging.info(f"Processando delta de '{key}': {len(linhas)} linhas novas/alteradas, {len(chaves)} chaves afetadas")
+    return linhas, chaves, base, id_base, origem
+
+
+def adicionar_coluna_chave(connection, tabela):
+    """Acrescenta a coluna `_chave` (e seu índice) à tabela, se ainda não existir."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE `{tabela}` ADD COLUMN IF NOT EXISTS {COLUNA_CHAVE} BIGINT UNSIGNED, "
+            f"ADD INDEX IF NOT EXISTS idx{COLUNA_CHAVE} ({COLUNA_CHAVE})"
+        )
+
+
+def preparar_tabela(connection, tabela):
+    """Garante a coluna `_chave` (e seu índice) na tabela do MariaDB, uma vez por processo worker."""
+    with etapa(ETAPA_DDL):
+        uma_vez(('coluna_chave', tabela), adicionar_coluna_chave, connection, tabela)
+
+
+def aplicar_delta_tabela(connection, tabela, novos, chaves, metodo='executemany', batch_size=DEFAULT_BATCH_SIZE,
+                         confirmar=True):
+    """
+    Sincroniza a tabela com o delta: remove as linhas das chaves alteradas (ou todas, quando chaves=None) e carrega
+    `novos` em lotes, tudo em uma única transação. Leitores continuam vendo a tabela anterior até o commit, e uma
+    falha em qualquer lote desfaz também as remoções. Com confirmar=False o commit fica com o chamador (ex.: depois
+    da troca do manifesto do snapshot).
+    """
+    preparar_tabela(connection, tabela)
+    try:
+        with etapa(ETAPA_CARGA_DB), connection.cursor() as cursor:
+            if chaves is None:
+                cursor.execute(f"DELETE FROM `{tabela}`")
+            else:
+                chaves = [int(c) for c in chaves]
+                for inicio in range(0, len(chaves), batch_size):
+                    lote = chaves[inicio:inicio + batch_size]
+                    cursor.execute(
+                        f"DELETE FROM `{tabela}` WHERE {COLUNA_CHAVE} IN ({', '.join(['%s'] * len(lote))})", lote
+                    )
+        n = bulk_load(connection, tabela, novos, metodo=metodo, batch_size=batch_size, confirmar=False)
+        if confirmar:
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return n
@@ -0,0 +1,104 @@
+import atexit
+import contextlib
+import functools
+import logging
+import queue
+import threading
+import time
+
+from airflow.providers.mysql.hooks.mysql import MySqlHook
+
+logger = logging.getLogger(__name__)
+
+CONN_ID = 'local_mariadb'
+
+# Conexões simultâneas por pool (threads além disso aguardam uma conexão ser devolvida). O modo streaming da gold
+# ocupa uma conexão por saída e mais uma para o cadastro das dimensões
+TAMANHO_POOL = 8
+
+# Conexões ociosas há mais tempo que isso são verificadas com ping antes de serem reutilizadas
+VERIFICAR_APOS_SEGUNDOS = 30
+
+
+class PoolConexoes:
+    """
+    Pool de conexões do MariaDB por processo worker. As conexões devolvidas ficam abertas e são reutilizadas pelas
+    próximas tarefas e iterações, evitando o handshake e a autenticação a cada MySqlHook.get_conn().
+    """
+
+    def __init__(self, conn_id=CONN_ID, tamanho=TAMANHO_POOL):
+        self.conn_id = conn_id
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+
+    def _nova(self):
+        logging.info(f"Abrindo nova conexão com '{self.conn_id}'")
+        return MySqlHook(mysql_conn_id=self.conn_id).get_conn()
+
+    def _reutilizavel(self):
+        """Conexão livre mais recente que ainda responde, ou None."""
+        while True:
+            try:
+                connection, devolvida_em = self._livres.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - devolvida_em < VERIFICAR_APOS_SEGUNDOS:
+                return connection
+            try:
+                connection.ping()
+                return connection
+            except Exception as e:
+                logging.warning(f"Conexão ociosa com '{self.conn_id}' descartada: {e}")
+                _fechar(connection)
+
+    @contextlib.contextmanager
+    def conexao(self):
+        """
+        Empresta uma conexão do pool. Se o bloco falhar, a transação pendente é desfeita antes da devolução; uma conexão
+        que não aceita o rollback é descartada.
+        """
+        self._vagas.acquire()
+        connection = None
+        try:
+            connection = self._reutilizavel() or self._nova()
+            yield connection
+        except Exception:
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except Exception:
+                    _fechar(connection)
+                    connection = None
+            raise
+        finally:
+            if connection is not None:
+                self._livres.put((connection, time.monotonic()))
+            self._vagas.release()
+
+    def fechar(self):
+        while True:
+            try:
+                connection, _ = self._livres.get_nowait()
+            except queue.Empty:
+                return
+            _fechar(connection)
+
+
+def _fechar(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def get_pool(conn_id=CONN_ID):
+    """Pool compartilhado por todas as tarefas e threads do processo worker."""
+    pool = PoolConexoes(conn_id)
+    atexit.register(pool.fechar)
+    return pool
+
+
+def conexao(conn_id=CONN_ID):
+    """Atalho para get_pool(conn_id).conexao()."""
+    return get_pool(conn_id).conexao()
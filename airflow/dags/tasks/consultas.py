@@ -0,0 +1,260 @@
+"""
+Consultas analíticas (DuckDB) sobre os datasets das camadas silver e gold no MinIO, sem passar pelo MariaDB.
+
+Cada dataset com manifesto (ex.: gold/gld_acordos/_manifest.json) vira uma tabela com o nome do dataset
+(gld_acordos, slv_acordos, ...), apontando para os arquivos do snapshot atual ou do indicado por `snapshot`. As
+tabelas são datasets do pyarrow sobre o S3ObjectReader, então o DuckDB empurra projeções e filtros para a leitura:
+
+    - arquivos inteiros são descartados pelo intervalo da coluna de partição registrado no manifesto;
+    - row groups são descartados pelas estatísticas de min/max de cada arquivo;
+    - apenas os column chunks das colunas usadas são baixados, por GETs com Range.
+
+Os metadados (manifesto, tamanho e rodapé parquet de cada arquivo) ficam em cache no objeto Consultas e só são
+recarregados quando o ETag do manifesto muda, verificado com um HEAD a cada VALIDADE_METADADOS segundos.
+
+Uso (a partir de airflow/dags):
+    python -m tasks.consultas --tabelas
+    python -m tasks.consultas "SELECT ano, sum(acordos) FROM gld_contagens WHERE continente = 'Europa' GROUP BY ano"
+    python -m tasks.consultas --snapshot 2024-05-01 --formato csv "SELECT * FROM slv_acordos WHERE ano >= 2020"
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from tasks.snapshots import MANIFESTO, ler_manifesto, manifest_key, resolver_snapshot
+from tasks.storage import S3ObjectReader, get_client, head, list_level
+
+logger = logging.getLogger(__name__)
+
+# Camadas consultáveis: bucket de cada uma (os datasets são descobertos pelos manifestos do bucket)
+BUCKETS_CONSULTA = ['silver', 'gold']
+
+# Níveis de prefixo em que os datasets são procurados (ex.: o prefixo gold/gld_acordos/ do dataset tem 2 níveis)
+PROFUNDIDADE_DATASETS = 3
+
+# Intervalo em que os metadados em cache são usados sem verificar se o manifesto mudou
+VALIDADE_METADADOS = 60
+
+# Rodapés parquet lidos em paralelo ao carregar os metadados de um snapshot
+MAX_LEITURAS_PARALELAS = 8
+
+_FORMATO = ds.ParquetFileFormat()
+
+
+def _expressao_particao(particao, arquivo):
+    # Garantia sobre as linhas do arquivo a partir do intervalo do manifesto, usada pelo pyarrow para descartar o
+    # arquivo inteiro. Arquivos gravados em lotes podem ter nulos além do intervalo
+    coluna = pc.field(particao)
+    if arquivo['min'] is None:
+        return coluna.is_null()
+    return ((coluna >= arquivo['min']) & (coluna <= arquivo['max'])) | coluna.is_null()
+
+
+def _fragmento(minio_client, bucket_name, particao, arquivo):
+    reader = S3ObjectReader(minio_client, bucket_name, arquivo['key'])
+    expressao = _expressao_particao(particao, arquivo) if particao else None
+    fragmento = _FORMATO.make_fragment(pa.PythonFile(reader, mode='r'), partition_expression=expressao)
+    # Rodapé e estatísticas dos row groups ficam no fragmento: as consultas seguintes não os leem de novo
+    fragmento.ensure_complete_metadata()
+    return reader, fragmento
+
+
+class TabelaSnapshot:
+    """Metadados em cache de um snapshot: o dataset do pyarrow registrado no DuckDB e os leitores dos arquivos."""
+
+    def __init__(self, minio_client, bucket_name, key, etag, entrada, max_workers=MAX_LEITURAS_PARALELAS):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.etag = etag
+        self.snapshot_id = entrada['id']
+        self.linhas = entrada['linhas']
+        particao = entrada.get('particao')
+        arquivos = entrada['arquivos']
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(arquivos)))) as executor:
+            lidos = list(executor.map(lambda a: _fragmento(minio_client, bucket_name, particao, a), arquivos))
+        self.readers = [reader for reader, _ in lidos]
+        fragmentos = [fragmento for _, fragmento in lidos]
+        schema = pa.unify_schemas([f.physical_schema for f in fragmentos], promote_options='permissive')
+        self.dataset = ds.FileSystemDataset(fragmentos, schema, _FORMATO)
+
+    @property
+    def bytes_lidos(self):
+        return sum(reader.bytes_lidos for reader in self.readers)
+
+
+def nome_tabela(key):
+    """Nome da tabela de um dataset (silver/slv_acordos.parquet -> slv_acordos)."""
+    nome = key.rsplit('/', 1)[-1]
+    return nome[:-len('.parquet')] if nome.endswith('.parquet') else nome
+
+
+def listar_datasets(minio_client, bucket_name, profundidade=PROFUNDIDADE_DATASETS):
+    """
+    Chaves lógicas (ex.: gold/gld_acordos.parquet) dos datasets com manifesto no bucket. Percorre os prefixos nível a
+    nível (Delimiter='/'), sem descer nos datasets encontrados nem nas pastas de partição/snapshot (`nome=valor`), de
+    modo que o custo acompanha o número de prefixos e não o de arquivos de snapshot no bucket.
+    """
+    datasets, nivel = [], ['']
+    for _ in range(profundidade + 1):
+        proximo = []
+        for prefixo in nivel:
+            chaves, subprefixos = list_level(minio_client, bucket_name, prefixo)
+            if prefixo and f'{prefixo}{MANIFESTO}' in chaves:
+                datasets.append(prefixo[:-1] + '.parquet')
+                continue
+            proximo.extend(p for p in subprefixos if '=' not in p[len(prefixo):])
+        nivel = proximo
+    return sorted(datasets)
+
+
+class Consultas:
+    """
+    Conexão DuckDB em memória com os datasets de `buckets` registrados como tabelas. Com `snapshot` (id ou data
+    AAAA-MM-DD, ver snapshots.resolver_snapshot), as tabelas mostram os dados daquele snapshot em vez do atual.
+
+        consultas = Consultas(get_client(endpoint_url, access_key, secret_key))
+        df = consultas.consultar("SELECT tipo_de_acordo, count(*) FROM gld_acordos WHERE ano = ? GROUP BY 1", [2023])
+
+    Uma instância pode ser usada por várias threads: a atualização dos metadados é serializada e cada consulta usa o
+    seu próprio cursor, com as tabelas registradas nele.
+    """
+
+    def __init__(self, minio_client, buckets=None, snapshot=None, validade=VALIDADE_METADADOS):
+        self.minio_client = minio_client
+        self.buckets = list(buckets or BUCKETS_CONSULTA)
+        self.snapshot = snapshot
+        self.validade = validade
+        self.conexao = duckdb.connect()
+        self._tabelas = {}
+        self._verificado_em = None
+        self._lock = threading.Lock()
+
+    def _carregar(self, bucket_name, key):
+        # Tabela do dataset, reaproveitada enquanto o ETag do manifesto não mudar. None se não houver o que consultar
+        nome = nome_tabela(key)
+        atual = self._tabelas.get(nome)
+        cabecalho = head(self.minio_client, bucket_name, manifest_key(key))
+        if cabecalho is None:
+            return None
+        if atual is not None and atual.bucket_name == bucket_name and atual.etag == cabecalho['ETag']:
+            return atual
+        lido = ler_manifesto(self.minio_client, bucket_name, key)
+        if lido is None:
+            return None
+        manifesto, etag, _ = lido
+        try:
+            entrada = resolver_snapshot(manifesto, self.snapshot)
+        except FileNotFoundError as e:
+            logging.warning(f"Dataset '{bucket_name}/{key}' ignorado: {e}")
+            return None
+        if not entrada['arquivos']:
+            logging.warning(f"Dataset '{bucket_name}/{key}' ignorado: snapshot {entrada['id']} sem arquivos")
+            return None
+        if atual is not None and atual.bucket_name == bucket_name and atual.snapshot_id == entrada['id']:
+            atual.etag = etag
+            return atual
+        inicio = time.perf_counter()
+        tabela = TabelaSnapshot(self.minio_client, bucket_name, key, etag, entrada)
+        logging.info(f"Tabela '{nome}' carregada do snapshot {tabela.snapshot_id} de '{bucket_name}/{key}' "
+                     f"({len(entrada['arquivos'])} arquivos, {tabela.linhas} linhas, "
+                     f"{time.perf_counter() - inicio:.2f} s)")
+        return tabela
+
+    def atualizar(self, forcar=False):
+        """
+        Descobre os datasets e recarrega os metadados das tabelas cujo manifesto mudou. Dentro da validade dos
+        metadados não faz nenhuma requisição, a menos que `forcar`.
+        """
+        with self._lock:
+            if not forcar and self._verificado_em is not None and \
+                    time.monotonic() - self._verificado_em < self.validade:
+                return
+            tabelas = {}
+            for bucket_name in self.buckets:
+                for key in listar_datasets(self.minio_client, bucket_name):
+                    nome = nome_tabela(key)
+                    if nome in tabelas:
+                        logging.warning(f"Tabela '{nome}' já registrada a partir de '{tabelas[nome].bucket_name}'; "
+                                        f"'{bucket_name}/{key}' ignorado")
+                        continue
+                    tabela = self._carregar(bucket_name, key)
+                    if tabela is not None:
+                        tabelas[nome] = tabela
+            self._tabelas = tabelas
+            self._verificado_em = time.monotonic()
+
+    def tabelas(self):
+        """Tabelas registradas: nome, bucket, chave do dataset, snapshot e linhas."""
+        self.atualizar()
+        return [
+            {'tabela': nome, 'bucket': t.bucket_name, 'dataset': t.key, 'snapshot': t.snapshot_id, 'linhas': t.linhas}
+            for nome, t in sorted(self._tabelas.items())
+        ]
+
+    def consultar(self, sql, parametros=None):
+        """Executa a consulta SQL (dialeto do DuckDB) e retorna o resultado como DataFrame."""
+        self.atualizar()
+        tabelas = self._tabelas
+        bytes_antes = sum(t.bytes_lidos for t in tabelas.values())
+        inicio = time.perf_counter()
+        # Registrar um dataset no cursor não lê nada: os metadados já estão nos fragmentos
+        with self.conexao.cursor() as cursor:
+            for nome, tabela in tabelas.items():
+                cursor.register(nome, tabela.dataset)
+            df = cursor.execute(sql, parametros).df()
+        lidos = sum(t.bytes_lidos for t in tabelas.values()) - bytes_antes
+        logging.info(f"Consulta executada em {time.perf_counter() - inicio:.3f} s ({len(df)} linhas, "
+                     f"{lidos} bytes lidos do MinIO)")
+        return df
+
+    def fechar(self):
+        self.conexao.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('sql', nargs='?', help='Consulta SQL (dialeto do DuckDB)')
+    parser.add_argument('--tabelas', action='store_true', help='Lista as tabelas disponíveis')
+    parser.add_argument('--snapshot', help='Id do snapshot ou data de execução (AAAA-MM-DD) a consultar')
+    parser.add_argument('--buckets', nargs='+', default=BUCKETS_CONSULTA)
+    parser.add_argument('--formato', choices=['tabela', 'csv', 'json'], default='tabela')
+    parser.add_argument('--endpoint-url', default=os.environ.get('MINIO_ENDPOINT', 'http://localhost:9000'))
+    parser.add_argument('--access-key', default=os.environ.get('MINIO_ACCESS_KEY'))
+    parser.add_argument('--secret-key', default=os.environ.get('MINIO_SECRET_KEY'))
+    args = parser.parse_args(argv)
+    if not args.sql and not args.tabelas:
+        parser.error('informe uma consulta SQL ou --tabelas')
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    minio_client = get_client(args.endpoint_url, args.access_key, args.secret_key)
+    with Consultas(minio_client, buckets=args.buckets, snapshot=args.snapshot) as consultas:
+        df = consultas.consultar(args.sql) if args.sql else pd.DataFrame(consultas.tabelas())
+    if args.formato == 'csv':
+        df.to_csv(sys.stdout, index=False)
+    elif args.formato == 'json':
+        df.to_json(sys.stdout, orient='records', force_ascii=False, date_format='iso')
+        sys.stdout.write('\n')
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
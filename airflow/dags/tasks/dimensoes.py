@@ -0,0 +1,145 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Colunas de baixa cardinalidade: Categorical no pandas, dictionary encoding no parquet e tabelas de lookup
+# (dim_<coluna>) com chave inteira no MariaDB
+DIMENSOES = ['tipo_de_parceiro', 'continente', 'região', 'tipo_de_acordo', 'recursos', 'tipo_de_documento']
+
+CREATE_TABLE_DIMENSAO_SQL = """
+CREATE TABLE IF NOT EXISTS `dim_{coluna}` (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    valor VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+    UNIQUE KEY uk_valor (valor)
+)
+"""
+
+# Cache de chaves por processo worker: {coluna: {valor: id}}. As tabelas de lookup só recebem inserções, então um id
+# conhecido nunca muda; apenas valores novos vão ao banco.
+_CACHE_CHAVES = {}
+
+
+def coluna_chave(coluna):
+    return f'id_{coluna}'
+
+
+def como_categorias(df, colunas=None):
+    """Converte as colunas de dimensão presentes no DataFrame para Categorical."""
+    colunas = DIMENSOES if colunas is None else colunas
+    colunas = [c for c in colunas if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if colunas:
+        df = df.assign(**{c: df[c].astype('category') for c in colunas})
+    return df
+
+
+def garantir_dimensoes(connection, colunas=None):
+    """Cria as tabelas de lookup das dimensões, se não existirem."""
+    with connection.cursor() as cursor:
+        for coluna in DIMENSOES if colunas is None else colunas:
+            cursor.execute(CREATE_TABLE_DIMENSAO_SQL.format(coluna=coluna))
+
+
+def migrar_tabela(connection, tabela, colunas=None):
+    """
+    Migra tabelas criadas antes da normalização: troca as colunas VARCHAR de dimensão por `id_<coluna>` com chave
+    estrangeira para dim_<coluna>, preservando os dados. A coluna de chave é acrescentada, os valores distintos da
+    coluna antiga são cadastrados na tabela de lookup, as chaves são preenchidas pela junção com ela e só então a
+    coluna antiga é removida, para que tabelas não recarregadas por inteiro (cargas incrementais, upsert ou saídas
+    já em dia) não percam as dimensões. Tabelas já migradas não recebem nenhum ALTER. Retorna True se a tabela foi
+    alterada.
+    """
+    alterada = False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (tabela,)
+        )
+        existentes = {linha[0] for linha in cursor.fetchall()}
+        for coluna in DIMENSOES if colunas is None else colunas:
+            chave = coluna_chave(coluna)
+            if chave not in existentes:
+                cursor.execute(
+                    f"ALTER TABLE `{tabela}` ADD COLUMN `{chave}` INT, "
+                    f"ADD CONSTRAINT `fk_{tabela}_{coluna}` FOREIGN KEY (`{chave}`) REFERENCES `dim_{coluna}` (id)"
+                )
+                alterada = True
+            if coluna in existentes:
+                cursor.execute(f"INSERT IGNORE INTO `dim_{coluna}` (valor) "
+                               f"SELECT DISTINCT `{coluna}` FROM `{tabela}` WHERE `{coluna}` IS NOT NULL")
+                cursor.execute(f"UPDATE `{tabela}` t JOIN `dim_{coluna}` d ON d.valor = t.`{coluna}` "
+                               f"SET t.`{chave}` = d.id")
+                connection.commit()
+                cursor.execute(f"ALTER TABLE `{tabela}` DROP COLUMN `{coluna}`")
+                logging.info(f"Tabela {tabela} migrada: coluna {coluna} substituída por {chave}")
+                alterada = True
+    return alterada
+
+
+def criar_view(connection, tabela, colunas, view=None):
+    """
+    Cria a view vw_<tabela> com as colunas originais, resolvendo as chaves de dimensão de volta para o texto, para
+    consultas e dashboards que usavam as colunas VARCHAR.
+    """
+    view = view or f'vw_{tabela}'
+    selecao, joins = [], []
+    for coluna in colunas:
+        if coluna in DIMENSOES:
+            selecao.append(f"`d_{coluna}`.valor AS `{coluna}`")
+            joins.append(f"LEFT JOIN `dim_{coluna}` `d_{coluna}` ON `d_{coluna}`.id = t.`{coluna_chave(coluna)}`")
+        else:
+            selecao.append(f"t.`{coluna}`")
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE OR REPLACE VIEW `{view}` AS SELECT {', '.join(selecao)} FROM `{tabela}` t {' '.join(joins)}")
+
+
+def _consultar_chaves(cursor, coluna, valores):
+    encontrados = {}
+    for inicio in range(0, len(valores), 1000):
+        lote = valores[inicio:inicio + 1000]
+        cursor.execute(
+            f"SELECT id, valor FROM `dim_{coluna}` WHERE valor IN ({', '.join(['%s'] * len(lote))})", lote
+        )
+        encontrados.update({valor: id_ for id_, valor in cursor.fetchall()})
+    return encontrados
+
+
+def resolver_chaves(connection, coluna, valores):
+    """
+    Retorna {valor: id} para os valores informados, consultando o banco apenas para os que não estão no cache e
+    inserindo na tabela de lookup os que ainda não existem.
+    """
+    cache = _CACHE_CHAVES.setdefault(coluna, {})
+    faltantes = [v for v in dict.fromkeys(valores) if v not in cache]
+    if faltantes:
+        with connection.cursor() as cursor:
+            encontrados = _consultar_chaves(cursor, coluna, faltantes)
+            novos = [v for v in faltantes if v not in encontrados]
+            if novos:
+                cursor.executemany(f"INSERT IGNORE INTO `dim_{coluna}` (valor) VALUES (%s)", [(v,) for v in novos])
+                connection.commit()
+                encontrados.update(_consultar_chaves(cursor, coluna, novos))
+                logging.info(f"{len(novos)} novos valores cadastrados em dim_{coluna}")
+        cache.update(encontrados)
+    return {v: cache[v] for v in valores}
+
+
+def substituir_por_chaves(connection, df, colunas=None):
+    """
+    Troca as colunas de dimensão do DataFrame por `id_<coluna>`, na mesma posição. A resolução é feita sobre as
+    categorias distintas e aplicada às linhas pelos códigos do Categorical.
+    """
+    df = como_categorias(df, colunas)
+    substituicoes = {}
+    for coluna in DIMENSOES if colunas is None else colunas:
+        if coluna not in df.columns:
+            continue
+        categorias = df[coluna].cat.categories
+        chaves = resolver_chaves(connection, coluna, [str(v) for v in categorias])
+        ids = np.array([chaves[str(v)] for v in categorias] + [None], dtype=object)
+        # Código -1 (nulo) aponta para o último elemento, None
+        substituicoes[coluna] = pd.Series(ids[df[coluna].cat.codes.to_numpy()], index=df.index, dtype=object)
+    df = df.assign(**substituicoes)
+    return df.rename(columns={c: coluna_chave(c) for c in substituicoes})
@@ -0,0 +1,110 @@
+import logging
+import re
+import threading
+
+from tasks.dimensoes import garantir_dimensoes, migrar_tabela, criar_view
+from tasks.metricas import ETAPA_DDL, etapa
+
+logger = logging.getLogger(__name__)
+
+# Registro de esquema por processo worker: objetos já verificados/criados não recebem nova DDL nem consulta ao
+# information_schema, evitando os metadata locks de CREATE/ALTER repetidos quando várias tarefas rodam juntas
+_VERIFICADOS = set()
+_LOCK = threading.Lock()
+
+# DDL e dimensões registradas de cada tabela ({tabela: (ddl, dimensoes)}), usadas para criar stagings com as mesmas
+# chaves estrangeiras da tabela publicada (ver ddl_staging)
+_DDL = {}
+
+
+def uma_vez(chave, funcao, *args, **kwargs):
+    """Executa funcao(*args, **kwargs) apenas na primeira chamada com `chave` neste processo."""
+    if chave in _VERIFICADOS:
+        return False
+    with _LOCK:
+        if chave in _VERIFICADOS:
+            return False
+        funcao(*args, **kwargs)
+        _VERIFICADOS.add(chave)
+    return True
+
+
+def invalidar(chave=None):
+    """Esquece um objeto verificado (ou todos), forçando nova verificação na próxima chamada."""
+    with _LOCK:
+        if chave is None:
+            _VERIFICADOS.clear()
+        else:
+            _VERIFICADOS.discard(chave)
+
+
+def objetos_existentes(connection, nomes):
+    """Tabelas e views de `nomes` que existem no banco atual, em uma única consulta."""
+    if not nomes:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+            f"AND TABLE_NAME IN ({', '.join(['%s'] * len(nomes))})",
+            list(nomes)
+        )
+        return {linha[0] for linha in cursor.fetchall()}
+
+
+def colunas_tabela(connection, tabela):
+    """Colunas da tabela no banco atual."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (tabela,)
+        )
+        return {linha[0] for linha in cursor.fetchall()}
+
+
+def ddl_staging(tabela, staging):
+    """
+    DDL registrada da `tabela` (ver garantir_tabela) reescrita para criar a tabela `staging`, e as dimensões da tabela;
+    None se a tabela não foi registrada neste processo. Os nomes das restrições são omitidos: nomes de chave
+    estrangeira são únicos no banco e os da tabela publicada já estão em uso. O InnoDB gera então nomes da própria
+    staging (<staging>_ibfk_N), que o RENAME TABLE acompanha ao trocá-la pela tabela publicada.
+    """
+    registrada = _DDL.get(tabela)
+    if registrada is None:
+        return None
+    ddl, dimensoes = registrada
+    ddl, n = re.subn(rf'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?{re.escape(tabela)}`?(?=[\s(])',
+                     f'CREATE TABLE `{staging}`', ddl, count=1, flags=re.I)
+    if n == 0:
+        return None
+    return re.sub(r'CONSTRAINT\s+`?\w+`?\s+(?=FOREIGN\s+KEY)', '', ddl, flags=re.I), dimensoes
+
+
+def _verificar_tabela(connection, tabela, ddl, dimensoes, colunas_view):
+    view = f'vw_{tabela}'
+    tabelas_dim = {coluna: f'dim_{coluna}' for coluna in dimensoes}
+    existentes = objetos_existentes(connection, [tabela, view] + list(tabelas_dim.values()))
+
+    faltantes = [coluna for coluna, dim in tabelas_dim.items() if dim not in existentes]
+    if faltantes:
+        garantir_dimensoes(connection, faltantes)
+    alterada = tabela not in existentes
+    if alterada:
+        with connection.cursor() as cursor:
+            cursor.execute(ddl)
+        logging.info(f"Tabela {tabela} criada no MariaDB")
+    if dimensoes:
+        alterada = migrar_tabela(connection, tabela, dimensoes) or alterada
+        if colunas_view is not None and (alterada or view not in existentes):
+            criar_view(connection, tabela, colunas_view, view)
+
+
+def garantir_tabela(connection, tabela, ddl, dimensoes=(), colunas_view=None):
+    """
+    Garante, uma vez por processo worker, a tabela e o que ela usa: as tabelas de lookup das `dimensoes`, a migração
+    das colunas de dimensão para chaves e a view vw_<tabela> com `colunas_view`. A existência de todos os objetos é
+    consultada de uma vez no information_schema e só os que faltam recebem DDL. A `ddl` fica registrada para as
+    stagings da tabela (ver ddl_staging). Retorna True na primeira verificação.
+    """
+    _DDL[tabela] = (ddl, list(dimensoes))
+    with etapa(ETAPA_DDL):
+        return uma_vez(('tabela', tabela), _verificar_tabela, connection, tabela, ddl, list(dimensoes), colunas_view)
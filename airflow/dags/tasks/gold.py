@@ -1,201 +1,487 @@
-import boto3
+import contextlib
+import functools
 import pandas as pd
-import io
 import logging
-from airflow.providers.mysql.hooks.mysql import MySqlHook
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+from tasks.loader import DEFAULT_BATCH_SIZE
+from tasks.publicacao import EtapaPublicacao, PublicacaoEmLotes, TransacaoPendente, desfazer_envio, validar_modo
+from tasks.storage import get_client
+from tasks.snapshots import (EscritorSnapshot, descartar_snapshot, gravar_snapshot, manifest_key, publicar_snapshot,
+                             referencia, read_snapshot, iter_snapshot, snapshot_atual)
+from tasks.agregados import aplicar_contagens, atualizar, contar, ler_membros, membros, somar, write_membros
+from tasks.cdc import (COLUNA_CHAVE, ContadorHashes, delta_key, deduplicar, ler_delta, ler_base, mesclar,
+                       aplicar_delta_tabela, validar_streaming)
+from tasks.cache import STATUS_EM_DIA, versao_codigo, linhagem, em_dia
+from tasks.dimensoes import DIMENSOES, como_categorias, substituir_por_chaves
+from tasks.conexoes import TAMANHO_POOL, conexao
+from tasks.esquema import garantir_tabela
+from tasks.metricas import ETAPA_TRANSFORMACAO, ETAPA_CARGA_DB, etapa, instrumentar
+from tasks.motores import MOTOR_PADRAO, get_motor
+
 logger = logging.getLogger(__name__)
 
-def transform_and_load_gold(bucket_name, key, endpoint_url, access_key, secret_key, bucket3_name='gold'):
+COLUNAS_ACORDOS = ['parceiro', 'tipo_de_parceiro', 'continente', 'região', 'local_de_assinatura', 'tipo_de_acordo',
+                   'título', 'objetivo', 'recursos', 'tipo_de_documento', 'ano']
+COLUNAS_HIER = ['continente', 'região', 'local_de_assinatura', 'tipo_de_acordo', 'recursos', 'tipo_de_parceiro']
+
+# Colunas agrupadas pelos rollups: contagem de acordos para os dashboards e dimensão hierárquica dos locais
+COLUNAS_CONTAGENS = ['ano', 'continente', 'região', 'tipo_de_acordo', 'tipo_de_parceiro']
+COLUNAS_LOCAL = ['continente', 'região', 'local_de_assinatura']
+
+CREATE_TABLE_ACORDOS_SQL = """
+CREATE TABLE IF NOT EXISTS gld_acordos (
+    cod_acordo INT PRIMARY KEY AUTO_INCREMENT,
+    parceiro VARCHAR(255),
+    id_tipo_de_parceiro INT,
+    id_continente INT,
+    id_região INT,
+    local_de_assinatura VARCHAR(255),
+    id_tipo_de_acordo INT,
+    título TEXT,
+    objetivo TEXT,
+    id_recursos INT,
+    id_tipo_de_documento INT,
+    ano VARCHAR(255),
+    CONSTRAINT fk_gld_acordos_tipo_de_parceiro FOREIGN KEY (id_tipo_de_parceiro) REFERENCES dim_tipo_de_parceiro (id),
+    CONSTRAINT fk_gld_acordos_continente FOREIGN KEY (id_continente) REFERENCES dim_continente (id),
+    CONSTRAINT fk_gld_acordos_região FOREIGN KEY (id_região) REFERENCES dim_região (id),
+    CONSTRAINT fk_gld_acordos_tipo_de_acordo FOREIGN KEY (id_tipo_de_acordo) REFERENCES dim_tipo_de_acordo (id),
+    CONSTRAINT fk_gld_acordos_recursos FOREIGN KEY (id_recursos) REFERENCES dim_recursos (id),
+    CONSTRAINT fk_gld_acordos_tipo_de_documento FOREIGN KEY (id_tipo_de_documento) REFERENCES dim_tipo_de_documento (id)
+)
+"""
+
+CREATE_TABLE_LOCAL_SQL = """
+CREATE TABLE IF NOT EXISTS {tabela} (
+    cod_local INT PRIMARY KEY AUTO_INCREMENT,
+    local_completo VARCHAR(255),
+    acordo_recurso VARCHAR(255)
+)
+"""
+
+
+# Rollups: a chave `_grupo` é o hash dos valores agrupados (estável entre cargas, usada no upsert incremental) e os
+# índices cobrem os filtros mais comuns dos dashboards
+CREATE_TABLE_CONTAGENS_SQL = """
+CREATE TABLE IF NOT EXISTS gld_contagens (
+    _grupo BIGINT UNSIGNED PRIMARY KEY,
+    ano INT,
+    id_continente INT,
+    id_região INT,
+    id_tipo_de_acordo INT,
+    id_tipo_de_parceiro INT,
+    acordos INT NOT NULL,
+    INDEX idx_gld_contagens_ano (ano),
+    INDEX idx_gld_contagens_local (id_continente, id_região, ano),
+    INDEX idx_gld_contagens_acordo (id_tipo_de_acordo, ano),
+    INDEX idx_gld_contagens_parceiro (id_tipo_de_parceiro, ano),
+    CONSTRAINT fk_gld_contagens_continente FOREIGN KEY (id_continente) REFERENCES dim_continente (id),
+    CONSTRAINT fk_gld_contagens_região FOREIGN KEY (id_região) REFERENCES dim_região (id),
+    CONSTRAINT fk_gld_contagens_tipo_de_acordo FOREIGN KEY (id_tipo_de_acordo) REFERENCES dim_tipo_de_acordo (id),
+    CONSTRAINT fk_gld_contagens_tipo_de_parceiro FOREIGN KEY (id_tipo_de_parceiro) REFERENCES dim_tipo_de_parceiro (id)
+)
+"""
+
+# Dimensão hierárquica continente > região > local: uma linha por local, com a chave de cada nível (id_continente e
+# id_região nas tabelas de lookup, `_grupo` para o local)
+CREATE_TABLE_DIM_LOCAL_SQL = """
+CREATE TABLE IF NOT EXISTS gld_dim_local (
+    _grupo BIGINT UNSIGNED PRIMARY KEY,
+    id_continente INT,
+    id_região INT,
+    local_de_assinatura VARCHAR(255),
+    acordos INT NOT NULL,
+    local_completo VARCHAR(255),
+    INDEX idx_gld_dim_local_regiao (id_continente, id_região),
+    INDEX idx_gld_dim_local_local (local_de_assinatura),
+    CONSTRAINT fk_gld_dim_local_continente FOREIGN KEY (id_continente) REFERENCES dim_continente (id),
+    CONSTRAINT fk_gld_dim_local_região FOREIGN KEY (id_região) REFERENCES dim_região (id)
+)
+"""
+
+
+def _hierarquia(df, motor):
+    # Criação de dimensões hierárquicas (colunas categóricas da silver são concatenadas como texto)
+    df_hier = pd.DataFrame(index=df.index)
+    df_hier['local_completo'] = motor.concatenar(df, ['continente', 'região', 'local_de_assinatura'], ' > ')
+    df_hier['acordo_recurso'] = motor.concatenar(df, ['tipo_de_acordo', 'recursos'], ' - ')
+    return df_hier
+
+
+def build_gld_acordos(df, motor=None):
+    return (motor or get_motor()).sem_duplicadas(df[COLUNAS_ACORDOS])
+
+
+def build_gld_hier(df, motor=None):
+    return _hierarquia(df, motor or get_motor())
+
+
+def build_gld_pais(df, motor=None):
+    # Acordos cujo parceiro é um país
+    motor = motor or get_motor()
+    return _hierarquia(motor.filtrar(df, 'tipo_de_parceiro', 'País'), motor)
+
+
+def build_gld_org(df, motor=None):
+    # Acordos cujo parceiro é uma organização
+    motor = motor or get_motor()
+    return _hierarquia(motor.filtrar(df, 'tipo_de_parceiro', 'Organização'), motor)
+
+
+def build_gld_contagens(df, motor=None):
+    # Número de acordos por ano, continente, região, tipo de acordo e tipo de parceiro
+    return contar(df, COLUNAS_CONTAGENS)
+
+
+def _local_completo(locais, motor=None):
+    motor = motor or get_motor()
+    return locais.assign(local_completo=motor.concatenar(locais, COLUNAS_LOCAL, ' > '))
+
+
+def build_gld_dim_local(df, motor=None):
+    return _local_completo(contar(df, COLUNAS_LOCAL), motor)
+
+
+# Saídas da camada gold: função de construção, DDL da tabela no MariaDB, colunas da silver necessárias, filtros
+# empurrados para a leitura do parquet e, com 'unico', se a saída não tem linhas repetidas (no modo streaming, a
+# deduplicação passa a valer entre os lotes). Rollups informam as colunas agrupadas em 'grupos' (e, em 'derivar', as
+# colunas calculadas sobre os grupos): no modo incremental são atualizados pelas contagens das linhas alteradas
+GOLD_TARGETS = {
+    'gld_acordos': {
+        'build': build_gld_acordos,
+        'ddl': CREATE_TABLE_ACORDOS_SQL,
+        'columns': COLUNAS_ACORDOS,
+        'filters': None,
+        'unico': True,
+    },
+    'gld_hier': {
+        'build': build_gld_hier,
+        'ddl': CREATE_TABLE_LOCAL_SQL.format(tabela='gld_hier'),
+        'columns': COLUNAS_HIER,
+        'filters': None,
+    },
+    'gld_pais': {
+        'build': build_gld_pais,
+        'ddl': CREATE_TABLE_LOCAL_SQL.format(tabela='gld_pais'),
+        'columns': COLUNAS_HIER,
+        'filters': [('tipo_de_parceiro', '==', 'País')],
+    },
+    'gld_org': {
+        'build': build_gld_org,
+        'ddl': CREATE_TABLE_LOCAL_SQL.format(tabela='gld_org'),
+        'columns': COLUNAS_HIER,
+        'filters': [('tipo_de_parceiro', '==', 'Organização')],
+    },
+    'gld_contagens': {
+        'build': build_gld_contagens,
+        'ddl': CREATE_TABLE_CONTAGENS_SQL,
+        'columns': COLUNAS_CONTAGENS,
+        'filters': None,
+        'grupos': COLUNAS_CONTAGENS,
+    },
+    'gld_dim_local': {
+        'build': build_gld_dim_local,
+        'ddl': CREATE_TABLE_DIM_LOCAL_SQL,
+        'columns': COLUNAS_LOCAL,
+        'filters': None,
+        'grupos': COLUNAS_LOCAL,
+        'derivar': _local_completo,
+    },
+}
+
+
+def _projecao(targets):
+    """
+    Colunas e filtros da leitura compartilhada pelas saídas selecionadas: a união das colunas e, quando todas usam o
+    mesmo filtro, esse filtro (caso contrário a leitura não é filtrada).
+    """
+    columns = list(dict.fromkeys(c for t in targets for c in GOLD_TARGETS[t]['columns']))
+    filters = [GOLD_TARGETS[t]['filters'] for t in targets]
+    return columns, (filters[0] if all(f == filters[0] for f in filters) else None)
+
+
+def _colunas_view(gld_name, colunas):
+    # Colunas da view vw_<tabela>: a chave da tabela (cod_acordo ou, nos rollups, o próprio _grupo) e as da saída
+    colunas = [c for c in colunas if c != COLUNA_CHAVE]
+    return colunas if GOLD_TARGETS[gld_name].get('grupos') else ['cod_acordo'] + colunas
+
+
+def _rollup(alvo, parciais, motor):
+    rollup = somar(parciais, alvo['grupos'])
+    return alvo['derivar'](rollup, motor) if alvo.get('derivar') else rollup
+
+
+def _gold_em_lotes(minio_client, bucket_name, key, bucket3_name, pendentes, columns, filters, metadata, origem,
+                   load_method, batch_size, publish_mode, motor):
+    """
+    Modo streaming da camada gold: uma única leitura da silver em lotes alimenta todas as saídas pendentes; cada lote
+    é construído, enviado à staging do MariaDB e ao snapshot de cada saída antes do próximo. Rollups acumulam apenas
+    as contagens parciais de cada lote e são enviados inteiros ao final. As saídas só são publicadas depois do último
+    lote: cada tabela logo depois da troca do manifesto do seu snapshot, que é desfeita se ela falhar.
+
+    Cada saída usa uma conexão própria, para que a confirmação (ou o rollback) de uma não confirme nem desfaça as
+    cargas das outras no modo upsert. As tabelas são todas criadas antes da primeira carga, já que o DDL confirma a
+    transação aberta; os valores novos das dimensões são cadastrados em outra conexão, que confirma só o cadastro.
+    """
+    if len(pendentes) + 1 > TAMANHO_POOL:
+        raise ValueError(f"O modo streaming da gold usa uma conexão por saída e mais uma para as dimensões: "
+                         f"{len(pendentes)} saídas excedem o pool de {TAMANHO_POOL} conexões")
+    with contextlib.ExitStack() as pilha:
+        cadastro = pilha.enter_context(conexao())
+
+        def preparar(gld_name, saida, gld_lote):
+            dimensoes = [c for c in DIMENSOES if c in gld_lote.columns]
+            colunas_view = _colunas_view(gld_name, gld_lote.columns) if dimensoes else None
+            garantir_tabela(saida['connection'], gld_name, GOLD_TARGETS[gld_name]['ddl'], dimensoes, colunas_view)
+            logging.info(f"Tabela {gld_name} criada/verificada com sucesso.")
+            # Concluída (ou abortada) pelo escritor do snapshot da saída, ao sair da pilha
+            saida['publicacao'] = saida['escritor'].publicacao = PublicacaoEmLotes(
+                saida['connection'], gld_name, modo=publish_mode, metodo=load_method, batch_size=batch_size
+            ).iniciar()
+
+        def enviar(gld_name, saida, gld_lote):
+            if saida['publicacao'] is None:
+                preparar(gld_name, saida, gld_lote)
+            with etapa(ETAPA_CARGA_DB):
+                db_lote = substituir_por_chaves(cadastro, gld_lote, [c for c in DIMENSOES if c in gld_lote.columns])
+            saida['publicacao'].carregar(db_lote)
+            saida['escritor'].escrever(como_categorias(gld_lote))
+
+        saidas = {}
+        for gld_name in pendentes:
+            alvo = GOLD_TARGETS[gld_name]
+            # A conexão entra na pilha antes do escritor, que conclui a publicação ao sair
+            connection = pilha.enter_context(conexao())
+            saidas[gld_name] = {
+                'connection': connection,
+                'escritor': pilha.enter_context(EscritorSnapshot(minio_client, bucket3_name, f'gold/{gld_name}.parquet',
+                                                                 metadata=metadata, particao='ano', origem=origem)),
+                'contador': ContadorHashes() if alvo.get('unico') else None,
+                'parciais': [] if alvo.get('grupos') else None,
+                'publicacao': None,
+            }
+
+        for lote in iter_snapshot(minio_client, bucket_name, key, columns=columns, filters=filters, snapshot=origem):
+            gld_lotes = {}
+            for gld_name, saida in saidas.items():
+                alvo = GOLD_TARGETS[gld_name]
+                with etapa(ETAPA_TRANSFORMACAO, linhas=len(lote)):
+                    if saida['parciais'] is not None:
+                        saida['parciais'].append(contar(lote, alvo['grupos']))
+                        if saida['publicacao'] is None:
+                            preparar(gld_name, saida, _rollup(alvo, saida['parciais'], motor))
+                        continue
+                    gld_lote = alvo['build'](lote, motor)
+                    if saida['contador'] is not None:
+                        gld_lote = deduplicar(gld_lote, saida['contador'])
+                gld_lotes[gld_name] = gld_lote
+                if saida['publicacao'] is None:
+                    preparar(gld_name, saida, gld_lote)
+            for gld_name, gld_lote in gld_lotes.items():
+                enviar(gld_name, saidas[gld_name], gld_lote)
+
+        for gld_name, saida in saidas.items():
+            if saida['parciais'] is not None:
+                with etapa(ETAPA_TRANSFORMACAO, linhas=sum(len(p) for p in saida['parciais'])):
+                    rollup = _rollup(GOLD_TARGETS[gld_name], saida['parciais'], motor)
+                enviar(gld_name, saida, rollup)
+
+    for gld_name, saida in saidas.items():
+        logging.info(f"Camada '{gld_name}' processada em lotes: {saida['escritor'].linhas} linhas")
+
+
+def _publicar_saida(publicacoes, minio_client, bucket3_name, gld_name, gld_df, snapshot_df, metadata, origem, carga,
+                    novos_membros, load_method, batch_size, publish_mode):
+    """
+    Publica uma saída gold (executada pela EtapaPublicacao): os arquivos do snapshot são enviados ao MinIO enquanto a
+    saída é carregada no MariaDB, sem confirmar, com uma conexão própria do pool. `carga(connection, tabela, db_df,
+    confirmar=False)` aplica as cargas incrementais em uma transação aberta; sem ela, a carga completa vai para a
+    staging (conforme `publish_mode`). A etapa final troca o manifesto do snapshot, com a linhagem, e só então confirma
+    a carga (commit ou troca/mescla da tabela); se a confirmação falhar, o manifesto volta ao anterior. Os membros de
+    um rollup são gravados depois da publicação.
+
+    Se qualquer etapa falhar, a carga é desfeita e os arquivos enviados são removidos: a tabela e o snapshot
+    publicados não mudam, e a próxima execução reprocessa a saída.
+
+    O snapshot registra como `origem` o snapshot da silver lido, e os membros de um rollup, o id do snapshot ao qual
+    pertencem (ver agregados.ler_membros).
+    """
+    gld_key = f'gold/{gld_name}.parquet'
+    envio = publicacoes.enviar(gravar_snapshot, minio_client, como_categorias(snapshot_df), bucket3_name, gld_key,
+                               particao='ano', origem=origem)
+    with conexao() as connection:
+        publicacao = None
+        try:
+            # Criar (uma vez por processo) e popular tabelas no MariaDB
+            dimensoes = [c for c in DIMENSOES if c in gld_df.columns]
+            colunas_view = _colunas_view(gld_name, gld_df.columns) if dimensoes else None
+            garantir_tabela(connection, gld_name, GOLD_TARGETS[gld_name]['ddl'], dimensoes, colunas_view)
+            logging.info(f"Tabela {gld_name} criada/verificada com sucesso.")
+
+            # Inserir dados em lotes, com as dimensões trocadas pelas chaves das tabelas de lookup
+            with etapa(ETAPA_CARGA_DB):
+                db_df = substituir_por_chaves(connection, gld_df, dimensoes)
+            if carga is not None:
+                carga(connection, gld_name, db_df, confirmar=False)
+                publicacao = TransacaoPendente(connection)
+            else:
+                publicacao = PublicacaoEmLotes(connection, gld_name, modo=publish_mode, metodo=load_method,
+                                               batch_size=batch_size).iniciar()
+                publicacao.carregar(db_df)
+            snapshot = envio.result()
+        except Exception:
+            if publicacao is not None:
+                publicacao.abortar()
+            desfazer_envio(envio, functools.partial(descartar_snapshot, minio_client, bucket3_name))
+            raise
+
+        # Etapa final: troca do manifesto (com a linhagem) e confirmação da carga no MariaDB
+        publicar_snapshot(minio_client, bucket3_name, gld_key, snapshot, metadata=metadata, publicacao=publicacao)
+    logging.info(f"Dados inseridos/atualizados na tabela {gld_name}.")
+    logging.info(f"Camada '{gld_name}' salva no MinIO no dataset: {gld_key}")
+
+    if novos_membros is not None:
+        write_membros(minio_client, novos_membros, bucket3_name, gld_key, snapshot['id'])
+
+
+@instrumentar('gold')
+def transform_and_load_gold(bucket_name, key, endpoint_url, access_key, secret_key, bucket3_name='gold',
+                            load_method='executemany', batch_size=DEFAULT_BATCH_SIZE, targets=None, incremental=False,
+                            publish_mode='swap', force=False, streaming=False, engine=MOTOR_PADRAO):
     """
     Agregação de dados, criação de dimensões hierárquicas, filtragem irrelevante e formatação para visualização, salvando a camada gold
     resultante no MinIO e MariaDB.
+
+    `targets` seleciona quais saídas de GOLD_TARGETS são construídas e carregadas a partir de uma única leitura da
+    camada silver (por padrão, todas).
+
+    Com incremental=True, apenas as linhas do delta publicado pela camada silver são transformadas; cada saída é
+    mesclada no seu snapshot anterior pela coluna `_chave` e o MariaDB recebe somente as linhas alteradas.
+
+    Os rollups (gld_contagens e a dimensão hierárquica gld_dim_local) guardam uma linha por grupo com o número de
+    acordos; no modo incremental, as contagens são atualizadas apenas pelas linhas alteradas da silver e o MariaDB
+    recebe somente os grupos afetados.
+
+    Saídas cuja linhagem (ETag das entradas, versão do código e parâmetros) corresponde às entradas atuais não são
+    reprocessadas; se nenhuma saída precisar de atualização, retorna "skipped: up to date" (force=True ignora o cache).
+
+    Cargas completas são publicadas no MariaDB conforme `publish_mode`: 'swap' (staging + RENAME TABLE atômico),
+    'merge' (mescla pelo hash determinístico das linhas) ou 'upsert' (INSERT direto, como antes). O modo incremental
+    continua aplicando o delta na própria tabela.
+
+    As saídas são publicadas em paralelo (ver tasks.publicacao.EtapaPublicacao): enquanto uma saída é construída, as
+    anteriores enviam os arquivos dos seus snapshots ao MinIO e carregam o MariaDB, cada uma com a sua conexão. Uma
+    saída com erro é desfeita sem afetar as demais, e a tarefa falha ao final listando o erro de cada saída.
+
+    Com streaming=True (apenas cargas completas), a silver é lida em lotes de tamanho limitado e cada saída é
+    construída e carregada lote a lote (ver _gold_em_lotes).
+
+    `engine` escolhe o motor das transformações (ver tasks.motores.MOTORES): 'pandas' ou 'arrow' (pyarrow.compute),
+    com saídas idênticas.
     """
-    # Configurar cliente MinIO
-    minio_client = boto3.client(
-        's3',
-        endpoint_url=endpoint_url,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key
-    )
-    
+    validar_modo(publish_mode)
+    validar_streaming(streaming, incremental)
+    motor = get_motor(engine)
+    targets = list(GOLD_TARGETS) if targets is None else list(targets)
+    invalidos = [t for t in targets if t not in GOLD_TARGETS]
+    if invalidos:
+        raise ValueError(f"Saídas gold desconhecidas: {invalidos}. Disponíveis: {list(GOLD_TARGETS)}")
+
+    # Cliente MinIO compartilhado pelo processo worker
+    minio_client = get_client(endpoint_url, access_key, secret_key)
+
     try:
-        # Listar objetos no bucket para verificar a chave correta
-        objects = minio_client.list_objects_v2(Bucket=bucket_name)
-        keys = [obj['Key'] for obj in objects.get('Contents', [])]
-        if key not in keys:
-            logging.error(f"Erro: A chave especificada '{key}' não existe no bucket '{bucket_name}'. Chaves disponíveis: {keys}")
+        # Verificar a existência do dataset (manifesto) com um HEAD, sem listar o bucket
+        atual = referencia(minio_client, bucket_name, key)
+        if atual is None:
+            logging.error(f"Erro: A chave especificada '{key}' não existe no bucket '{bucket_name}'.")
             raise Exception(f"A chave especificada '{key}' não existe no bucket '{bucket_name}'.")
 
-        # Ler dados do MinIO
-        response = minio_client.get_object(Bucket=bucket_name, Key=key)
-        df = pd.read_parquet(io.BytesIO(response['Body'].read()))
-
-        # Criação de dimensões hierárquicas
-        df_hier = df.copy()
-        df_hier['local_completo'] = df_hier['continente'] + ' > ' + df_hier['região'] + ' > ' + df_hier['local_de_assinatura']
-        df_hier['acordo_recurso'] = df_hier['tipo_de_acordo'] + ' - ' + df_hier['recursos']
-
-        #Separação em dois dataframes diferentes os acordos que são de tipo de parceiro diferentes
-        df_pais = df_hier[df_hier['tipo_de_parceiro'] == 'País']
-        df_org = df_hier[df_hier['tipo_de_parceiro'] == 'Organização']
-
-        
-
-
-
-
- # Transformação da camada gold
-        gld_acordos_df = df[['parceiro', 'tipo_de_parceiro', 'continente', 'região', 'local_de_assinatura', 'tipo_de_acordo', 'título', 'objetivo', 'recursos', 'tipo_de_documento', 'ano']].drop_duplicates()
-
- # Salvar camada gold no MinIO
-        for gld_df, gld_name in [
-            (gld_acordos_df, 'gld_acordos'),
-            (df_hier[['local_completo', 'acordo_recurso']], 'gld_hier'),
-            (df_pais[['local_completo', 'acordo_recurso']], 'gld_pais'),
-            (df_org[['local_completo', 'acordo_recurso']], 'gld_org')
-        ]:
-            output_buffer = io.BytesIO()
-            gld_df.to_parquet(output_buffer, index=False)
-            output_buffer.seek(0)
-            gld_key = f'gold/{gld_name}.parquet'
-            minio_client.put_object(
-                Bucket=bucket3_name,
-                Key=gld_key,
-                Body=output_buffer.getvalue()
-            )
-            logging.info(f"Camada '{gld_name}' salva no MinIO com a chave: {gld_key}")
-            
-            # Criar e popular tabelas no MariaDB
-            mysql_hook = MySqlHook(mysql_conn_id='local_mariadb')
-            connection = mysql_hook.get_conn()
-            with connection.cursor() as cursor:
-                # Criar tabela gld_acordos
-                create_table_acordos_sql = """
-                CREATE TABLE IF NOT EXISTS gld_acordos (
-                    cod_acordo INT PRIMARY KEY AUTO_INCREMENT,
-                    parceiro VARCHAR(255),
-                    tipo_de_parceiro VARCHAR(255),
-                    continente VARCHAR(255),
-                    região VARCHAR(255),
-                    local_de_assinatura VARCHAR(255),
-                    tipo_de_acordo VARCHAR(255),
-                    título TEXT,
-                    objetivo TEXT,
-                    recursos VARCHAR(255),
-                    tipo_de_documento VARCHAR(255),
-                    ano VARCHAR(255)
-                )
-                """
-                cursor.execute(create_table_acordos_sql)
-                logging.info("Tabela gld_acordos criada/verificada com sucesso.")
-
-                # Criar tabela gld_hier
-                create_table_hier_sql = """
-                CREATE TABLE IF NOT EXISTS gld_hier (
-                    cod_local INT PRIMARY KEY AUTO_INCREMENT,
-                    local_completo VARCHAR(255),
-                    acordo_recurso VARCHAR(255)
-                )
-                """
-                cursor.execute(create_table_hier_sql)
-                logging.info("Tabela gld_hier criada/verificada com sucesso.")
-
-                # Criar tabela gld_pais 
-                create_table_pais_sql = """
-                CREATE TABLE IF NOT EXISTS gld_pais (
-                    cod_local INT PRIMARY KEY AUTO_INCREMENT,
-                    local_completo VARCHAR(255),
-                    acordo_recurso VARCHAR(255)
-                )
-                """
-                cursor.execute(create_table_pais_sql)
-                logging.info("Tabela gld_pais criada/verificada com sucesso.")
-
-                # Criar tabela gld_org
-                create_table_org_sql = """
-                CREATE TABLE IF NOT EXISTS gld_org (
-                    cod_local INT PRIMARY KEY AUTO_INCREMENT,
-                    local_completo VARCHAR(255),
-                    acordo_recurso VARCHAR(255)
-                )
-                """
-                cursor.execute(create_table_org_sql)
-                logging.info("Tabela gld_org criada/verificada com sucesso.")
-                
-                
-                # Inserir dados
-                if gld_name == 'gld_acordos':
-                    for _, row in gld_df.iterrows():
-                        insert_sql = """
-                        INSERT INTO gld_acordos
-                        (parceiro, tipo_de_parceiro, continente, região, local_de_assinatura, tipo_de_acordo, título, objetivo, recursos, tipo_de_documento, ano)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        parceiro=VALUES(parceiro),
-                        tipo_de_parceiro=VALUES(tipo_de_parceiro),
-                        continente=VALUES(continente),
-                        região=VALUES(região),
-                        local_de_assinatura=VALUES(local_de_assinatura),
-                        tipo_de_acordo=VALUES(tipo_de_acordo),
-                        título=VALUES(título),
-                        objetivo=VALUES(objetivo),
-                        recursos=VALUES(recursos),
-                        tipo_de_documento=VALUES(tipo_de_documento),
-                        ano=VALUES(ano)
-                        """ 
-                        cursor.execute(insert_sql, tuple(row))
-                    connection.commit()
-                    logging.info("Dados inseridos/atualizados na tabela gld_acordos.")
-
-                elif gld_name == 'gld_hier':
-                    for _, row in gld_df.iterrows():
-                        insert_sql = """
-                        INSERT INTO gld_hier
-                        (local_completo, acordo_recurso)
-                        VALUES (%s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        local_completo=VALUES(local_completo),
-                        acordo_recurso=VALUES(acordo_recurso)
-                        """
-                        cursor.execute(insert_sql, tuple(row))
-                    connection.commit()
-                    logging.info("Dados inseridos/atualizados na tabela gld_hier.")
-
-                elif gld_name == 'gld_pais':
-                    for _, row in gld_df.iterrows():
-                        insert_sql = """
-                        INSERT INTO gld_pais
-                        (local_completo, acordo_recurso)
-                        VALUES (%s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        local_completo=VALUES(local_completo),
-                        acordo_recurso=VALUES(acordo_recurso)
-                        """
-                        cursor.execute(insert_sql, tuple(row))
-                    connection.commit()
-                    logging.info("Dados inseridos/atualizados na tabela gld_pais.")
-
-                elif gld_name == 'gld_org':
-                    for _, row in gld_df.iterrows():
-                        insert_sql = """
-                        INSERT INTO gld_org
-                        (local_completo, acordo_recurso)
-                        VALUES (%s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        local_completo=VALUES(local_completo),
-                        acordo_recurso=VALUES(acordo_recurso)
-                        """
-                        cursor.execute(insert_sql, tuple(row))
-                    connection.commit()
-                    logging.info("Dados inseridos/atualizados na tabela gld_org.")
+        # Verificar quais saídas já foram produzidas a partir das mesmas entradas e do mesmo código
+        entradas = [(bucket_name, atual)] + ([(bucket_name, delta_key(key))] if incremental else [])
+        metadata = linhagem(minio_client, entradas, versao_codigo(), incremental=incremental)
+        pendentes = [t for t in targets
+                     if force or not em_dia(minio_client, bucket3_name, manifest_key(f'gold/{t}.parquet'), metadata)]
+        for gld_name in [t for t in targets if t not in pendentes]:
+            logging.info(f"Camada '{gld_name}' já está atualizada em relação a {entradas}; nada a processar")
+        if not pendentes:
+            return STATUS_EM_DIA
+
+        # Ler dados do MinIO apenas com as colunas e row groups necessários às saídas pendentes, sempre do snapshot
+        # atual da silver (a origem dos snapshots gold), mesmo que outro seja publicado durante a tarefa
+        columns, filters = _projecao(pendentes)
+        origem = (snapshot_atual(minio_client, bucket_name, key) or {}).get('id')
+        if streaming:
+            _gold_em_lotes(minio_client, bucket_name, key, bucket3_name, pendentes, columns, filters, metadata, origem,
+                           load_method, batch_size, publish_mode, motor)
+            return
+        df = None
+        if incremental:
+            # O delta não é filtrado: linhas que deixaram de atender ao filtro precisam sair do snapshot. Ele só é
+            # aplicado às saídas produzidas a partir do snapshot silver sobre o qual foi calculado (`base_delta`)
+            linhas, chaves, base_delta = (ler_delta(minio_client, bucket_name, key, columns=columns, snapshot=origem)
+                                          if origem is not None else (None, None, None))
+        else:
+            df = read_snapshot(minio_client, bucket_name, key, columns=columns, filters=filters, snapshot=origem)
+
+        # Construir cada saída gold pendente e entregá-la à etapa de publicação, que envia o snapshot ao MinIO e carrega
+        # o MariaDB de várias saídas ao mesmo tempo enquanto as próximas são construídas
+        with EtapaPublicacao() as publicacoes:
+            for gld_name in pendentes:
+                alvo = GOLD_TARGETS[gld_name]
+                build, grupos = alvo['build'], alvo.get('grupos')
+                gld_key = f'gold/{gld_name}.parquet'
+                novos_membros, carga = None, None
+
+                if incremental and grupos:
+                    # Rollup: as contagens anteriores recebem a variação das linhas alteradas (ver agregados.atualizar)
+                    base, id_base = (ler_base(minio_client, bucket3_name, gld_key, origem=base_delta, coluna=None)
+                                     if chaves is not None else (None, None))
+                    anteriores = ler_membros(minio_client, bucket3_name, gld_key, id_base) if base is not None else None
+                    if anteriores is None:
+                        base = None
+                        if df is None:
+                            df = read_snapshot(minio_client, bucket_name, key, columns=columns + [COLUNA_CHAVE],
+                                               filters=filters, snapshot=origem)
+                        with etapa(ETAPA_TRANSFORMACAO, linhas=len(df)):
+                            gld_df = snapshot_df = build(df, motor)
+                            novos_membros = membros(df, grupos)
+                    else:
+                        with etapa(ETAPA_TRANSFORMACAO, linhas=len(linhas)):
+                            snapshot_df, gld_df, novos_membros = atualizar(base, anteriores, linhas, chaves, grupos)
+                            if alvo.get('derivar'):
+                                snapshot_df = alvo['derivar'](snapshot_df, motor)
+                                gld_df = alvo['derivar'](gld_df, motor)
+                    carga = functools.partial(aplicar_contagens, completo=base is None, metodo=load_method,
+                                              batch_size=batch_size)
+                elif incremental:
+                    base, _ = (ler_base(minio_client, bucket3_name, gld_key, origem=base_delta) if chaves is not None
+                               else (None, None))
+                    if base is None:
+                        # Sem snapshot incremental anterior desta saída produzido a partir da base do delta: recarga
+                        # completa a partir da silver
+                        if df is None:
+                            df = read_snapshot(minio_client, bucket_name, key, columns=columns + [COLUNA_CHAVE],
+                                               filters=filters, snapshot=origem)
+                        entrada, chaves_alvo = df, None
+                    else:
+                        entrada, chaves_alvo = linhas, chaves
+                    with etapa(ETAPA_TRANSFORMACAO, linhas=len(entrada)):
+                        gld_df = build(entrada, motor)
+                        # Alinhada ao índice da saída: atribuída a uma saída vazia (ex.: filtro sem linhas no delta),
+                        # a coluna inteira criaria linhas só com a chave
+                        gld_df[COLUNA_CHAVE] = entrada[COLUNA_CHAVE].reindex(gld_df.index)
+                        snapshot_df = mesclar(base, gld_df, chaves_alvo)
+                    carga = functools.partial(aplicar_delta_tabela, chaves=chaves_alvo, metodo=load_method,
+                                              batch_size=batch_size)
+                else:
+                    with etapa(ETAPA_TRANSFORMACAO, linhas=len(df)):
+                        gld_df = snapshot_df = build(df, motor)
 
+                publicacoes.publicar(gld_name, _publicar_saida, publicacoes, minio_client, bucket3_name, gld_name,
+                                     gld_df, snapshot_df, metadata, origem, carga, novos_membros, load_method,
+                                     batch_size, publish_mode)
 
     except Exception as e:
         logging.error(f"Erro ao processar camada: {e}")
         raise
-    finally:
-        if 'connection' in locals() and connection and not connection.closed:
-            connection.close()
\ No newline at end of file
@@ -0,0 +1,159 @@
+import logging
+import os
+import tempfile
+
+import pandas as pd
+
+from tasks.metricas import ETAPA_CARGA_DB, etapa
+
+logger = logging.getLogger(__name__)
+
+# Métodos de carga suportados pelo carregador em lote
+METODOS_CARGA = ('executemany', 'values', 'infile')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _quote(identificador):
+    """Protege nomes de tabelas/colunas (ex.: colunas acentuadas como região e título)."""
+    return f"`{identificador.replace('`', '``')}`"
+
+
+def dataframe_para_linhas(df):
+    """
+    Converte um DataFrame em tuplas prontas para o driver, trocando NaN/NaT/pd.NA por None
+    e Timestamps por datetime nativo.
+    """
+    if df.empty:
+        return []
+    valores = df.astype(object).where(df.notna(), None)
+    linhas = []
+    for linha in valores.itertuples(index=False, name=None):
+        linhas.append(tuple(v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in linha))
+    return linhas
+
+
+def _sufixo_duplicados(colunas):
+    return ' ON DUPLICATE KEY UPDATE ' + ', '.join(f'{_quote(c)} = VALUES({_quote(c)})' for c in colunas)
+
+
+def _insert_sql(tabela, colunas, n_linhas, on_duplicate_update):
+    placeholders = '(' + ', '.join(['%s'] * len(colunas)) + ')'
+    sql = (
+        f"INSERT INTO {_quote(tabela)} ({', '.join(_quote(c) for c in colunas)}) "
+        f"VALUES {', '.join([placeholders] * n_linhas)}"
+    )
+    if on_duplicate_update:
+        sql += _sufixo_duplicados(colunas)
+    return sql
+
+
+def _escapar_infile(valor):
+    if valor is None:
+        return '\\N'
+    texto = str(valor)
+    return (texto.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
+
+
+def _carregar_executemany(cursor, tabela, colunas, lote, on_duplicate_update):
+    # O driver reescreve INSERT ... VALUES com executemany em um único comando multi-linha
+    cursor.executemany(_insert_sql(tabela, colunas, 1, on_duplicate_update), lote)
+
+
+def _carregar_values(cursor, tabela, colunas, lote, on_duplicate_update):
+    parametros = [valor for linha in lote for valor in linha]
+    cursor.execute(_insert_sql(tabela, colunas, len(lote), on_duplicate_update), parametros)
+
+
+def _load_data(cursor, tabela, colunas, lote):
+    # Requer local_infile habilitado na conexão (extra {"local_infile": true} na conexão do Airflow)
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', newline='', delete=False) as arquivo:
+        for linha in lote:
+            arquivo.write('\t'.join(_escapar_infile(v) for v in linha) + '\n')
+        caminho = arquivo.name
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {_quote(tabela)} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' "
+            f"({', '.join(_quote(c) for c in colunas)})",
+            (caminho,)
+        )
+    finally:
+        os.remove(caminho)
+
+
+def _carregar_infile(cursor, tabela, colunas, lote, on_duplicate_update):
+    if not on_duplicate_update:
+        _load_data(cursor, tabela, colunas, lote)
+        return
+    # LOAD DATA ... REPLACE apagaria e reinseriria as linhas existentes (novos ids AUTO_INCREMENT, ON DELETE das chaves
+    # estrangeiras disparado, colunas fora da carga perdidas): o lote vai para uma tabela temporária, sem chaves, e é
+    # aplicado com INSERT ... SELECT ... ON DUPLICATE KEY UPDATE. CREATE/DROP TEMPORARY não confirmam a transação
+    temporaria = _quote(f'{tabela}__infile')
+    lista = ', '.join(_quote(c) for c in colunas)
+    cursor.execute(f"CREATE TEMPORARY TABLE {temporaria} AS SELECT {lista} FROM {_quote(tabela)} LIMIT 0")
+    try:
+        _load_data(cursor, f'{tabela}__infile', colunas, lote)
+        cursor.execute(f"INSERT INTO {_quote(tabela)} ({lista}) SELECT {lista} FROM {temporaria}"
+                       + _sufixo_duplicados(colunas))
+    finally:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {temporaria}")
+
+
+_CARREGADORES = {
+    'executemany': _carregar_executemany,
+    'values': _carregar_values,
+    'infile': _carregar_infile,
+}
+
+
+def bulk_load(connection, tabela, df, metodo='executemany', batch_size=DEFAULT_BATCH_SIZE, on_duplicate_update=False,
+              confirmar=True):
+    """
+    Carrega um DataFrame no MariaDB em lotes de `batch_size` linhas, com um commit por lote. Com confirmar=False
+    nenhum commit (nem rollback) é feito: os lotes ficam na transação do chamador, que confirma ou desfaz a carga
+    inteira.
+
+    metodo:
+        'executemany' - INSERT parametrizado enviado via cursor.executemany
+        'values'      - um único INSERT com VALUES multi-linha por lote
+        'infile'      - LOAD DATA LOCAL INFILE a partir de um arquivo temporário por lote (com on_duplicate_update,
+                        em uma tabela temporária aplicada com INSERT ... SELECT ... ON DUPLICATE KEY UPDATE);
+                        se o servidor recusar, o lote é refeito com executemany
+
+    Retorna o número de linhas enviadas.
+    """
+    if metodo not in _CARREGADORES:
+        raise ValueError(f"Método de carga inválido '{metodo}'. Use um de {METODOS_CARGA}")
+    if batch_size <= 0:
+        raise ValueError("batch_size deve ser maior que zero")
+
+    colunas = list(df.columns)
+    linhas = dataframe_para_linhas(df)
+    carregar = _CARREGADORES[metodo]
+    total = 0
+
+    with etapa(ETAPA_CARGA_DB) as medicao, connection.cursor() as cursor:
+        for inicio in range(0, len(linhas), batch_size):
+            lote = linhas[inicio:inicio + batch_size]
+            try:
+                carregar(cursor, tabela, colunas, lote, on_duplicate_update)
+            except Exception as e:
+                # Um comando recusado não desfaz os anteriores da transação; sem confirmar, quem desfaz é o chamador
+                if confirmar:
+                    connection.rollback()
+                if metodo != 'infile':
+                    raise
+                logging.warning(f"LOAD DATA LOCAL INFILE indisponível para {tabela} ({e}); usando executemany no lote")
+                _carregar_executemany(cursor, tabela, colunas, lote, on_duplicate_update)
+            if confirmar:
+                connection.commit()
+            total += len(lote)
+            medicao.linhas = total
+
+    logging.info(f"{total} linhas carregadas na tabela {tabela} ({metodo}, lotes de {batch_size})")
+    return total
@@ -0,0 +1,162 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Etapas medidas dentro das tarefas
+ETAPA_LEITURA_PLANILHA = 'leitura_planilha'
+ETAPA_TRANSFORMACAO = 'transformacao'
+ETAPA_CODIFICACAO_PARQUET = 'codificacao_parquet'
+ETAPA_DECODIFICACAO_PARQUET = 'decodificacao_parquet'
+ETAPA_MINIO_PUT = 'minio_put'
+ETAPA_MINIO_GET = 'minio_get'
+ETAPA_DDL = 'ddl'
+ETAPA_CARGA_DB = 'carga_db'
+
+XCOM_METRICAS = 'metricas'
+
+# Exportador StatsD (UDP): desligado enquanto ETL_STATSD_HOST não estiver definido
+STATSD_HOST = os.environ.get('ETL_STATSD_HOST')
+STATSD_PORT = int(os.environ.get('ETL_STATSD_PORT', 8125))
+STATSD_PREFIXO = os.environ.get('ETL_STATSD_PREFIX', 'etl')
+
+# Coletor da tarefa em execução; sem coletor ativo as medições são descartadas
+_COLETOR = contextvars.ContextVar('coletor_metricas', default=None)
+
+
+class Coletor:
+    """
+    Acumula, por etapa, o tempo de parede, o número de chamadas e as linhas e bytes processados. Etapas executadas em
+    threads (com o contexto copiado) somam no mesmo coletor, então o tempo de uma etapa pode exceder o da tarefa.
+    """
+
+    def __init__(self, tarefa):
+        self.tarefa = tarefa
+        self.etapas = {}
+        self.segundos = 0.0
+        self.status = 'ok'
+        self._lock = threading.Lock()
+
+    def registrar(self, nome, segundos, linhas=None, n_bytes=None):
+        with self._lock:
+            etapa = self.etapas.setdefault(nome, {'segundos': 0.0, 'chamadas': 0, 'linhas': 0, 'bytes': 0})
+            etapa['segundos'] += segundos
+            etapa['chamadas'] += 1
+            etapa['linhas'] += linhas or 0
+            etapa['bytes'] += n_bytes or 0
+
+    def resumo(self):
+        """Dicionário serializável em JSON (XCom e log estruturado)."""
+        return {
+            'tarefa': self.tarefa,
+            'status': self.status,
+            'segundos': round(self.segundos, 6),
+            'etapas': {nome: {**valores, 'segundos': round(valores['segundos'], 6)}
+                       for nome, valores in self.etapas.items()},
+        }
+
+
+class Medicao:
+    """Linhas e bytes de uma etapa em andamento, preenchidos pelo bloco medido."""
+
+    def __init__(self, linhas=None, n_bytes=None):
+        self.linhas = linhas
+        self.n_bytes = n_bytes
+
+
+def registrar(nome, segundos, linhas=None, n_bytes=None):
+    """Registra uma medição já cronometrada no coletor da tarefa em execução (se houver)."""
+    coletor = _COLETOR.get()
+    if coletor is not None:
+        coletor.registrar(nome, segundos, linhas=linhas, n_bytes=n_bytes)
+
+
+@contextlib.contextmanager
+def etapa(nome, linhas=None, n_bytes=None):
+    """
+    Cronometra o bloco como uma ocorrência da etapa `nome`. Linhas e bytes podem ser informados na abertura ou
+    atribuídos ao objeto retornado dentro do bloco:
+
+        with etapa(ETAPA_CARGA_DB) as medicao:
+            medicao.linhas = bulk_load(...)
+    """
+    medicao = Medicao(linhas, n_bytes)
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    finally:
+        registrar(nome, time.perf_counter() - inicio, linhas=medicao.linhas, n_bytes=medicao.n_bytes)
+
+
+def formatar_statsd(resumo, prefixo=STATSD_PREFIXO):
+    """Linhas no formato StatsD: tempos em ms (|ms) e contagens de linhas e bytes como gauges (|g)."""
+    base = f"{prefixo}.{resumo['tarefa']}"
+    linhas = [f"{base}.segundos:{resumo['segundos'] * 1000:.3f}|ms"]
+    for nome, valores in resumo['etapas'].items():
+        linhas.append(f"{base}.{nome}.tempo:{valores['segundos'] * 1000:.3f}|ms")
+        linhas.append(f"{base}.{nome}.linhas:{valores['linhas']}|g")
+        linhas.append(f"{base}.{nome}.bytes:{valores['bytes']}|g")
+    return linhas
+
+
+def enviar_statsd(resumo, host=None, port=None, prefixo=STATSD_PREFIXO):
+    """Envia o resumo ao StatsD por UDP, um datagrama por métrica. Falhas de envio não interrompem a tarefa."""
+    host = host or STATSD_HOST
+    if not host:
+        return
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for linha in formatar_statsd(resumo, prefixo):
+                sock.sendto(linha.encode('utf-8'), (host, port or STATSD_PORT))
+    except OSError as e:
+        logging.warning(f"Falha ao enviar métricas ao StatsD em {host}: {e}")
+
+
+def _enviar_xcom(resumo):
+    try:
+        from airflow.operators.python import get_current_context
+        contexto = get_current_context()
+    except Exception:
+        # Execução fora de uma tarefa do Airflow (ex.: benchmark)
+        return
+    contexto['ti'].xcom_push(key=XCOM_METRICAS, value=resumo)
+
+
+def publicar(coletor):
+    """Publica o resumo da tarefa no log (uma linha JSON), no XCom 'metricas' e no StatsD."""
+    resumo = coletor.resumo()
+    logging.info(f"metricas {json.dumps(resumo, ensure_ascii=False, sort_keys=True)}")
+    _enviar_xcom(resumo)
+    enviar_statsd(resumo)
+    return resumo
+
+
+def instrumentar(tarefa):
+    """
+    Decorador das funções de tarefa: ativa um coletor durante a execução e publica as métricas ao final, também quando
+    a tarefa falha (status 'erro').
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            coletor = Coletor(tarefa)
+            token = _COLETOR.set(coletor)
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                coletor.status = 'erro'
+                raise
+            finally:
+                coletor.segundos = time.perf_counter() - inicio
+                _COLETOR.reset(token)
+                publicar(coletor)
+        return wrapper
+    return decorador
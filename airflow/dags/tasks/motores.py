@@ -0,0 +1,180 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Caracteres cujo title case no Arrow (utf8_title) difere do str.title do Python ou não foi verificado: os valores que
+# os contêm (ª, º, ß, ligaduras, sigma final, ...) são normalizados pelo Python para manter a saída idêntica
+_FORA_TITULO_ARROW = r'[^\x{00}-\x{7F}\x{C0}-\x{DE}\x{E0}-\x{FF}]'
+
+# Valores mínimos por fatia nos kernels de texto divididos entre as threads do pool de CPU do pyarrow
+VALORES_POR_FATIA = 16 * 1024
+
+
+class MotorPandas:
+    """
+    Motor de referência das transformações silver e gold, em pandas (single-thread). Cada operação recebe e devolve
+    objetos pandas; outros motores só mudam a implementação e precisam produzir exatamente o mesmo resultado (mesmos
+    valores, dtypes e índice).
+    """
+
+    nome = 'pandas'
+
+    def limpar(self, serie, sentinela=None, preencher=None, titulo=False):
+        """
+        Limpeza de uma coluna de texto feita sobre os seus valores distintos: nulos e `sentinela` passam a `preencher`
+        e, com `titulo`, os valores perdem os espaços das bordas e recebem title case (str.strip().title()). Retorna os
+        códigos de cada linha (-1 para nulos) e os valores distintos resultantes, na ordem de aparição, como Index
+        object; valores que ficaram iguais após a normalização compartilham o mesmo código.
+        """
+        codigos, valores = pd.factorize(serie)
+        valores = pd.Series(valores, dtype=object)
+        if preencher is not None:
+            # Nulos passam a apontar para o valor de preenchimento, que segue a mesma normalização
+            valores = pd.concat([valores, pd.Series([preencher], dtype=object)], ignore_index=True)
+            codigos = np.where(codigos < 0, len(valores) - 1, codigos)
+            if sentinela is not None:
+                valores = valores.where(valores != sentinela, preencher)
+        if titulo:
+            valores = valores.str.strip().str.title()
+        recodificacao, categorias = pd.factorize(valores)
+        return np.where(codigos < 0, -1, recodificacao[codigos]), categorias
+
+    def ano(self, serie):
+        return serie.dt.year
+
+    def sem_duplicadas(self, df):
+        """drop_duplicates: primeira ocorrência de cada linha, com o índice original."""
+        return df.drop_duplicates()
+
+    def concatenar(self, df, colunas, separador):
+        """Texto das `colunas` unido por `separador`, NaN se alguma delas for nula."""
+        texto = df[colunas].astype(object)
+        resultado = texto[colunas[0]]
+        for coluna in colunas[1:]:
+            resultado = resultado + separador + texto[coluna]
+        return resultado
+
+    def filtrar(self, df, coluna, valor):
+        return df[df[coluna] == valor]
+
+
+class MotorArrow(MotorPandas):
+    """
+    Motor com os kernels do pyarrow.compute, vetorizados em C++ e sem as cópias intermediárias de objetos Python do
+    pandas; a deduplicação usa o group_by multi-thread do Arrow (pool de CPU do pyarrow, pa.cpu_count()). Os
+    resultados voltam como pandas, idênticos aos do MotorPandas.
+    """
+
+    nome = 'arrow'
+
+    def limpar(self, serie, sentinela=None, preencher=None, titulo=False):
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Categorias usadas, na ordem de aparição, direto dos códigos do Categorical
+            codigos = serie.cat.codes.to_numpy()
+            usados = pc.unique(pa.array(codigos[codigos >= 0])).to_numpy()
+            remapear = np.full(len(serie.cat.categories) + 1, -1, dtype=np.intp)
+            remapear[usados] = np.arange(len(usados))
+            codigos = remapear[codigos]
+            valores = pa.array(serie.cat.categories.to_numpy(dtype=object)[usados], from_pandas=True)
+        else:
+            codificado = pc.dictionary_encode(_arrow(serie))
+            codigos = pc.fill_null(codificado.indices, -1).to_numpy().astype(np.intp)
+            valores = codificado.dictionary
+        if not pa.types.is_string(valores.type) and not pa.types.is_large_string(valores.type):
+            # Valores que não são texto (ex.: números convertidos da planilha) seguem a implementação de referência
+            return super().limpar(serie, sentinela, preencher, titulo)
+
+        if preencher is not None:
+            valores = pa.concat_arrays([valores, pa.array([preencher], type=valores.type)])
+            codigos = np.where(codigos < 0, len(valores) - 1, codigos)
+            if sentinela is not None:
+                valores = pc.if_else(pc.equal(valores, sentinela), pa.scalar(preencher, valores.type), valores)
+        if titulo:
+            valores = self._titulo(valores)
+        recodificado = pc.dictionary_encode(valores)
+        recodificacao = recodificado.indices.to_numpy()
+        categorias = pd.Index(recodificado.dictionary.to_numpy(zero_copy_only=False), dtype=object)
+        return np.where(codigos < 0, -1, recodificacao[codigos]), categorias
+
+    @staticmethod
+    def _titulo(valores):
+        normalizados = _em_fatias(lambda fatia: pc.utf8_title(pc.utf8_trim_whitespace(fatia)), valores)
+        fora = _em_fatias(lambda fatia: pc.match_substring_regex(fatia, _FORA_TITULO_ARROW), valores)
+        if not pc.any(fora).as_py():
+            return normalizados
+        # Os poucos valores com caracteres fora do intervalo verificado são normalizados pelo Python
+        python = [v.strip().title() for v in pc.filter(valores, fora).to_pylist()]
+        return pc.replace_with_mask(normalizados, fora, pa.array(python, type=valores.type))
+
+    def ano(self, serie):
+        anos = pc.year(_arrow(serie))
+        # Como o .dt.year: int32 sem nulos, float64 com NaN quando há datas nulas
+        valores = anos.to_numpy(zero_copy_only=False)
+        if anos.null_count == 0:
+            valores = valores.astype(np.int32)
+        return pd.Series(valores, index=serie.index, name=serie.name)
+
+    def sem_duplicadas(self, df):
+        # Cada coluna vira códigos inteiros (Categorical ou dicionário do Arrow, nulos com o mesmo código) e o group_by
+        # agrupa apenas inteiros
+        with ThreadPoolExecutor(max_workers=max(1, min(pa.cpu_count(), len(df.columns)))) as executor:
+            codigos = list(executor.map(_codigos, [df[coluna] for coluna in df.columns]))
+        tabela = pa.table({f'c{i}': c for i, c in enumerate(codigos)} | {'__linha': np.arange(len(df))})
+        primeiras = tabela.group_by(tabela.column_names[:-1], use_threads=True).aggregate([('__linha', 'min')])
+        return df.iloc[np.sort(primeiras['__linha_min'].to_numpy())]
+
+    def concatenar(self, df, colunas, separador):
+        texto = [pc.cast(_arrow(df[c]), pa.large_string()) for c in colunas]
+        unido = pc.binary_join_element_wise(*texto, pa.scalar(separador, pa.large_string()))
+        resultado = unido.to_numpy(zero_copy_only=False)
+        resultado[pd.isna(resultado)] = np.nan
+        return pd.Series(resultado, index=df.index, dtype=object)
+
+    def filtrar(self, df, coluna, valor):
+        iguais = pc.equal(pc.cast(_arrow(df[coluna]), pa.large_string()), valor)
+        return df[pc.fill_null(iguais, False).to_numpy(zero_copy_only=False)]
+
+
+def _arrow(serie):
+    """Coluna pandas como um único pa.Array (colunas de texto do pandas já são Arrow e não são copiadas)."""
+    dados = pa.array(serie, from_pandas=True)
+    return dados.combine_chunks() if isinstance(dados, pa.ChunkedArray) else dados
+
+
+def _codigos(serie):
+    """Código inteiro de cada valor da coluna: linhas com valores iguais (ou ambos nulos) recebem o mesmo código."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy()
+    return pc.fill_null(pc.dictionary_encode(_arrow(serie)).indices, -1)
+
+
+def _em_fatias(funcao, valores):
+    """
+    Aplica um kernel elemento a elemento em fatias de `valores` em paralelo (os kernels do pyarrow liberam o GIL) e
+    junta os resultados na ordem original.
+    """
+    fatias = min(pa.cpu_count(), len(valores) // VALORES_POR_FATIA)
+    if fatias <= 1:
+        return funcao(valores)
+    tamanho = -(-len(valores) // fatias)
+    with ThreadPoolExecutor(max_workers=fatias) as executor:
+        partes = list(executor.map(funcao, [valores.slice(i, tamanho) for i in range(0, len(valores), tamanho)]))
+    return pa.concat_arrays(partes)
+
+
+MOTORES = {motor.nome: motor for motor in (MotorPandas(), MotorArrow())}
+
+MOTOR_PADRAO = 'pandas'
+
+
+def get_motor(nome=MOTOR_PADRAO):
+    """Motor de transformação registrado em MOTORES com esse nome."""
+    if nome not in MOTORES:
+        raise ValueError(f"Motor de transformação inválido '{nome}'. Use um de {list(MOTORES)}")
+    return MOTORES[nome]
@@ -0,0 +1,346 @@
+import contextvars
+import logging
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from tasks.loader import bulk_load, DEFAULT_BATCH_SIZE
+from tasks.cdc import COLUNA_CHAVE, ContadorHashes, adicionar_coluna_chave, chave_ocorrencia, hash_colunas
+from tasks.dimensoes import migrar_tabela
+from tasks.esquema import colunas_tabela, ddl_staging, uma_vez
+from tasks.metricas import ETAPA_CARGA_DB, ETAPA_DDL, etapa
+
+logger = logging.getLogger(__name__)
+
+# Modos de publicação de uma carga completa no MariaDB:
+#   'upsert' - INSERT ... ON DUPLICATE KEY UPDATE direto na tabela (comportamento original; com chave substituta
+#              AUTO_INCREMENT nenhuma linha casa, e cada execução acrescenta uma cópia dos dados)
+#   'swap'   - carga em uma tabela de staging e troca atômica com RENAME TABLE
+#   'merge'  - carga em staging e mescla pelo hash determinístico da linha: linhas inalteradas ficam (com a mesma
+#              chave substituta), novas são inseridas e as que sumiram são removidas, em uma única transação
+MODOS_PUBLICACAO = ('upsert', 'swap', 'merge')
+
+# Hash de cada linha (conteúdo + ocorrência, para linhas repetidas), chave natural do modo 'merge'
+COLUNA_HASH_LINHA = '_hash_linha'
+
+# Staging e tabela substituída do modo 'swap' levam, além do sufixo, o instante e um código aleatório da execução
+# (ex.: slv_acordos__stg_1714521600_3f9a1c): execuções simultâneas da mesma tabela não usam as tabelas uma da outra
+SUFIXO_STAGING = '__stg'
+SUFIXO_ANTIGA = '__old'
+
+# Idade (segundos) a partir da qual stagings e tabelas substituídas de execuções interrompidas são removidas
+IDADE_TABELA_ABANDONADA = 24 * 3600
+
+# Saídas publicadas ao mesmo tempo por tarefa (cada uma ocupa uma conexão do pool do processo, ver
+# conexoes.TAMANHO_POOL) e envios ao MinIO em paralelo com as cargas no MariaDB
+MAX_PUBLICACOES_PARALELAS = 4
+MAX_ENVIOS_PARALELOS = 4
+
+
+def hash_linhas(df, contador=None):
+    """
+    Hash determinístico de cada linha: todas as colunas normalizadas, mais o número da ocorrência da linha. Com um
+    `contador` (ContadorHashes), as ocorrências continuam a contagem dos lotes anteriores.
+    """
+    base = hash_colunas(df, [c for c in df.columns if c != COLUNA_CHAVE])
+    contador = contador or ContadorHashes()
+    return pd.Series(chave_ocorrencia(base, contador.ocorrencias(base)), index=df.index)
+
+
+def validar_modo(modo):
+    if modo not in MODOS_PUBLICACAO:
+        raise ValueError(f"Modo de publicação inválido '{modo}'. Use um de {MODOS_PUBLICACAO}")
+
+
+def _adicionar_hash_linha(connection, tabela):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE `{tabela}` ADD COLUMN IF NOT EXISTS {COLUNA_HASH_LINHA} BIGINT UNSIGNED, "
+            f"ADD UNIQUE INDEX IF NOT EXISTS uk{COLUNA_HASH_LINHA} ({COLUNA_HASH_LINHA})"
+        )
+
+
+def _nome_execucao(tabela, sufixo):
+    return f'{tabela}{sufixo}_{int(time.time())}_{uuid.uuid4().hex[:6]}'
+
+
+def remover_abandonadas(connection, tabela, idade=IDADE_TABELA_ABANDONADA):
+    """
+    Remove as stagings e tabelas substituídas da `tabela` deixadas há mais de `idade` segundos por execuções
+    interrompidas (e as de nome fixo das versões anteriores); as de execuções em andamento são mais recentes.
+    """
+    padrao = re.compile(rf'{re.escape(tabela)}(?:{SUFIXO_STAGING}|{SUFIXO_ANTIGA})(?:_(\d+)_[0-9a-f]+)?')
+    limite = time.time() - idade
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE %s",
+            (f'{tabela}__%',)
+        )
+        abandonadas = []
+        for nome, in cursor.fetchall():
+            encontrado = padrao.fullmatch(nome)
+            if encontrado and (encontrado.group(1) is None or int(encontrado.group(1)) < limite):
+                abandonadas.append(nome)
+        if abandonadas:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(f'`{nome}`' for nome in abandonadas)}")
+            logging.info(f"Tabelas abandonadas de {tabela} removidas: {abandonadas}")
+
+
+class PublicacaoEmLotes:
+    """
+    Publicação de uma carga completa recebida em um ou mais lotes, conforme `modo` (ver MODOS_PUBLICACAO). Usada como
+    context manager: cada carregar(df) envia um lote e, ao final do bloco, a carga é publicada de uma vez (troca,
+    mescla ou commit); se o bloco ou a publicação falhar, a staging é descartada e a tabela publicada não muda. No modo
+    'upsert' os lotes vão direto para a tabela, em uma transação confirmada só na publicação.
+
+        with PublicacaoEmLotes(connection, 'slv_acordos', modo='swap') as publicacao:
+            for lote in lotes:
+                publicacao.carregar(lote)
+
+    Fora de um bloco `with`, iniciar(), concluir() e abortar() fazem as mesmas etapas explicitamente.
+    """
+
+    def __init__(self, connection, tabela, modo='swap', metodo='executemany', batch_size=DEFAULT_BATCH_SIZE):
+        validar_modo(modo)
+        self.connection = connection
+        self.tabela = tabela
+        self.modo = modo
+        self.metodo = metodo
+        self.batch_size = batch_size
+        self.total = 0
+        # A staging do 'merge' é temporária (visível só na própria conexão) e pode ter nome fixo
+        self._staging = _nome_execucao(tabela, SUFIXO_STAGING) if modo == 'swap' else tabela + SUFIXO_STAGING
+        self._contador = ContadorHashes()
+        self._colunas = None
+
+    def iniciar(self):
+        """Prepara a staging da carga (no 'upsert' não há staging)."""
+        if self.modo == 'swap':
+            with etapa(ETAPA_DDL):
+                remover_abandonadas(self.connection, self.tabela)
+                self._criar_staging()
+        elif self.modo == 'merge':
+            with etapa(ETAPA_DDL):
+                uma_vez(('hash_linha', self.tabela), _adicionar_hash_linha, self.connection, self.tabela)
+            with etapa(ETAPA_DDL), self.connection.cursor() as cursor:
+                cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{self._staging}`")
+                cursor.execute(f"CREATE TEMPORARY TABLE `{self._staging}` LIKE `{self.tabela}`")
+        return self
+
+    def carregar(self, df):
+        """Envia um lote da carga. Retorna o número de linhas enviadas."""
+        if self.modo == 'upsert':
+            n = bulk_load(self.connection, self.tabela, df, metodo=self.metodo, batch_size=self.batch_size,
+                          on_duplicate_update=True, confirmar=False)
+        else:
+            if self.modo == 'merge':
+                df = df.assign(**{COLUNA_HASH_LINHA: hash_linhas(df, self._contador).values})
+                self._colunas = list(df.columns)
+            n = bulk_load(self.connection, self._staging, df, metodo=self.metodo, batch_size=self.batch_size)
+        self.total += n
+        return n
+
+    def concluir(self):
+        """
+        Publica a carga: troca atômica ('swap'), mescla ('merge') ou commit ('upsert'). Se falhar, a carga é abortada.
+        Retorna o total de linhas carregadas.
+        """
+        try:
+            if self.modo == 'swap':
+                self._trocar()
+            elif self.modo == 'merge':
+                self._mesclar()
+            else:
+                self.connection.commit()
+        except Exception:
+            self.abortar()
+            raise
+        if self.modo == 'merge':
+            self._descartar_staging()
+        return self.total
+
+    def abortar(self):
+        """Desfaz a carga sem publicar (rollback e descarte da staging); a tabela publicada não muda."""
+        self.connection.rollback()
+        if self.modo != 'upsert':
+            self._descartar_staging()
+
+    def _descartar_staging(self):
+        temporaria = 'TEMPORARY ' if self.modo == 'merge' else ''
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP {temporaria}TABLE IF EXISTS `{self._staging}`")
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.concluir()
+        else:
+            self.abortar()
+        return False
+
+    def _criar_staging(self):
+        # A staging vem da DDL registrada da tabela (ver esquema.ddl_staging), com as chaves estrangeiras, que
+        # CREATE TABLE ... LIKE não copia, e recebe as colunas técnicas que a tabela publicada tiver
+        registrada = ddl_staging(self.tabela, self._staging)
+        with self.connection.cursor() as cursor:
+            if registrada is None:
+                logging.warning(f"DDL de {self.tabela} não registrada neste processo; staging criada com LIKE, "
+                                f"sem as chaves estrangeiras")
+                cursor.execute(f"CREATE TABLE `{self._staging}` LIKE `{self.tabela}`")
+                return
+            ddl, dimensoes = registrada
+            cursor.execute(ddl)
+        if dimensoes:
+            migrar_tabela(self.connection, self._staging, dimensoes)
+        colunas = colunas_tabela(self.connection, self.tabela)
+        if COLUNA_CHAVE in colunas:
+            adicionar_coluna_chave(self.connection, self._staging)
+        if COLUNA_HASH_LINHA in colunas:
+            _adicionar_hash_linha(self.connection, self._staging)
+
+    def _trocar(self):
+        antiga = _nome_execucao(self.tabela, SUFIXO_ANTIGA)
+        with etapa(ETAPA_DDL), self.connection.cursor() as cursor:
+            cursor.execute(f"RENAME TABLE `{self.tabela}` TO `{antiga}`, `{self._staging}` TO `{self.tabela}`")
+            # A troca já está publicada: uma falha na remoção da tabela antiga não a desfaz (remover_abandonadas a
+            # remove depois)
+            try:
+                cursor.execute(f"DROP TABLE `{antiga}`")
+            except Exception as e:
+                logging.warning(f"Não foi possível remover a tabela substituída {antiga}: {e}")
+        logging.info(f"Tabela {self.tabela} publicada por troca atômica ({self.total} linhas)")
+
+    def _mesclar(self):
+        # Linhas antigas sem hash (anteriores a este modo) são removidas na primeira mescla. As remoções vêm antes
+        # das inserções: uma linha alterada que mantém a chave natural da tabela (ex.: o `_grupo` dos rollups) só
+        # pode entrar depois que a versão antiga sai. Tudo em uma transação, confirmada ao final
+        colunas, inseridas = self._colunas, 0
+        with etapa(ETAPA_CARGA_DB), self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE t FROM `{self.tabela}` t LEFT JOIN `{self._staging}` s "
+                f"ON s.{COLUNA_HASH_LINHA} = t.{COLUNA_HASH_LINHA} WHERE s.{COLUNA_HASH_LINHA} IS NULL"
+            )
+            removidas = cursor.rowcount
+            if colunas:
+                cursor.execute(
+                    f"INSERT INTO `{self.tabela}` ({', '.join(f'`{c}`' for c in colunas)}) "
+                    f"SELECT {', '.join(f's.`{c}`' for c in colunas)} "
+                    f"FROM `{self._staging}` s LEFT JOIN `{self.tabela}` t "
+                    f"ON t.{COLUNA_HASH_LINHA} = s.{COLUNA_HASH_LINHA} WHERE t.{COLUNA_HASH_LINHA} IS NULL"
+                )
+                inseridas = cursor.rowcount
+            self.connection.commit()
+        logging.info(f"Tabela {self.tabela} mesclada pelo hash das linhas: {inseridas} inseridas, {removidas} removidas, "
+                     f"{self.total - inseridas} mantidas")
+
+
+def publicar_tabela(connection, tabela, df, modo='swap', metodo='executemany', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Publica a carga completa `df` na tabela do MariaDB (que já deve existir) conforme `modo` (ver MODOS_PUBLICACAO).
+    Retorna o número de linhas carregadas.
+    """
+    with PublicacaoEmLotes(connection, tabela, modo=modo, metodo=metodo, batch_size=batch_size) as publicacao:
+        publicacao.carregar(df)
+    return publicacao.total
+
+
+class TransacaoPendente:
+    """
+    Carga já aplicada na transação aberta da conexão (ex.: cdc.aplicar_delta_tabela com confirmar=False), com a
+    interface de PublicacaoEmLotes para a etapa final de snapshots.publicar_snapshot: concluir() faz o commit e
+    abortar() o rollback.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def concluir(self):
+        self.connection.commit()
+
+    def abortar(self):
+        self.connection.rollback()
+
+
+class ErroPublicacao(RuntimeError):
+    """Falha de uma ou mais saídas de uma EtapaPublicacao; `erros` traz a exceção de cada saída ({saída: exceção})."""
+
+    def __init__(self, erros):
+        self.erros = erros
+        super().__init__(f"Falha ao publicar as saídas {sorted(erros)}: {erros}")
+
+
+class EtapaPublicacao:
+    """
+    Publicação concorrente das saídas de uma tarefa em pools limitados de threads. Cada saída é entregue com
+    publicar(nome, funcao, *args) assim que está pronta e roda em paralelo com a construção das próximas e com as
+    publicações das outras (até `max_workers`); dentro dela, enviar(funcao, *args) põe um envio ao MinIO em um pool
+    próprio, em paralelo com a carga no MariaDB. Assim o tempo da etapa fica próximo ao da saída mais lenta, e não à
+    soma de todos os envios e cargas.
+
+        with EtapaPublicacao() as publicacoes:
+            for nome, df in saidas:
+                publicacoes.publicar(nome, publicar_saida, publicacoes, df)
+
+    Cada saída confirma ou desfaz a sua parte de forma independente (ver desfazer_envio): uma falha não interrompe as
+    demais e, ao final do bloco `with`, a etapa levanta ErroPublicacao com o erro de cada saída que falhou.
+    """
+
+    def __init__(self, max_workers=MAX_PUBLICACOES_PARALELAS, max_envios=MAX_ENVIOS_PARALELOS):
+        self._saidas = ThreadPoolExecutor(max_workers=max_workers)
+        self._envios = ThreadPoolExecutor(max_workers=max_envios)
+        self._futuros = {}
+
+    def publicar(self, nome, funcao, *args, **kwargs):
+        """Agenda a publicação da saída `nome`, funcao(*args, **kwargs)."""
+        # Cada publicação roda em uma cópia do contexto para que as métricas cheguem ao coletor da tarefa
+        self._futuros[nome] = self._saidas.submit(contextvars.copy_context().run, funcao, *args, **kwargs)
+
+    def enviar(self, funcao, *args, **kwargs):
+        """Agenda um envio ao MinIO, funcao(*args, **kwargs), e retorna o seu Future."""
+        return self._envios.submit(contextvars.copy_context().run, funcao, *args, **kwargs)
+
+    def concluir(self):
+        """Espera todas as saídas. Retorna {saída: resultado}; levanta ErroPublicacao se alguma falhou."""
+        resultados, erros = {}, {}
+        for nome, futuro in self._futuros.items():
+            try:
+                resultados[nome] = futuro.result()
+            except Exception as e:
+                logging.error(f"Erro ao publicar a saída '{nome}': {e}")
+                erros[nome] = e
+        if erros:
+            raise ErroPublicacao(erros)
+        return resultados
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Com erro no próprio bloco, as saídas já agendadas terminam (confirmando ou desfazendo) antes da propagação
+        try:
+            if exc_type is None:
+                self.concluir()
+            else:
+                for futuro in self._futuros.values():
+                    futuro.exception()
+        finally:
+            self._saidas.shutdown()
+            self._envios.shutdown()
+        return False
+
+
+def desfazer_envio(futuro, desfazer):
+    """
+    Espera um envio agendado com EtapaPublicacao.enviar e desfaz o que ele gravou, desfazer(resultado). Um envio que
+    falhou não deixa nada para desfazer.
+    """
+    try:
+        resultado = futuro.result()
+    except Exception:
+        return
+    desfazer(resultado)
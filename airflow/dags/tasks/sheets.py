@@ -0,0 +1,303 @@
+import contextvars
+import functools
+import gzip
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import gspread
+import pandas as pd
+from google.oauth2.service_account import Credentials
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import absolute_range_name, fill_gaps, numericise_all
+
+from tasks.metricas import ETAPA_LEITURA_PLANILHA, etapa
+from tasks.storage import delete_keys, list_keys, read_bytes, write_bytes
+
+logger = logging.getLogger(__name__)
+
+CREDENCIAIS = '/opt/airflow/config_airflow/credentials.json'
+# Leitura das planilhas e dos metadados do Drive (revisão consultada antes de qualquer leitura das abas)
+ESCOPO = ["https://www.googleapis.com/auth/spreadsheets.readonly",
+          "https://www.googleapis.com/auth/drive.metadata.readonly"]
+
+# Cota de leitura da API do Google Sheets por usuário (requisições por minuto)
+LEITURAS_POR_MINUTO = 60
+
+# Requisições que podem sair em rajada antes de o limitador passar a espaçá-las
+RAJADA = 10
+
+# Abas lidas por requisição values_batch_get
+ABAS_POR_LOTE = 10
+
+# Threads de leitura concorrentes (as requisições continuam sujeitas ao limitador)
+MAX_LEITURAS_PARALELAS = 4
+
+# Prefixo, no bucket da bronze, das respostas brutas da API guardadas por revisão da planilha (CacheRespostas)
+PREFIXO_CACHE = '_planilhas'
+
+# Cabeçalho esperado de cada aba: todas essas colunas precisam estar presentes (como o expected_headers do
+# get_all_records)
+EXPECTED_HEADERS = {
+    'Geral': ['Data de Celebração', 'Parceiro', 'Tipo de Parceiro', 'Continente', 'Região', 'Local de Assinatura',
+              'Tipo de Acordo', 'Título', 'Objetivo', 'Recursos', 'Tipo de Documento', 'Vigência', 'Link'],
+}
+
+
+class TokenBucket:
+    """Limitador de taxa thread-safe: `taxa` fichas por segundo, acumulando no máximo `capacidade` fichas."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._fichas = capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloqueia até haver uma ficha disponível e a consome."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa
+            time.sleep(espera)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sheets_client(credentials_file=CREDENCIAIS):
+    """
+    Cliente gspread autorizado uma única vez por processo worker e compartilhado por todas as abas e planilhas.
+    Respostas 429 (cota excedida) são refeitas com backoff exponencial pelo BackOffHTTPClient.
+    """
+    creds = Credentials.from_service_account_file(credentials_file, scopes=ESCOPO)
+    return gspread.authorize(creds, http_client=gspread.BackOffHTTPClient)
+
+
+@functools.lru_cache(maxsize=None)
+def limitador(leituras_por_minuto=LEITURAS_POR_MINUTO):
+    """Token bucket compartilhado pelas leituras do processo, respeitando a cota de leitura do Sheets."""
+    return TokenBucket(leituras_por_minuto / 60, capacidade=RAJADA)
+
+
+def revisao(client, sheet_id):
+    """
+    Revisão atual da planilha segundo o Drive (campo version, que muda a cada edição, ou modifiedTime), com uma
+    requisição que não consome a cota de leitura do Sheets. None se os metadados não puderem ser lidos (ex.:
+    credencial sem o escopo do Drive); nesse caso a planilha é sempre lida por inteiro.
+    """
+    try:
+        metadados = client.http_client.request(
+            'get', f'{DRIVE_FILES_API_V3_URL}/{sheet_id}',
+            params={'supportsAllDrives': True, 'fields': 'version,modifiedTime'},
+        ).json()
+    except Exception as e:
+        logging.warning(f"Revisão da planilha {sheet_id} indisponível; as abas serão lidas da API: {e}")
+        return None
+    return str(metadados.get('version') or metadados.get('modifiedTime') or '') or None
+
+
+def revisoes(planilhas):
+    """Revisão de cada planilha de `planilhas` ({sheet_id: [abas]}): {sheet_id: revisão ou None}."""
+    client = get_sheets_client()
+    return {sheet_id: revisao(client, sheet_id) for sheet_id in planilhas}
+
+
+class CacheRespostas:
+    """
+    Respostas brutas da API (valores de cada aba, como vêm do values_batch_get) guardadas no MinIO por revisão da
+    planilha, em JSON comprimido: <prefixo>/<sheet_id>/<revisão>/<aba>.json.gz. Enquanto a revisão não muda, as abas
+    são lidas do cache sem nenhuma requisição ao Sheets; as revisões anteriores de uma planilha são removidas por
+    limpar().
+    """
+
+    def __init__(self, minio_client, bucket_name, prefixo=PREFIXO_CACHE):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.prefixo = prefixo
+
+    def _prefixo_revisao(self, sheet_id, revisao):
+        return f'{self.prefixo}/{sheet_id}/{quote(revisao, safe="")}/'
+
+    def _key(self, sheet_id, revisao, aba):
+        return f'{self._prefixo_revisao(sheet_id, revisao)}{quote(aba, safe="")}.json.gz'
+
+    def ler(self, sheet_id, revisao, aba):
+        """Valores da aba na revisão, ou None se não estiverem no cache."""
+        resposta = read_bytes(self.minio_client, self.bucket_name, self._key(sheet_id, revisao, aba))
+        if resposta is None:
+            return None
+        return json.loads(gzip.decompress(resposta[0]))
+
+    def gravar(self, sheet_id, revisao, aba, valores):
+        dados = gzip.compress(json.dumps(valores, ensure_ascii=False).encode('utf-8'), compresslevel=6)
+        write_bytes(self.minio_client, dados, self.bucket_name, self._key(sheet_id, revisao, aba),
+                    content_type='application/gzip')
+
+    def limpar(self, sheet_id, revisao):
+        """Remove as respostas guardadas de outras revisões da planilha."""
+        atual = self._prefixo_revisao(sheet_id, revisao)
+        antigas = [k for k in list_keys(self.minio_client, self.bucket_name, f'{self.prefixo}/{sheet_id}/')
+                   if not k.startswith(atual)]
+        if antigas:
+            delete_keys(self.minio_client, self.bucket_name, antigas)
+            logging.info(f"Cache da planilha {sheet_id}: {len(antigas)} respostas de revisões anteriores removidas")
+
+
+def registros(valores, sheet_name):
+    """
+    Converte os valores brutos de uma aba (lista de linhas, a primeira sendo o cabeçalho) em uma lista de dicionários,
+    como o get_all_records: linhas completadas até a largura da aba e números convertidos. Cabeçalhos repetidos são
+    renomeados (ver desduplicar) e, se a aba tem EXPECTED_HEADERS, todos os esperados precisam estar presentes.
+    """
+    if not valores:
+        return []
+    valores = fill_gaps(valores)
+    cabecalho = _validar_cabecalho(valores[0], sheet_name)
+    return [dict(zip(cabecalho, numericise_all(linha))) for linha in valores[1:]]
+
+
+def desduplicar(cabecalho):
+    """Nomes únicos para as colunas: as repetições recebem os sufixos _2, _3, ... (Link, Link -> Link, Link_2)."""
+    originais, usados, unicos = set(cabecalho), set(), []
+    for nome in cabecalho:
+        novo, n = nome, 1
+        while novo in usados or (novo != nome and novo in originais):
+            n += 1
+            novo = f'{nome}_{n}'
+        usados.add(novo)
+        unicos.append(novo)
+    return unicos
+
+
+def _validar_cabecalho(cabecalho, sheet_name):
+    esperados = EXPECTED_HEADERS.get(sheet_name)
+    if esperados is not None and not set(esperados) <= set(cabecalho):
+        raise ValueError(f"Cabeçalhos esperados ausentes na aba {sheet_name}: {set(esperados) - set(cabecalho)}")
+    unicos = desduplicar(cabecalho)
+    if unicos != list(cabecalho):
+        renomeados = [f'{a} -> {b}' for a, b in zip(cabecalho, unicos) if a != b]
+        logging.warning(f"Cabeçalhos repetidos na aba {sheet_name} renomeados: {renomeados}")
+    return unicos
+
+
+def registros_em_lotes(valores, sheet_name, linhas_por_lote):
+    """
+    Como registros, mas produz DataFrames de até `linhas_por_lote` linhas (modo streaming): apenas a resposta bruta da
+    API e um lote convertido ficam em memória ao mesmo tempo. O cabeçalho é validado antes do primeiro lote.
+    """
+    largura = max(len(linha) for linha in valores)
+    cabecalho = _validar_cabecalho(fill_gaps(valores[:1], cols=largura)[0], sheet_name)
+    for inicio in range(1, len(valores), linhas_por_lote):
+        lote = fill_gaps(valores[inicio:inicio + linhas_por_lote], cols=largura)
+        yield pd.DataFrame([dict(zip(cabecalho, numericise_all(linha))) for linha in lote])
+
+
+def _converter(valores, aba, linhas_por_lote=None):
+    if len(valores) < 2:
+        raise ValueError(f"Nenhum dado foi retornado para a planilha {aba}")
+    if linhas_por_lote:
+        return registros_em_lotes(valores, aba, linhas_por_lote)
+    return pd.DataFrame(registros(valores, aba))
+
+
+def _ler_lote(sheet_id, planilha, abas, bucket, linhas_por_lote=None, cache=None, revisao_planilha=None):
+    # Retorna ({aba: DataFrame}, {aba: exceção}): uma aba que não pode ser convertida não descarta as outras do lote
+    bucket.adquirir()
+    with etapa(ETAPA_LEITURA_PLANILHA) as medicao:
+        resposta = planilha.values_batch_get([absolute_range_name(aba) for aba in abas])
+        dados, erros, medicao.linhas = {}, {}, 0
+        for aba, intervalo in zip(abas, resposta.get('valueRanges', [])):
+            valores = intervalo.get('values', [])
+            try:
+                dados[aba] = _converter(valores, aba, linhas_por_lote)
+            except Exception as e:
+                erros[aba] = e
+                continue
+            medicao.linhas += len(valores) - 1
+            if cache is not None:
+                cache.gravar(sheet_id, revisao_planilha, aba, valores)
+    logging.info(f"Abas {sorted(dados)} lidas da planilha {planilha.id}")
+    return dados, erros
+
+
+def _registrar_erro(erros, sheet_id, abas, erro):
+    if erros is None:
+        raise erro
+    logging.error(f"Erro ao ler as abas {abas} da planilha {sheet_id}: {erro}")
+    erros.update({(sheet_id, aba): erro for aba in abas})
+
+
+def ler_planilhas(planilhas, max_workers=MAX_LEITURAS_PARALELAS, linhas_por_lote=None, revisoes=None, cache=None,
+                  erros=None):
+    """
+    Lê as abas de uma ou mais planilhas com um único cliente autorizado. `planilhas` mapeia o ID de cada planilha para
+    a lista de abas. As abas são agrupadas em requisições values_batch_get de até ABAS_POR_LOTE abas, executadas em
+    paralelo sob o limitador de taxa.
+
+    Com `cache` (CacheRespostas) e a revisão de cada planilha em `revisoes` ({sheet_id: revisão}), as abas já
+    guardadas nessa revisão são lidas do cache, sem requisições ao Sheets (nem o open_by_key, se todas estiverem
+    guardadas); as demais são lidas da API e guardadas.
+
+    Retorna {(sheet_id, aba): DataFrame}; com `linhas_por_lote`, cada aba vem como um iterador de DataFrames de até
+    esse número de linhas (ver registros_em_lotes). Com o dicionário `erros`, uma aba que não pode ser lida (ex.: aba
+    vazia, ou falha da requisição do seu lote) é registrada nele como {(sheet_id, aba): exceção} e as demais seguem;
+    sem ele, o primeiro erro interrompe a leitura.
+    """
+    client = get_sheets_client()
+    bucket = limitador()
+    revisoes = revisoes or {}
+    dados, lotes = {}, []
+    for sheet_id, abas in planilhas.items():
+        revisao_planilha = revisoes.get(sheet_id)
+        cache_planilha = cache if revisao_planilha is not None else None
+        faltantes = []
+        for aba in abas:
+            valores = cache_planilha.ler(sheet_id, revisao_planilha, aba) if cache_planilha is not None else None
+            if valores is None:
+                faltantes.append(aba)
+                continue
+            try:
+                dados[(sheet_id, aba)] = _converter(valores, aba, linhas_por_lote)
+            except Exception as e:
+                _registrar_erro(erros, sheet_id, [aba], e)
+                continue
+            logging.info(f"Aba {aba} lida do cache da revisão {revisao_planilha} da planilha {sheet_id}")
+        if not faltantes:
+            continue
+        # open_by_key consulta os metadados da planilha: uma requisição por planilha, não por aba
+        bucket.adquirir()
+        try:
+            planilha = client.open_by_key(sheet_id)
+        except Exception as e:
+            _registrar_erro(erros, sheet_id, faltantes, e)
+            continue
+        lotes.extend((sheet_id, planilha, faltantes[i:i + ABAS_POR_LOTE], cache_planilha, revisao_planilha)
+                     for i in range(0, len(faltantes), ABAS_POR_LOTE))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Cada leitura roda em uma cópia do contexto para que as métricas cheguem ao coletor da tarefa
+        futuros = [(sheet_id, abas, executor.submit(contextvars.copy_context().run, _ler_lote, sheet_id, planilha,
+                                                    abas, bucket, linhas_por_lote, cache_planilha, revisao_planilha))
+                   for sheet_id, planilha, abas, cache_planilha, revisao_planilha in lotes]
+        for sheet_id, abas, futuro in futuros:
+            try:
+                lidas, falhas = futuro.result()
+            except Exception as e:
+                _registrar_erro(erros, sheet_id, abas, e)
+                continue
+            dados.update({(sheet_id, aba): df for aba, df in lidas.items()})
+            for aba, erro in falhas.items():
+                _registrar_erro(erros, sheet_id, [aba], erro)
+
+    if cache is not None:
+        for sheet_id in {sheet_id for sheet_id, _, _, cache_planilha, _ in lotes if cache_planilha is not None}:
+            cache.limpar(sheet_id, revisoes[sheet_id])
+    return dados
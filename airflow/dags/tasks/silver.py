@@ -1,147 +1,275 @@
-import boto3
+import functools
+import numpy as np
 import pandas as pd
-import io
 import logging
-from airflow.providers.mysql.hooks.mysql import MySqlHook
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+from tasks.loader import DEFAULT_BATCH_SIZE
+from tasks.publicacao import EtapaPublicacao, PublicacaoEmLotes, TransacaoPendente, desfazer_envio, validar_modo
+from tasks.storage import get_client
+from tasks.snapshots import (EscritorSnapshot, descartar_snapshot, gravar_snapshot, manifest_key, publicar_snapshot,
+                             referencia, read_snapshot, iter_snapshot, snapshot_atual)
+from tasks.cdc import (COLUNA_CHAVE, ContadorHashes, delta_key, deduplicar, ler_entrada, mesclar, montar_delta, write_delta,
+                       aplicar_delta_tabela, validar_streaming, ler_conteudo, sem_duplicadas, write_conteudo)
+from tasks.cache import STATUS_EM_DIA, versao_codigo, linhagem, em_dia
+from tasks.dimensoes import DIMENSOES, como_categorias, substituir_por_chaves
+from tasks.conexoes import conexao
+from tasks.esquema import garantir_tabela
+from tasks.metricas import ETAPA_TRANSFORMACAO, ETAPA_CARGA_DB, etapa, instrumentar
+from tasks.motores import MOTOR_PADRAO, get_motor
+
 logger = logging.getLogger(__name__)
 
-def transform_and_load_silver(bucket_name, key, endpoint_url, access_key, secret_key, bucket2_name='silver'):
+COLUNAS_ACORDOS = ['parceiro', 'tipo_de_parceiro', 'continente', 'região', 'local_de_assinatura', 'tipo_de_acordo',
+                   'título', 'objetivo', 'recursos', 'tipo_de_documento', 'ano']
+
+# Colunas da camada bronze usadas na silver
+COLUNAS_BRONZE = ['data_de_celebração'] + [c for c in COLUNAS_ACORDOS if c != 'ano']
+
+# Ordenação do snapshot silver: agrupa nos mesmos row groups os valores filtrados pela camada gold
+ORDEM_SNAPSHOT = ['tipo_de_parceiro', 'ano']
+
+NAO_INFORMADO = 'não informado'
+
+# Regras de limpeza por coluna:
+#   sentinela  - valor da planilha que representa ausência de dado
+#   preencher  - valor usado para nulos e sentinelas
+#   normalizar - 'title': remove espaços das bordas e aplica title case
+#   categoria  - mantém a coluna como pandas Categorical (colunas de baixa cardinalidade)
+LIMPEZA = {
+    'parceiro': {'normalizar': 'title'},
+    'tipo_de_parceiro': {'normalizar': 'title', 'categoria': True},
+    'continente': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title', 'categoria': True},
+    'região': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title', 'categoria': True},
+    'local_de_assinatura': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title'},
+    'tipo_de_acordo': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title', 'categoria': True},
+    'título': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title'},
+    'objetivo': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title'},
+    'recursos': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title', 'categoria': True},
+    'tipo_de_documento': {'sentinela': '-', 'preencher': NAO_INFORMADO, 'normalizar': 'title', 'categoria': True},
+}
+
+CREATE_TABLE_ACORDOS_SQL = """
+CREATE TABLE IF NOT EXISTS slv_acordos (
+    cod_acordo INT PRIMARY KEY AUTO_INCREMENT,
+    parceiro VARCHAR(255),
+    id_tipo_de_parceiro INT,
+    id_continente INT,
+    id_região INT,
+    local_de_assinatura VARCHAR(255),
+    id_tipo_de_acordo INT,
+    título TEXT,
+    objetivo TEXT,
+    id_recursos INT,
+    id_tipo_de_documento INT,
+    ano VARCHAR(255),
+    CONSTRAINT fk_slv_acordos_tipo_de_parceiro FOREIGN KEY (id_tipo_de_parceiro) REFERENCES dim_tipo_de_parceiro (id),
+    CONSTRAINT fk_slv_acordos_continente FOREIGN KEY (id_continente) REFERENCES dim_continente (id),
+    CONSTRAINT fk_slv_acordos_região FOREIGN KEY (id_região) REFERENCES dim_região (id),
+    CONSTRAINT fk_slv_acordos_tipo_de_acordo FOREIGN KEY (id_tipo_de_acordo) REFERENCES dim_tipo_de_acordo (id),
+    CONSTRAINT fk_slv_acordos_recursos FOREIGN KEY (id_recursos) REFERENCES dim_recursos (id),
+    CONSTRAINT fk_slv_acordos_tipo_de_documento FOREIGN KEY (id_tipo_de_documento) REFERENCES dim_tipo_de_documento (id)
+)
+"""
+
+
+def _limpar_coluna(serie, regra, motor):
+    """
+    Aplica a regra de limpeza sobre os valores distintos da coluna e remapeia os códigos (ver motores.limpar), em vez
+    de repetir fillna/replace/strip/title sobre todas as linhas.
+    """
+    codigos, categorias = motor.limpar(serie, sentinela=regra.get('sentinela'), preencher=regra.get('preencher'),
+                                       titulo=regra.get('normalizar') == 'title')
+    if regra.get('categoria'):
+        return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=serie.index)
+    resultado = np.asarray(categorias, dtype=object)[codigos]
+    resultado[codigos < 0] = None
+    return pd.Series(resultado, index=serie.index, dtype=object)
+
+
+def limpar_acordos(df, regras=None, motor=None):
+    """
+    Tratamento de nulos, normalização de texto e criação das colunas derivadas dos acordos, conforme LIMPEZA, com o
+    `motor` de transformação (ver tasks.motores; por padrão, pandas).
+    """
+    regras = LIMPEZA if regras is None else regras
+    motor = motor or get_motor()
+    df = df.assign(**{coluna: _limpar_coluna(df[coluna], regra, motor) for coluna, regra in regras.items()})
+
+    # Criação de novas colunas
+    df['ano'] = motor.ano(df['data_de_celebração'])
+    return df
+
+
+def _silver_em_lotes(minio_client, bucket_name, key, bucket2_name, slv_key, metadata, load_method, batch_size,
+                     publish_mode, motor):
+    """
+    Modo streaming da camada silver: a bronze é lida em lotes e cada lote passa pela limpeza, pela deduplicação por
+    hash (que vale entre lotes), pela carga na staging do MariaDB e pelo snapshot silver antes do próximo. A memória
+    fica limitada a um lote mais 16 bytes por linha distinta. O snapshot não é ordenado por ORDEM_SNAPSHOT.
+    """
+    slv_name = 'slv_acordos'
+    contador = ContadorHashes()
+    # Snapshot da bronze lido do início ao fim, registrado como origem do snapshot silver
+    origem = (snapshot_atual(minio_client, bucket_name, key) or {}).get('id')
+    # Os valores novos das dimensões são cadastrados (e confirmados) em outra conexão: um commit na da carga
+    # confirmaria os lotes já carregados no modo upsert
+    with conexao() as connection, conexao() as cadastro:
+        garantir_tabela(connection, slv_name, CREATE_TABLE_ACORDOS_SQL, DIMENSOES, ['cod_acordo'] + COLUNAS_ACORDOS)
+        logging.info("Tabela slv_acordos criada/verificada com sucesso.")
+        # A tabela é publicada logo depois da troca do manifesto do snapshot silver, que é desfeita se ela falhar
+        publicacao = PublicacaoEmLotes(connection, slv_name, modo=publish_mode, metodo=load_method,
+                                       batch_size=batch_size).iniciar()
+        with EscritorSnapshot(minio_client, bucket2_name, slv_key, metadata=metadata, particao='ano', origem=origem,
+                              publicacao=publicacao) as escritor:
+            for lote in iter_snapshot(minio_client, bucket_name, key, columns=COLUNAS_BRONZE, snapshot=origem):
+                with etapa(ETAPA_TRANSFORMACAO, linhas=len(lote)):
+                    lote = deduplicar(limpar_acordos(lote, motor=motor)[COLUNAS_ACORDOS], contador)
+                with etapa(ETAPA_CARGA_DB):
+                    db_lote = substituir_por_chaves(cadastro, lote)
+                publicacao.carregar(db_lote)
+                escritor.escrever(como_categorias(lote))
+    logging.info(f"Camada '{slv_name}' processada em lotes: {escritor.linhas} linhas no dataset {slv_key}")
+
+
+def _publicar(publicacoes, minio_client, bucket2_name, slv_name, slv_key, slv_df, snapshot_df, metadata, incremental,
+              chaves, base, id_base, origem, conteudo, load_method, batch_size, publish_mode):
+    """
+    Publica a camada silver (executada pela EtapaPublicacao): os arquivos do snapshot são enviados ao MinIO enquanto
+    a carga vai para o MariaDB sem ser confirmada (transação aberta ou staging). A etapa final troca o manifesto do
+    snapshot, com a linhagem, e só então confirma a carga (commit ou troca/mescla da tabela); se a confirmação falhar,
+    o manifesto volta ao anterior. Qualquer falha desfaz a carga e remove os arquivos enviados. O delta para a gold e
+    o conteúdo das linhas da bronze (ver cdc.sem_duplicadas) são gravados depois da publicação.
+
+    O snapshot registra como `origem` o snapshot da bronze lido, e o delta, o snapshot silver anterior (`id_base`) e
+    o novo, para que a gold só o aplique sobre uma base produzida a partir do mesmo snapshot silver (ver
+    cdc.ler_entrada).
+    """
+    envio = publicacoes.enviar(gravar_snapshot, minio_client, snapshot_df, bucket2_name, slv_key, particao='ano',
+                               origem=origem)
+    # Criar e popular tabelas no MariaDB, com uma conexão do pool do processo
+    with conexao() as connection:
+        publicacao = None
+        try:
+            garantir_tabela(connection, slv_name, CREATE_TABLE_ACORDOS_SQL, DIMENSOES, ['cod_acordo'] + COLUNAS_ACORDOS)
+            logging.info("Tabela slv_acordos criada/verificada com sucesso.")
+
+            # Inserir dados em lotes, com as dimensões trocadas pelas chaves das tabelas de lookup
+            with etapa(ETAPA_CARGA_DB):
+                db_df = substituir_por_chaves(connection, slv_df)
+            if incremental:
+                aplicar_delta_tabela(connection, slv_name, db_df, chaves, metodo=load_method, batch_size=batch_size,
+                                     confirmar=False)
+                publicacao = TransacaoPendente(connection)
+            else:
+                publicacao = PublicacaoEmLotes(connection, slv_name, modo=publish_mode, metodo=load_method,
+                                               batch_size=batch_size).iniciar()
+                publicacao.carregar(db_df)
+            snapshot = envio.result()
+        except Exception:
+            if publicacao is not None:
+                publicacao.abortar()
+            desfazer_envio(envio, functools.partial(descartar_snapshot, minio_client, bucket2_name))
+            raise
+
+        # Etapa final: troca do manifesto (com a linhagem) e confirmação da carga no MariaDB
+        publicar_snapshot(minio_client, bucket2_name, slv_key, snapshot, metadata=metadata, publicacao=publicacao)
+    logging.info(f"Dados inseridos/atualizados na tabela {slv_name}.")
+    logging.info(f"Camada '{slv_name}' salva no MinIO no dataset: {slv_key}")
+
+    if incremental:
+        write_delta(minio_client, montar_delta(slv_df, chaves, base), bucket2_name, slv_key, completo=chaves is None,
+                    metadata=metadata, base=id_base, snapshot=snapshot['id'])
+        write_conteudo(minio_client, conteudo, bucket2_name, slv_key, snapshot['id'])
+
+
+@instrumentar('silver')
+def transform_and_load_silver(bucket_name, key, endpoint_url, access_key, secret_key, bucket2_name='silver',
+                              load_method='executemany', batch_size=DEFAULT_BATCH_SIZE, incremental=False,
+                              publish_mode='swap', force=False, streaming=False, engine=MOTOR_PADRAO):
     """
     Função para tratamento de nulos, normalização de texto, criação de colunas derivadas e validação de regras de negócio, salvando a camada silver
     resultante no MinIO e MariaDB.
+
+    Com incremental=True, lê apenas o delta publicado pela camada bronze, mescla as linhas alteradas no snapshot silver
+    anterior pela coluna `_chave` e publica o próprio delta para a camada gold. Linhas repetidas são descartadas pelo
+    hash do conteúdo (ver cdc.sem_duplicadas), com o mesmo resultado do drop_duplicates da carga completa.
+
+    A saída carrega nos metadados a linhagem (ETag das entradas, versão do código e parâmetros); se ela já corresponde
+    às entradas atuais, a tarefa termina com o status "skipped: up to date" sem reprocessar (force=True ignora o cache).
+
+    Cargas completas são publicadas no MariaDB conforme `publish_mode`: 'swap' (staging + RENAME TABLE atômico),
+    'merge' (mescla pelo hash determinístico das linhas) ou 'upsert' (INSERT direto, como antes). O modo incremental
+    continua aplicando o delta na própria tabela.
+
+    O envio do snapshot ao MinIO e a carga no MariaDB rodam ao mesmo tempo (ver _publicar).
+
+    Com streaming=True (apenas cargas completas), a bronze é processada em lotes de tamanho limitado, sem carregar o
+    dataset inteiro em memória; drop_duplicates é substituído por uma deduplicação por hash entre os lotes.
+
+    `engine` escolhe o motor das transformações (ver tasks.motores.MOTORES): 'pandas' ou 'arrow' (pyarrow.compute),
+    com saídas idênticas.
     """
-    # Configurar cliente MinIO
-    minio_client = boto3.client(
-        's3',
-        endpoint_url=endpoint_url,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key
-    )
-    
+    validar_modo(publish_mode)
+    validar_streaming(streaming, incremental)
+    motor = get_motor(engine)
+    # Cliente MinIO compartilhado pelo processo worker
+    minio_client = get_client(endpoint_url, access_key, secret_key)
+    slv_name = 'slv_acordos'
+    slv_key = f'silver/{slv_name}.parquet'
+
     try:
-        # Listar objetos no bucket para verificar a chave correta
-        objects = minio_client.list_objects_v2(Bucket=bucket_name)
-        keys = [obj['Key'] for obj in objects.get('Contents', [])]
-        if key not in keys:
-            logging.error(f"Erro: A chave especificada '{key}' não existe no bucket '{bucket_name}'. Chaves disponíveis: {keys}")
+        # Verificar a existência do dataset (manifesto) com um HEAD, sem listar o bucket
+        atual = referencia(minio_client, bucket_name, key)
+        if atual is None:
+            logging.error(f"Erro: A chave especificada '{key}' não existe no bucket '{bucket_name}'.")
             raise minio_client.exceptions.NoSuchKey(f"A chave especificada '{key}' não existe no bucket '{bucket_name}'.")
 
-        # Ler dados do MinIO
-        response = minio_client.get_object(Bucket=bucket_name, Key=key)
-        df = pd.read_parquet(io.BytesIO(response['Body'].read()))
-        
-        #Tratamento de valores nulos
-        df['continente'].fillna('não informado')
-        df['continente'] = df['continente'].replace('-', 'não informado')
-        df['região'] = df['região'].fillna('não informado')
-        df['região'] = df['região'].replace('-', 'não informado')
-        df['local_de_assinatura'] = df['local_de_assinatura'].fillna('não informado')
-        df['local_de_assinatura'] = df['local_de_assinatura'].replace('-', 'não informado')
-        df['tipo_de_acordo'] = df['tipo_de_acordo'].fillna('não informado')
-        df['tipo_de_acordo'] = df['tipo_de_acordo'].replace('-', 'não informado')
-        df['título'] = df['título'].fillna('não informado')
-        df['título'] = df['título'].replace('-', 'não informado')
-        df['objetivo'] = df['objetivo'].fillna('não informado')
-        df['objetivo'] = df['objetivo'].replace('-', 'não informado')
-        df['recursos'] = df['recursos'].fillna('não informado')
-        df['recursos'] = df['recursos'].replace('-', 'não informado')
-        df['tipo_de_documento'] = df['tipo_de_documento'].fillna('não informado')
-        df['tipo_de_documento'] = df['tipo_de_documento'].replace('-', 'não informado')
-
-
-        #Normalização de todas as colunas textuais
-        df['parceiro'] = df['parceiro'].str.strip().str.title()
-        df['tipo_de_parceiro'] = df['tipo_de_parceiro'].str.strip().str.title()
-        df['continente'] = df['continente'].str.strip().str.title()
-        df['região'] = df['região'].str.strip().str.title()
-        df['local_de_assinatura'] = df['local_de_assinatura'].str.strip().str.title()
-        df['tipo_de_acordo'] = df['tipo_de_acordo'].str.strip().str.title()
-        df['título'] = df['título'].str.strip().str.title()
-        df['objetivo'] = df['objetivo'].str.strip().str.title()
-        df['recursos'] = df['recursos'].str.strip().str.title()
-        df['tipo_de_documento'] = df['tipo_de_documento'].str.strip().str.title()
-
-
-        # Criação de novas colunas
-        df['ano'] = df['data_de_celebração'].dt.year
-
-        # Transformação da camada silver 
-        slv_acordos_df = df[['parceiro', 'tipo_de_parceiro', 'continente', 'região', 'local_de_assinatura', 'tipo_de_acordo', 'título', 'objetivo', 'recursos', 'tipo_de_documento', 'ano']].drop_duplicates()
-
-    
-        
-        # Salvar camada silver no MinIO
-        for slv_df, slv_name in [
-            (slv_acordos_df, 'slv_acordos'),
-            
-        ]:
-            output_buffer = io.BytesIO()
-            slv_df.to_parquet(output_buffer, index=False)
-            output_buffer.seek(0)
-            slv_key = f'silver/{slv_name}.parquet'
-            minio_client.put_object(
-                Bucket=bucket2_name,
-                Key=slv_key,
-                Body=output_buffer.getvalue()
-            )
-            logging.info(f"Camada '{slv_name}' salva no MinIO com a chave: {slv_key}")
-            
-            # Criar e popular tabelas no MariaDB
-            mysql_hook = MySqlHook(mysql_conn_id='local_mariadb')
-            connection = mysql_hook.get_conn()
-            with connection.cursor() as cursor:
-                # Criar tabela slv_clientes
-                create_table_acordos_sql = """
-                CREATE TABLE IF NOT EXISTS slv_acordos (
-                    cod_acordo INT PRIMARY KEY AUTO_INCREMENT,
-                    parceiro VARCHAR(255),
-                    tipo_de_parceiro VARCHAR(255),
-                    continente VARCHAR(255),
-                    região VARCHAR(255),
-                    local_de_assinatura VARCHAR(255),
-                    tipo_de_acordo VARCHAR(255),
-                    título TEXT,
-                    objetivo TEXT,
-                    recursos VARCHAR(255),
-                    tipo_de_documento VARCHAR(255),
-                    ano VARCHAR(255)
-                )
-                """
-                cursor.execute(create_table_acordos_sql)
-                logging.info("Tabela slv_acordos criada/verificada com sucesso.")
-                
-                
-                # Inserir dados
-                if slv_name == 'slv_acordos':
-                    for _, row in slv_df.iterrows():
-                        insert_sql = """
-                        INSERT INTO slv_acordos
-                        (parceiro, tipo_de_parceiro, continente, região, local_de_assinatura, tipo_de_acordo, título, objetivo, recursos, tipo_de_documento, ano)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        parceiro=VALUES(parceiro),
-                        tipo_de_parceiro=VALUES(tipo_de_parceiro),
-                        continente=VALUES(continente),
-                        região=VALUES(região),
-                        local_de_assinatura=VALUES(local_de_assinatura),
-                        tipo_de_acordo=VALUES(tipo_de_acordo),
-                        título=VALUES(título),
-                        objetivo=VALUES(objetivo),
-                        recursos=VALUES(recursos),
-                        tipo_de_documento=VALUES(tipo_de_documento),
-                        ano=VALUES(ano)
-                        """ 
-                        cursor.execute(insert_sql, tuple(row))
-                    connection.commit()
-                    logging.info("Dados inseridos/atualizados na tabela slv_acordos.")
-                
-                
+        # Verificar se a saída já foi produzida a partir das mesmas entradas e do mesmo código
+        entradas = [(bucket_name, atual)] + ([(bucket_name, delta_key(key))] if incremental else [])
+        metadata = linhagem(minio_client, entradas, versao_codigo(), incremental=incremental)
+        if not force and em_dia(minio_client, bucket2_name, manifest_key(slv_key), metadata):
+            logging.info(f"Camada '{slv_name}' já está atualizada em relação a {entradas}; nada a processar")
+            return STATUS_EM_DIA
+
+        if streaming:
+            _silver_em_lotes(minio_client, bucket_name, key, bucket2_name, slv_key, metadata, load_method, batch_size,
+                             publish_mode, motor)
+            return
+
+        # Ler dados do MinIO, fixando o snapshot atual da bronze (a origem do snapshot silver)
+        if incremental:
+            df, chaves, base, id_base, origem = ler_entrada(minio_client, bucket_name, key, bucket2_name, slv_key,
+                                                            columns=COLUNAS_BRONZE)
+            conteudo = ler_conteudo(minio_client, bucket2_name, slv_key, id_base) if chaves is not None else None
+            if chaves is not None and conteudo is None:
+                # Sem o conteúdo das linhas anteriores não há como deduplicar o delta: recarga completa da bronze
+                df = read_snapshot(minio_client, bucket_name, key, columns=COLUNAS_BRONZE + [COLUNA_CHAVE],
+                                   snapshot=origem)
+                chaves = base = id_base = None
+        else:
+            origem = (snapshot_atual(minio_client, bucket_name, key) or {}).get('id')
+            df = read_snapshot(minio_client, bucket_name, key, columns=COLUNAS_BRONZE, snapshot=origem)
+            chaves = base = id_base = conteudo = None
+
+        with etapa(ETAPA_TRANSFORMACAO, linhas=len(df)):
+            df = limpar_acordos(df, motor=motor)
+
+            # Transformação da camada silver
+            if incremental:
+                # As chaves passam a ser as da silver: removidas ou gravadas pela deduplicação
+                slv_df, chaves, conteudo = sem_duplicadas(base, conteudo, df[COLUNAS_ACORDOS + [COLUNA_CHAVE]], chaves,
+                                                          COLUNAS_ACORDOS)
+                snapshot_df = mesclar(base, slv_df, chaves)
+            else:
+                slv_df = snapshot_df = motor.sem_duplicadas(df[COLUNAS_ACORDOS])
+
+        # O snapshot é enviado ao MinIO enquanto o MariaDB é carregado (ver _publicar)
+        snapshot_df = como_categorias(snapshot_df).sort_values(ORDEM_SNAPSHOT, kind='stable')
+        with EtapaPublicacao(max_workers=1) as publicacoes:
+            publicacoes.publicar(slv_name, _publicar, publicacoes, minio_client, bucket2_name, slv_name, slv_key,
+                                 slv_df, snapshot_df, metadata, incremental, chaves, base, id_base, origem, conteudo,
+                                 load_method, batch_size, publish_mode)
+
     except Exception as e:
         logging.error(f"Erro ao processar camada: {e}")
         raise
-    finally:
-        if 'connection' in locals() and connection and not connection.closed:
-            connection.close()
\ No newline at end of file
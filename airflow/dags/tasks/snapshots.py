@@ -0,0 +1,508 @@
+import contextvars
+import datetime
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from tasks.storage import ROW_GROUP_SIZE, LINHAS_POR_LOTE, S3MultipartWriter, head, read_bytes, write_bytes, \
+    precondicao_falhou, delete_keys, read_table, read_parquet, iter_parquet, write_parquet
+from tasks.metricas import ETAPA_CODIFICACAO_PARQUET, ETAPA_DECODIFICACAO_PARQUET, etapa, registrar
+
+logger = logging.getLogger(__name__)
+
+# Layout de cada dataset no MinIO (a chave lógica, ex.: silver/slv_acordos.parquet, vira o prefixo silver/slv_acordos):
+#
+#   silver/slv_acordos/_manifest.json                                  <- aponta para o snapshot atual
+#   silver/slv_acordos/data_execucao=2024-05-01/snapshot=<id>/ano=2019/part-0.parquet
+#   silver/slv_acordos/data_execucao=2024-05-01/snapshot=<id>/ano=2020_2023/part-0.parquet
+#
+# Cada gravação escreve um snapshot completo em um prefixo próprio e só então troca o manifesto (um único PUT
+# condicional): leitores nunca veem um snapshot pela metade e execuções concorrentes não sobrescrevem os arquivos
+# uma da outra. O servidor precisa respeitar os cabeçalhos If-Match/If-None-Match no PUT (versões recentes do MinIO;
+# o boto3/botocore mínimo está em requirements.txt): um servidor que os ignore aceita qualquer gravação e uma execução
+# concorrente pode sobrescrever a troca da outra.
+MANIFESTO = '_manifest.json'
+FORMATO_MANIFESTO = 1
+
+# Snapshots mantidos no manifesto (e no bucket) para leitura histórica; os mais antigos são removidos
+RETENCAO_SNAPSHOTS = 7
+
+# Compactação: partições consecutivas menores que isso são gravadas juntas em um único arquivo (o intervalo de
+# valores de cada arquivo fica no manifesto, então a poda por partição continua valendo)
+LINHAS_MINIMAS_ARQUIVO = ROW_GROUP_SIZE
+
+# Linhas por arquivo dos snapshots gravados em lotes (EscritorSnapshot)
+LINHAS_POR_ARQUIVO = 8 * ROW_GROUP_SIZE
+
+# Valor de partição para linhas sem valor na coluna de partição (convenção do Hive)
+PARTICAO_NULA = '__HIVE_DEFAULT_PARTITION__'
+
+# Arquivos de um snapshot enviados ao MinIO ao mesmo tempo (gravar_snapshot)
+MAX_ENVIOS_PARALELOS = 4
+
+# Tentativas de troca do manifesto quando outra execução o altera ao mesmo tempo
+MAX_TENTATIVAS_MANIFESTO = 5
+
+
+def prefixo_dataset(key):
+    """Prefixo do dataset de uma chave lógica (ex.: Geral/brz_Geral.parquet -> Geral/brz_Geral)."""
+    return key[:-len('.parquet')] if key.endswith('.parquet') else key
+
+
+def manifest_key(key):
+    return f'{prefixo_dataset(key)}/{MANIFESTO}'
+
+
+def _data_execucao():
+    # Data lógica da execução do Airflow (ds); fora de uma tarefa, a data atual em UTC
+    try:
+        from airflow.operators.python import get_current_context
+        return get_current_context()['ds']
+    except Exception:
+        return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def _valor_particao(valor):
+    valor = valor.item() if hasattr(valor, 'item') else valor
+    return int(valor) if isinstance(valor, float) and valor.is_integer() else valor
+
+
+def _agrupar_particoes(contagens, minimo):
+    """Agrupa os valores de partição consecutivos [(valor, linhas), ...] até cada grupo somar `minimo` linhas."""
+    grupos, atual, linhas = [], [], 0
+    for valor, n in contagens:
+        atual.append(valor)
+        linhas += n
+        if linhas >= minimo:
+            grupos.append(atual)
+            atual, linhas = [], 0
+    if atual:
+        grupos.append(atual)
+    return grupos
+
+
+def _particionar(df, particao, minimo):
+    """Divide o DataFrame em [(nome do diretório, mínimo, máximo, parte)] pela coluna `particao`, compactando as pequenas."""
+    if particao is None or particao not in df.columns or df.empty:
+        return [(None, None, None, df)]
+    valores = df[particao]
+    nulos = valores.isna()
+    contagens = valores[~nulos].value_counts().sort_index()
+    partes = []
+    for grupo in _agrupar_particoes(contagens.items(), minimo):
+        menor, maior = _valor_particao(grupo[0]), _valor_particao(grupo[-1])
+        nome = f'{particao}={menor}' if menor == maior else f'{particao}={menor}_{maior}'
+        partes.append((nome, menor, maior, df[valores.between(grupo[0], grupo[-1])]))
+    if nulos.any():
+        partes.append((f'{particao}={PARTICAO_NULA}', None, None, df[nulos]))
+    return partes
+
+
+def ler_manifesto(minio_client, bucket_name, key):
+    """Manifesto do dataset `key` com um único GET: (manifesto, ETag, metadados), ou None se o dataset não existir."""
+    resposta = read_bytes(minio_client, bucket_name, manifest_key(key))
+    if resposta is None:
+        return None
+    dados, etag, metadata = resposta
+    return json.loads(dados), etag, metadata
+
+
+def referencia(minio_client, bucket_name, key):
+    """
+    Objeto que identifica a versão atual do dataset, para a linhagem: o manifesto ou, para datasets ainda no layout
+    antigo (um único parquet), o próprio objeto. None se o dataset não existir.
+    """
+    for candidato in (manifest_key(key), key):
+        if head(minio_client, bucket_name, candidato) is not None:
+            return candidato
+    return None
+
+
+def _trocar_manifesto(minio_client, bucket_name, key, entrada, metadata, retencao):
+    """
+    Inclui o snapshot `entrada` no manifesto como atual. Retorna (snapshots que saíram pela retenção, ETag do novo
+    manifesto, (manifesto, metadados) anteriores ou None se o dataset não tinha manifesto), para desfazer a troca.
+    """
+    for _ in range(MAX_TENTATIVAS_MANIFESTO):
+        atual = ler_manifesto(minio_client, bucket_name, key)
+        anteriores, etag = (atual[0]['snapshots'], atual[1]) if atual is not None else ([], '*')
+        snapshots = [entrada] + anteriores
+        manifesto = {
+            'formato': FORMATO_MANIFESTO,
+            'dataset': prefixo_dataset(key),
+            'atual': entrada['id'],
+            'snapshots': snapshots[:retencao],
+        }
+        try:
+            resposta = write_bytes(minio_client, json.dumps(manifesto, ensure_ascii=False, indent=1).encode('utf-8'),
+                                   bucket_name, manifest_key(key), metadata=metadata, content_type='application/json',
+                                   if_match=etag)
+            return snapshots[retencao:], resposta['ETag'], (atual[0], atual[2]) if atual is not None else None
+        except Exception as e:
+            if not precondicao_falhou(e):
+                raise
+            logging.warning(f"Manifesto de '{key}' alterado por outra execução; tentando novamente")
+    raise RuntimeError(f"Não foi possível atualizar o manifesto de '{key}' após {MAX_TENTATIVAS_MANIFESTO} tentativas")
+
+
+def _desfazer_troca(minio_client, bucket_name, key, entrada, etag, anterior):
+    """
+    Volta o manifesto ao conteúdo `anterior` à troca que gravou o ETag `etag` e remove os arquivos do snapshot
+    `entrada`. Se outra execução trocou o manifesto depois, ele é mantido (o snapshot continua no histórico dela).
+    """
+    lido = ler_manifesto(minio_client, bucket_name, key)
+    if lido is None or lido[1] != etag:
+        logging.warning(f"Manifesto de '{key}' alterado por outra execução após a troca; snapshot {entrada['id']} "
+                        f"mantido")
+        return
+    if anterior is None:
+        delete_keys(minio_client, bucket_name, [manifest_key(key)])
+    else:
+        manifesto, metadata = anterior
+        write_bytes(minio_client, json.dumps(manifesto, ensure_ascii=False, indent=1).encode('utf-8'), bucket_name,
+                    manifest_key(key), metadata=metadata, content_type='application/json', if_match=etag)
+    delete_keys(minio_client, bucket_name, [a['key'] for a in entrada['arquivos']])
+    logging.info(f"Publicação do snapshot {entrada['id']} de '{key}' desfeita")
+
+
+def _novo_snapshot(key, data_execucao):
+    # Id único (instante + sufixo aleatório) e prefixo próprio do snapshot
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    snapshot_id = f'{agora:%Y%m%dT%H%M%S%fZ}-{uuid.uuid4().hex[:8]}'
+    return snapshot_id, agora, f'{prefixo_dataset(key)}/data_execucao={data_execucao}/snapshot={snapshot_id}'
+
+
+def _publicar(minio_client, bucket_name, key, entrada, metadata, retencao, publicacao=None):
+    """
+    Troca o manifesto para o snapshot `entrada`, cujos arquivos já foram gravados, e aplica a retenção.
+
+    `publicacao` é a etapa final das demais partes da saída (objeto com concluir() e abortar(), ex.: a carga no
+    MariaDB, ver publicacao.PublicacaoEmLotes), executada logo depois da troca: se ela falhar, o manifesto volta ao
+    anterior e o snapshot é removido; se a troca falhar, ela é abortada. Os snapshots que saem pela retenção só são
+    removidos no fim, quando nada mais pode ser desfeito.
+    """
+    try:
+        expirados, etag, anterior = _trocar_manifesto(minio_client, bucket_name, key, entrada, metadata, retencao)
+    except Exception:
+        # O snapshot nunca chegou a ser publicado: seus arquivos não são referenciados por nenhum manifesto
+        delete_keys(minio_client, bucket_name, [a['key'] for a in entrada['arquivos']])
+        if publicacao is not None:
+            publicacao.abortar()
+        raise
+    if publicacao is not None:
+        try:
+            publicacao.concluir()
+        except Exception:
+            try:
+                _desfazer_troca(minio_client, bucket_name, key, entrada, etag, anterior)
+            except Exception as e:
+                logging.error(f"Não foi possível desfazer a publicação do snapshot {entrada['id']} de '{key}': {e}")
+            publicacao.abortar()
+            raise
+    if expirados:
+        delete_keys(minio_client, bucket_name, [a['key'] for s in expirados for a in s['arquivos']])
+        logging.info(f"Retenção de '{key}': snapshots {[s['id'] for s in expirados]} removidos")
+    logging.info(f"Snapshot {entrada['id']} de '{key}' publicado ({entrada['linhas']} linhas em "
+                 f"{len(entrada['arquivos'])} arquivos)")
+    return entrada['id']
+
+
+def gravar_snapshot(minio_client, df, bucket_name, key, particao=None, data_execucao=None,
+                    linhas_minimas=LINHAS_MINIMAS_ARQUIVO, max_workers=MAX_ENVIOS_PARALELOS, origem=None):
+    """
+    Primeira etapa de write_snapshot: grava os arquivos do novo snapshot (as partições em paralelo, até
+    `max_workers` envios simultâneos) sem publicá-lo. Retorna a entrada do manifesto, a ser publicada com
+    publicar_snapshot ou descartada com descartar_snapshot; enquanto isso os arquivos não são vistos por nenhum leitor.
+    Se algum envio falhar, os arquivos já gravados são removidos. `origem` é o id do snapshot da entrada a partir do
+    qual este foi produzido (ver cdc.ler_entrada).
+    """
+    data_execucao = data_execucao or _data_execucao()
+    snapshot_id, agora, prefixo = _novo_snapshot(key, data_execucao)
+
+    arquivos = []
+    for nome, menor, maior, parte in _particionar(df, particao, linhas_minimas):
+        arquivo = f'{prefixo}/{nome}/part-0.parquet' if nome else f'{prefixo}/part-0.parquet'
+        arquivos.append(({'key': arquivo, 'linhas': len(parte), 'min': menor, 'max': maior}, parte))
+
+    # Cada envio roda em uma cópia do contexto para que as métricas cheguem ao coletor da tarefa
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(arquivos)))) as executor:
+        futuros = [executor.submit(contextvars.copy_context().run, write_parquet, minio_client, parte, bucket_name,
+                                   arquivo['key'])
+                   for arquivo, parte in arquivos]
+        erros = [e for e in (f.exception() for f in futuros) if e is not None]
+    if erros:
+        delete_keys(minio_client, bucket_name, [arquivo['key'] for arquivo, _ in arquivos])
+        raise erros[0]
+
+    return {
+        'id': snapshot_id,
+        'data_execucao': data_execucao,
+        'criado_em': agora.isoformat(),
+        'linhas': len(df),
+        'particao': particao if particao in df.columns else None,
+        'arquivos': [arquivo for arquivo, _ in arquivos],
+        'origem': origem,
+    }
+
+
+def publicar_snapshot(minio_client, bucket_name, key, entrada, metadata=None, retencao=RETENCAO_SNAPSHOTS,
+                      publicacao=None):
+    """
+    Publica o snapshot gravado por gravar_snapshot (troca do manifesto, ver write_snapshot), confirmando junto a
+    `publicacao` das demais partes da saída (ver _publicar). Retorna o seu id.
+    """
+    return _publicar(minio_client, bucket_name, key, entrada, metadata, retencao, publicacao)
+
+
+def descartar_snapshot(minio_client, bucket_name, entrada):
+    """Remove os arquivos de um snapshot gravado por gravar_snapshot e nunca publicado."""
+    delete_keys(minio_client, bucket_name, [a['key'] for a in entrada['arquivos']])
+    logging.info(f"Snapshot {entrada['id']} descartado ({len(entrada['arquivos'])} arquivos removidos)")
+
+
+def write_snapshot(minio_client, df, bucket_name, key, metadata=None, particao=None, data_execucao=None,
+                   retencao=RETENCAO_SNAPSHOTS, linhas_minimas=LINHAS_MINIMAS_ARQUIVO):
+    """
+    Grava o DataFrame como um novo snapshot do dataset `key`, particionado pela data da execução e, se informada,
+    pela coluna `particao` (partições com menos de `linhas_minimas` linhas são compactadas em um arquivo). Os arquivos
+    são gravados antes do manifesto, que passa a apontar para o novo snapshot e guarda `metadata` (linhagem) nos
+    metadados do objeto. Snapshots além dos `retencao` mais recentes são removidos. Retorna o id do snapshot.
+    """
+    entrada = gravar_snapshot(minio_client, df, bucket_name, key, particao=particao, data_execucao=data_execucao,
+                              linhas_minimas=linhas_minimas)
+    return _publicar(minio_client, bucket_name, key, entrada, metadata, retencao)
+
+
+def _esquema_estavel(schema):
+    # Índices de dicionário em int32: o pandas escolhe int8/int16 conforme as categorias de cada lote. Os metadados do
+    # pandas são mantidos (ex.: colunas Int64 com nulos voltam como Int64, e não float64)
+    return pa.schema([
+        campo.with_type(pa.dictionary(pa.int32(), campo.type.value_type)) if pa.types.is_dictionary(campo.type)
+        else campo
+        for campo in schema
+    ], metadata=schema.metadata)
+
+
+class EscritorSnapshot:
+    """
+    Grava um snapshot recebido em lotes (modo streaming). Os lotes vão para arquivos parquet de até
+    `linhas_por_arquivo` linhas, enviados ao MinIO à medida que chegam, e o manifesto só é trocado ao final do bloco
+    `with`; se o bloco falhar, os arquivos já gravados são removidos. Como os lotes não chegam agrupados pela
+    partição, cada arquivo registra no manifesto o intervalo de valores de `particao` que contém, usado na poda.
+
+        with EscritorSnapshot(minio_client, 'silver', 'silver/slv_acordos.parquet', particao='ano') as escritor:
+            for lote in lotes:
+                escritor.escrever(lote)
+
+    `publicacao` (que também pode ser atribuída durante o bloco) é confirmada logo após a troca do manifesto, como em
+    publicar_snapshot, e abortada se o bloco falhar.
+    """
+
+    def __init__(self, minio_client, bucket_name, key, metadata=None, particao=None, data_execucao=None,
+                 retencao=RETENCAO_SNAPSHOTS, linhas_por_arquivo=LINHAS_POR_ARQUIVO, origem=None, publicacao=None):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.metadata = metadata
+        self.origem = origem
+        self.publicacao = publicacao
+        self.particao = particao
+        self.retencao = retencao
+        self.linhas_por_arquivo = linhas_por_arquivo
+        self.data_execucao = data_execucao or _data_execucao()
+        self.snapshot_id, self._agora, self._prefixo = _novo_snapshot(key, self.data_execucao)
+        self.linhas = 0
+        self._schema = None
+        self._arquivos = []
+        self._destino = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def _abrir(self):
+        arquivo = {'key': f'{self._prefixo}/part-{len(self._arquivos):05d}.parquet', 'linhas': 0, 'min': None,
+                   'max': None}
+        self._destino = S3MultipartWriter(self.minio_client, self.bucket_name, arquivo['key'])
+        self._writer = pq.ParquetWriter(self._destino, self._schema, write_statistics=True)
+        self._arquivos.append(arquivo)
+
+    def _fechar(self):
+        self._writer.close()
+        self._destino.close()
+        self._writer = self._destino = None
+
+    def escrever(self, df):
+        """Acrescenta um lote ao snapshot."""
+        inicio = time.perf_counter()
+        if self._schema is None:
+            self._schema = _esquema_estavel(pa.Table.from_pandas(df, preserve_index=False).schema)
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._abrir()
+        envio_antes, bytes_antes = self._destino.segundos_envio, self._destino.bytes_escritos
+        self._writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+        arquivo = self._arquivos[-1]
+        arquivo['linhas'] += len(df)
+        if self.particao in df.columns and df[self.particao].notna().any():
+            menor, maior = _valor_particao(df[self.particao].min()), _valor_particao(df[self.particao].max())
+            arquivo['min'] = menor if arquivo['min'] is None else min(arquivo['min'], menor)
+            arquivo['max'] = maior if arquivo['max'] is None else max(arquivo['max'], maior)
+        self.linhas += len(df)
+        destino = self._destino
+        if arquivo['linhas'] >= self.linhas_por_arquivo:
+            self._fechar()
+        registrar(ETAPA_CODIFICACAO_PARQUET, time.perf_counter() - inicio - (destino.segundos_envio - envio_antes),
+                  linhas=len(df), n_bytes=destino.bytes_escritos - bytes_antes)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if self._destino is not None:
+                self._destino.abort()
+            delete_keys(self.minio_client, self.bucket_name, [a['key'] for a in self._arquivos])
+            if self.publicacao is not None:
+                self.publicacao.abortar()
+            return False
+        if self._writer is not None:
+            self._fechar()
+        entrada = {
+            'id': self.snapshot_id,
+            'data_execucao': self.data_execucao,
+            'criado_em': self._agora.isoformat(),
+            'linhas': self.linhas,
+            'particao': self.particao if self._schema is not None and self.particao in self._schema.names else None,
+            'arquivos': self._arquivos,
+            'origem': self.origem,
+        }
+        _publicar(self.minio_client, self.bucket_name, self.key, entrada, self.metadata, self.retencao, self.publicacao)
+        return False
+
+
+def resolver_snapshot(manifesto, snapshot=None):
+    """
+    Entrada do manifesto a ler: o snapshot atual, o de id `snapshot` ou, se `snapshot` for uma data (AAAA-MM-DD), o
+    mais recente com data de execução até ela.
+    """
+    snapshots = manifesto['snapshots']
+    if snapshot is None:
+        snapshot = manifesto['atual']
+    for entrada in snapshots:
+        if entrada['id'] == snapshot:
+            return entrada
+    candidatos = [s for s in snapshots if s['data_execucao'] <= snapshot]
+    if not candidatos:
+        raise FileNotFoundError(f"Snapshot '{snapshot}' não encontrado no manifesto de '{manifesto['dataset']}'")
+    return max(candidatos, key=lambda s: (s['data_execucao'], s['criado_em']))
+
+
+def snapshot_atual(minio_client, bucket_name, key):
+    """Entrada do manifesto do snapshot atual do dataset `key`, ou None se o dataset não tiver manifesto."""
+    lido = ler_manifesto(minio_client, bucket_name, key)
+    return resolver_snapshot(lido[0]) if lido is not None else None
+
+
+def _atende(arquivo, operador, valor):
+    # Se o intervalo [min, max] de partição do arquivo pode conter linhas que atendem ao filtro
+    menor, maior = arquivo['min'], arquivo['max']
+    if menor is None:
+        return False
+    try:
+        if operador in ('=', '=='):
+            return menor <= valor <= maior
+        if operador == 'in':
+            return any(menor <= v <= maior for v in valor)
+        if operador == '>':
+            return maior > valor
+        if operador == '>=':
+            return maior >= valor
+        if operador == '<':
+            return menor < valor
+        if operador == '<=':
+            return menor <= valor
+        if operador == '!=':
+            return not menor == maior == valor
+        if operador == 'not in':
+            return not (menor == maior and menor in valor)
+    except TypeError:
+        pass
+    return True
+
+
+def podar_arquivos(entrada, filters):
+    """Arquivos do snapshot que podem conter linhas que atendem a `filters` (formato do pyarrow), pela partição."""
+    particao = entrada.get('particao')
+    if not filters or particao is None:
+        return entrada['arquivos']
+    conjuncoes = filters if isinstance(filters[0], list) else [filters]
+    return [
+        arquivo for arquivo in entrada['arquivos']
+        if any(all(_atende(arquivo, op, valor) for coluna, op, valor in conjuncao if coluna == particao)
+               for conjuncao in conjuncoes)
+    ]
+
+
+def read_snapshot(minio_client, bucket_name, key, with_metadata=False, columns=None, filters=None, snapshot=None):
+    """
+    Lê o snapshot atual do dataset `key` (ou o indicado por `snapshot`, ver resolver_snapshot) a partir do manifesto,
+    sem listar o bucket. Filtros sobre a coluna de partição descartam arquivos inteiros antes de qualquer leitura; os
+    demais são aplicados pelo pyarrow em cada arquivo. Datasets ainda no layout antigo são lidos do objeto único.
+    Com with_metadata=True retorna (df, metadados do manifesto). Levanta FileNotFoundError se o dataset não existir.
+    """
+    lido = ler_manifesto(minio_client, bucket_name, key)
+    if lido is None:
+        if snapshot is not None:
+            raise FileNotFoundError(f"Dataset '{key}' não tem manifesto no bucket '{bucket_name}'")
+        return read_parquet(minio_client, bucket_name, key, with_metadata=with_metadata, columns=columns,
+                            filters=filters)
+    manifesto, _, metadata = lido
+    entrada = resolver_snapshot(manifesto, snapshot)
+    # Sem nenhum arquivo após a poda, o primeiro é lido mesmo assim para obter o esquema (o filtro o esvazia)
+    arquivos = podar_arquivos(entrada, filters) or entrada['arquivos'][:1]
+
+    if len(arquivos) == 1:
+        df = read_parquet(minio_client, bucket_name, arquivos[0]['key'], columns=columns, filters=filters)
+    else:
+        tabelas = [read_table(minio_client, bucket_name, a['key'], columns=columns, filters=filters)[0]
+                   for a in arquivos]
+        with etapa(ETAPA_DECODIFICACAO_PARQUET):
+            table = pa.concat_tables(tabelas, promote_options='permissive')
+            del tabelas
+            df = table.to_pandas(self_destruct=True, split_blocks=True)
+            del table
+    if with_metadata:
+        return df, metadata
+    return df
+
+
+def iter_snapshot(minio_client, bucket_name, key, columns=None, filters=None, batch_size=LINHAS_POR_LOTE,
+                  snapshot=None):
+    """
+    Como read_snapshot, mas em DataFrames de até `batch_size` linhas (modo streaming, ver iter_parquet), arquivo por
+    arquivo do snapshot.
+    """
+    lido = ler_manifesto(minio_client, bucket_name, key)
+    if lido is None:
+        if snapshot is not None:
+            raise FileNotFoundError(f"Dataset '{key}' não tem manifesto no bucket '{bucket_name}'")
+        arquivos = [key]
+    else:
+        entrada = resolver_snapshot(lido[0], snapshot)
+        arquivos = [a['key'] for a in podar_arquivos(entrada, filters) or entrada['arquivos'][:1]]
+    for arquivo in arquivos:
+        yield from iter_parquet(minio_client, bucket_name, arquivo, columns=columns, filters=filters,
+                                batch_size=batch_size)
+
+
+def try_read_snapshot(minio_client, bucket_name, key, with_metadata=False, columns=None, filters=None, snapshot=None):
+    """Como read_snapshot, mas retorna None quando o dataset não existe."""
+    try:
+        return read_snapshot(minio_client, bucket_name, key, with_metadata=with_metadata, columns=columns,
+                             filters=filters, snapshot=snapshot)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,376 @@
+import contextlib
+import functools
+import io
+import logging
+import time
+
+import boto3
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from tasks.metricas import ETAPA_MINIO_GET, ETAPA_MINIO_PUT, ETAPA_CODIFICACAO_PARQUET, ETAPA_DECODIFICACAO_PARQUET, \
+    etapa, registrar
+
+logger = logging.getLogger(__name__)
+
+# Tentativas para erros transitórios do MinIO (timeouts, 5xx, throttling), com backoff exponencial do botocore
+MAX_TENTATIVAS = 5
+
+# Tamanho de cada parte do upload multipart (mínimo do S3: 5 MiB)
+TAMANHO_PARTE = 8 * 1024 * 1024
+
+# Linhas por row group nos parquets gravados: grupos menores permitem descartar mais dados pelas estatísticas de
+# min/max nas leituras com filtro, grupos maiores comprimem melhor
+ROW_GROUP_SIZE = 128 * 1024
+
+# Linhas por lote no modo streaming: limita a memória de cada etapa ao tamanho de um lote, independente do total
+LINHAS_POR_LOTE = 64 * 1024
+
+# Leitura em lotes sem pre_buffer: cada row group é buscado apenas quando o lote anterior já foi consumido
+_FORMATO_STREAMING = ds.ParquetFileFormat(default_fragment_scan_options=ds.ParquetFragmentScanOptions(pre_buffer=False))
+
+_CODIGOS_INEXISTENTE = ('404', 'NoSuchKey', 'NotFound')
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(endpoint_url, access_key, secret_key):
+    """
+    Cliente S3 do MinIO reutilizado por todas as tarefas do mesmo processo worker (clientes boto3 são thread-safe).
+    """
+    session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    return session.client(
+        's3',
+        endpoint_url=endpoint_url,
+        config=Config(retries={'max_attempts': MAX_TENTATIVAS, 'mode': 'standard'})
+    )
+
+
+def head(minio_client, bucket_name, key):
+    """Metadados do objeto via HEAD (ETag, tamanho, x-amz-meta-*), ou None se o objeto não existir."""
+    try:
+        return minio_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in _CODIGOS_INEXISTENTE:
+            return None
+        raise
+
+
+def object_exists(minio_client, bucket_name, key):
+    return head(minio_client, bucket_name, key) is not None
+
+
+def read_bytes(minio_client, bucket_name, key):
+    """Conteúdo de um objeto pequeno com um único GET: (bytes, ETag, metadados), ou None se o objeto não existir."""
+    inicio = time.perf_counter()
+    try:
+        response = minio_client.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in _CODIGOS_INEXISTENTE:
+            return None
+        raise
+    dados = response['Body'].read()
+    registrar(ETAPA_MINIO_GET, time.perf_counter() - inicio, n_bytes=len(dados))
+    return dados, response['ETag'], response.get('Metadata', {})
+
+
+def write_bytes(minio_client, dados, bucket_name, key, metadata=None, content_type='application/octet-stream',
+                if_match=None):
+    """
+    Grava um objeto pequeno com um único put_object. Com if_match (ETag, ou '*' para exigir que o objeto ainda não
+    exista), a gravação é condicional e falha com PreconditionFailed se o objeto tiver sido alterado nesse meio-tempo.
+    Requer botocore >= 1.35.69 (parâmetros IfMatch/IfNoneMatch do put_object) e um servidor com PUT condicional.
+    """
+    condicao = {}
+    if if_match == '*':
+        condicao['IfNoneMatch'] = '*'
+    elif if_match is not None:
+        condicao['IfMatch'] = if_match
+    with etapa(ETAPA_MINIO_PUT, n_bytes=len(dados)):
+        return minio_client.put_object(Bucket=bucket_name, Key=key, Body=dados, Metadata=metadata or {},
+                                       ContentType=content_type, **condicao)
+
+
+def precondicao_falhou(erro):
+    """True se o ClientError veio de uma gravação condicional (write_bytes com if_match) cuja condição não valeu."""
+    return isinstance(erro, ClientError) and erro.response.get('Error', {}).get('Code') in ('PreconditionFailed', '412')
+
+
+def delete_keys(minio_client, bucket_name, keys):
+    """Remove as chaves em lotes de até 1000 por requisição delete_objects."""
+    keys = list(keys)
+    for inicio in range(0, len(keys), 1000):
+        minio_client.delete_objects(
+            Bucket=bucket_name, Delete={'Objects': [{'Key': k} for k in keys[inicio:inicio + 1000]], 'Quiet': True}
+        )
+
+
+def list_keys(minio_client, bucket_name, prefix=''):
+    """Lista as chaves sob `prefix`, percorrendo todas as páginas do list_objects_v2."""
+    paginator = minio_client.get_paginator('list_objects_v2')
+    for pagina in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in pagina.get('Contents', []):
+            yield obj['Key']
+
+
+def list_level(minio_client, bucket_name, prefix=''):
+    """
+    Lista um único nível sob `prefix` (list_objects_v2 com Delimiter='/'): retorna (chaves, subprefixos) sem percorrer
+    os objetos dos níveis abaixo.
+    """
+    chaves, subprefixos = [], []
+    paginator = minio_client.get_paginator('list_objects_v2')
+    for pagina in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+        chaves.extend(obj['Key'] for obj in pagina.get('Contents', []))
+        subprefixos.extend(p['Prefix'] for p in pagina.get('CommonPrefixes', []))
+    return chaves, subprefixos
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Arquivo somente leitura e posicionável sobre um objeto do MinIO. Cada read() vira um GET com Range, de modo que o
+    pyarrow busca apenas o rodapé e os column chunks/row groups de que precisa, sem baixar o objeto inteiro.
+    """
+
+    def __init__(self, minio_client, bucket_name, key, head_response=None):
+        super().__init__()
+        head_response = head_response or head(minio_client, bucket_name, key)
+        if head_response is None:
+            raise FileNotFoundError(f"Objeto '{key}' não existe no bucket '{bucket_name}'")
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = head_response['ContentLength']
+        self.etag = head_response['ETag']
+        self.metadata = head_response.get('Metadata', {})
+        self.bytes_lidos = 0
+        # Acumulados no próprio leitor: o pyarrow pode chamar read() a partir das suas threads de I/O
+        self.segundos_leitura = 0.0
+        self._posicao = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._posicao
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._posicao = offset
+        elif whence == io.SEEK_CUR:
+            self._posicao += offset
+        elif whence == io.SEEK_END:
+            self._posicao = self.size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        return self._posicao
+
+    def read(self, size=-1):
+        fim = self.size if size is None or size < 0 else min(self.size, self._posicao + size)
+        if self._posicao >= fim:
+            return b''
+        inicio = time.perf_counter()
+        # IfMatch garante que todos os intervalos venham da mesma versão do objeto
+        response = self.minio_client.get_object(
+            Bucket=self.bucket_name, Key=self.key, Range=f'bytes={self._posicao}-{fim - 1}', IfMatch=self.etag
+        )
+        dados = response['Body'].read()
+        self.segundos_leitura += time.perf_counter() - inicio
+        self._posicao += len(dados)
+        self.bytes_lidos += len(dados)
+        return dados
+
+    def readall(self):
+        return self.read(-1)
+
+    def readinto(self, buffer):
+        dados = self.read(len(buffer))
+        buffer[:len(dados)] = dados
+        return len(dados)
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Arquivo somente escrita que envia o conteúdo ao MinIO em partes de `part_size` bytes (multipart upload), mantendo
+    em memória no máximo uma parte. Objetos menores que uma parte são enviados com um único put_object.
+    Deve ser usado como context manager: em caso de erro o upload é abortado e nada é publicado.
+    """
+
+    def __init__(self, minio_client, bucket_name, key, metadata=None, part_size=None):
+        super().__init__()
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.metadata = metadata or {}
+        self.part_size = part_size or TAMANHO_PARTE
+        self.bytes_escritos = 0
+        self.segundos_envio = 0.0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._buffer += dados
+        self.bytes_escritos += len(dados)
+        while len(self._buffer) >= self.part_size:
+            self._enviar_parte(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(dados)
+
+    @contextlib.contextmanager
+    def _envio(self, n_bytes):
+        inicio = time.perf_counter()
+        with etapa(ETAPA_MINIO_PUT, n_bytes=n_bytes):
+            yield
+        self.segundos_envio += time.perf_counter() - inicio
+
+    def _enviar_parte(self, dados):
+        with self._envio(len(dados)):
+            if self._upload_id is None:
+                self._upload_id = self.minio_client.create_multipart_upload(
+                    Bucket=self.bucket_name, Key=self.key, Metadata=self.metadata
+                )['UploadId']
+            numero = len(self._partes) + 1
+            response = self.minio_client.upload_part(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id, PartNumber=numero, Body=dados
+            )
+        self._partes.append({'ETag': response['ETag'], 'PartNumber': numero})
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                with self._envio(len(self._buffer)):
+                    self.minio_client.put_object(
+                        Bucket=self.bucket_name, Key=self.key, Body=bytes(self._buffer), Metadata=self.metadata
+                    )
+            else:
+                if self._buffer:
+                    self._enviar_parte(bytes(self._buffer))
+                with self._envio(0):
+                    self.minio_client.complete_multipart_upload(
+                        Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+                        MultipartUpload={'Parts': self._partes}
+                    )
+            self._buffer = bytearray()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        if self._upload_id is not None:
+            self.minio_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id)
+        self._buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def write_parquet(minio_client, df, bucket_name, key, metadata=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Grava o DataFrame como parquet no MinIO, com metadados opcionais no objeto (x-amz-meta-*). O pyarrow escreve
+    diretamente no upload multipart, sem montar o arquivo inteiro em memória. Cada row group leva estatísticas de
+    min/max por coluna, usadas pelos filtros de read_parquet.
+
+    O tempo de codificação registrado nas métricas exclui o tempo gasto nos envios ao MinIO (medidos à parte).
+    """
+    inicio = time.perf_counter()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with S3MultipartWriter(minio_client, bucket_name, key, metadata=metadata) as writer:
+        pq.write_table(table, writer, row_group_size=row_group_size, write_statistics=True)
+    registrar(ETAPA_CODIFICACAO_PARQUET, time.perf_counter() - inicio - writer.segundos_envio, linhas=len(df),
+              n_bytes=writer.bytes_escritos)
+    logging.info(f"Objeto '{key}' salvo no bucket '{bucket_name}' ({len(df)} linhas, {writer.bytes_escritos} bytes)")
+
+
+def read_table(minio_client, bucket_name, key, columns=None, filters=None):
+    """
+    Como read_parquet, mas sem converter para o pandas: retorna (pyarrow.Table, metadados do objeto). Usado para juntar
+    vários arquivos em uma única conversão.
+    """
+    inicio = time.perf_counter()
+    reader = S3ObjectReader(minio_client, bucket_name, key)
+    table = pq.read_table(reader, columns=columns, filters=filters)
+    registrar(ETAPA_MINIO_GET, reader.segundos_leitura, n_bytes=reader.bytes_lidos)
+    registrar(ETAPA_DECODIFICACAO_PARQUET, max(time.perf_counter() - inicio - reader.segundos_leitura, 0.0),
+              linhas=table.num_rows, n_bytes=reader.bytes_lidos)
+    return table, reader.metadata
+
+
+def read_parquet(minio_client, bucket_name, key, with_metadata=False, columns=None, filters=None):
+    """
+    Lê um parquet do MinIO por GETs com Range. Com with_metadata=True retorna (df, metadados do objeto).
+    Levanta FileNotFoundError se o objeto não existir.
+
+    `columns` restringe as colunas decodificadas e `filters` (formato do pyarrow, ex.:
+    [('tipo_de_parceiro', '==', 'País')]) é aplicado no pyarrow: row groups descartados pelas estatísticas nem
+    chegam a ser baixados.
+    """
+    inicio = time.perf_counter()
+    reader = S3ObjectReader(minio_client, bucket_name, key)
+    table = pq.read_table(reader, columns=columns, filters=filters)
+    # self_destruct libera os buffers do Arrow à medida que as colunas são convertidas para o pandas
+    df = table.to_pandas(self_destruct=True, split_blocks=True)
+    del table
+    # Leituras paralelas somam mais tempo de GET que o tempo de parede; nesse caso a decodificação fica em zero
+    registrar(ETAPA_MINIO_GET, reader.segundos_leitura, n_bytes=reader.bytes_lidos)
+    registrar(ETAPA_DECODIFICACAO_PARQUET, max(time.perf_counter() - inicio - reader.segundos_leitura, 0.0),
+              linhas=len(df), n_bytes=reader.bytes_lidos)
+    if with_metadata:
+        return df, reader.metadata
+    return df
+
+
+def iter_parquet(minio_client, bucket_name, key, columns=None, filters=None, batch_size=LINHAS_POR_LOTE):
+    """
+    Lê um parquet do MinIO em DataFrames de até `batch_size` linhas (modo streaming). Os row groups são baixados sob
+    demanda, um por vez, e `filters` descarta row groups pelas estatísticas e linhas dentro de cada lote. Se nenhuma
+    linha atender, produz um único DataFrame vazio com as colunas do arquivo.
+    """
+    reader = S3ObjectReader(minio_client, bucket_name, key)
+    fragmento = _FORMATO_STREAMING.make_fragment(pa.PythonFile(reader, mode='r'))
+    expressao = pq.filters_to_expression(filters) if filters else None
+    lotes = iter(fragmento.to_batches(columns=columns, filter=expressao, batch_size=batch_size, use_threads=False))
+    segundos_decodificacao, linhas, produziu = 0.0, 0, False
+    try:
+        while True:
+            inicio, leitura_antes = time.perf_counter(), reader.segundos_leitura
+            lote = next(lotes, None)
+            if lote is None:
+                break
+            df = lote.to_pandas(split_blocks=True)
+            segundos_decodificacao += time.perf_counter() - inicio - (reader.segundos_leitura - leitura_antes)
+            linhas += len(df)
+            produziu = True
+            yield df
+        if not produziu:
+            esquema = fragmento.physical_schema
+            yield esquema.empty_table().select(columns or esquema.names).to_pandas()
+    finally:
+        registrar(ETAPA_MINIO_GET, reader.segundos_leitura, n_bytes=reader.bytes_lidos)
+        registrar(ETAPA_DECODIFICACAO_PARQUET, max(segundos_decodificacao, 0.0), linhas=linhas,
+                  n_bytes=reader.bytes_lidos)
+
+
+def try_read_parquet(minio_client, bucket_name, key, with_metadata=False, columns=None, filters=None):
+    """Como read_parquet, mas retorna None quando o objeto não existe."""
+    try:
+        return read_parquet(minio_client, bucket_name, key, with_metadata=with_metadata, columns=columns,
+                            filters=filters)
+    except FileNotFoundError:
+        return None
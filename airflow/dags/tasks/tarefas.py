@@ -0,0 +1,39 @@
+import functools
+import importlib
+import inspect
+
+# Callables das tarefas usados pelo dag_main.py. Este módulo só usa a biblioteca padrão: o scheduler importa o arquivo
+# da DAG a cada ciclo de parse, e pandas, pyarrow, boto3, gspread e o provider MySQL só devem ser carregados no worker
+# que executa a tarefa.
+
+
+class TarefaAdiada:
+    """
+    Callable que só importa o módulo que implementa a tarefa quando é chamado ou inspecionado. A assinatura exposta é
+    a da função real (o PythonOperator a inspeciona na execução para decidir quais argumentos do contexto repassar).
+    """
+
+    def __init__(self, modulo, nome):
+        self.modulo = modulo
+        self.nome = nome
+        self.__name__ = self.__qualname__ = nome
+        self.__module__ = modulo
+
+    @functools.cached_property
+    def funcao(self):
+        return getattr(importlib.import_module(self.modulo), self.nome)
+
+    @property
+    def __signature__(self):
+        return inspect.signature(self.funcao)
+
+    def __call__(self, *args, **kwargs):
+        return self.funcao(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<TarefaAdiada {self.modulo}.{self.nome}>'
+
+
+google_sheets_to_minio_etl = TarefaAdiada('tasks.bronze', 'google_sheets_to_minio_etl')
+transform_and_load_silver = TarefaAdiada('tasks.silver', 'transform_and_load_silver')
+transform_and_load_gold = TarefaAdiada('tasks.gold', 'transform_and_load_gold')
@@ -0,0 +1,393 @@
+"""
+Substituto local do MariaDB para o benchmark do pipeline: um banco SQLite em arquivo temporário (modo WAL), acessado
+por conexões DB-API que traduzem o dialeto usado pelas tarefas e executam de fato cada comando.
+
+A tradução cobre o que tasks.* envia ao banco: DDL com AUTO_INCREMENT, índices e chaves estrangeiras declarados no
+CREATE TABLE (com a exigência do InnoDB de nomes de restrição únicos no banco), CREATE TABLE ... LIKE (que, como no
+MariaDB, não copia as chaves estrangeiras), ALTER TABLE com várias alterações, RENAME TABLE atômico, DROP de várias
+tabelas, views, INSERT IGNORE, ON DUPLICATE KEY UPDATE, DELETE e UPDATE com JOIN, consultas ao information_schema e os
+placeholders %s. Chaves estrangeiras são verificadas (PRAGMA foreign_keys) e inteiros sem sinal acima de 2^63 são
+gravados em complemento de dois, já que o INTEGER do SQLite tem sinal.
+
+Transações seguem o MariaDB com autocommit desligado: a primeira alteração de dados abre uma transação, que só é
+gravada no commit(); DDL (salvo CREATE/DROP TEMPORARY TABLE) confirma antes a transação pendente e é gravada na
+hora. LOAD DATA LOCAL INFILE é recusado, como em um servidor sem local_infile (o carregador refaz o lote com
+executemany). O SQLite aceita um escritor por vez: transações concorrentes esperam até TEMPO_ESPERA segundos pela
+vez.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+
+# Espera máxima, em segundos, pela vez de escrever quando outra conexão tem uma transação aberta
+TEMPO_ESPERA = 120
+
+# Tabelas do information_schema usadas pelas tarefas, como views temporárias de cada conexão
+_INFORMATION_SCHEMA = """
+CREATE TEMP VIEW information_schema_tables AS
+    SELECT 'main' AS TABLE_SCHEMA, name AS TABLE_NAME FROM main.sqlite_master
+    WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%';
+CREATE TEMP VIEW information_schema_columns AS
+    SELECT 'main' AS TABLE_SCHEMA, m.name AS TABLE_NAME, c.name AS COLUMN_NAME
+    FROM main.sqlite_master m JOIN pragma_table_info(m.name, 'main') c WHERE m.type = 'table';
+"""
+
+_NOME = r'`?([^`\s(),]+)`?'
+_CREATE_LIKE = re.compile(rf'CREATE\s+(TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?{_NOME}\s+LIKE\s+{_NOME}$', re.I)
+_CREATE_TABLE = re.compile(rf'CREATE\s+(TEMPORARY\s+)?TABLE\s+(IF\s+NOT\s+EXISTS\s+)?{_NOME}\s*\((.*)\)$', re.I | re.S)
+_CREATE_VIEW = re.compile(rf'CREATE\s+OR\s+REPLACE\s+VIEW\s+{_NOME}\s+AS\s+(.*)$', re.I | re.S)
+_DROP_TABLE = re.compile(r'DROP\s+(TEMPORARY\s+)?TABLE\s+(IF\s+EXISTS\s+)?(.*)$', re.I | re.S)
+_RENAME_TABLE = re.compile(r'RENAME\s+TABLE\s+(.*)$', re.I | re.S)
+_ALTER_TABLE = re.compile(rf'ALTER\s+TABLE\s+{_NOME}\s+(.*)$', re.I | re.S)
+_DELETE_JOIN = re.compile(rf'DELETE\s+(\w+)\s+FROM\s+{_NOME}\s+\1\s+(.*)$', re.I | re.S)
+_UPDATE_JOIN = re.compile(rf'UPDATE\s+{_NOME}\s+(\w+)\s+JOIN\s+{_NOME}\s+(\w+)\s+ON\s+(.*?)\s+SET\s+(.*)$', re.I | re.S)
+_DUPLICADOS = re.compile(r'\s+ON\s+DUPLICATE\s+KEY\s+UPDATE\s+(.*)$', re.I | re.S)
+_RESTRICAO_FK = re.compile(rf'CONSTRAINT\s+{_NOME}\s+FOREIGN\s+KEY', re.I)
+_INDICE = re.compile(rf'(UNIQUE\s+)?(?:INDEX|KEY)\s+(IF\s+NOT\s+EXISTS\s+)?{_NOME}\s*\((.*)\)$', re.I | re.S)
+_DML = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def _itens(texto):
+    """Divide uma lista separada por vírgulas no nível mais externo de parênteses."""
+    itens, nivel, atual = [], 0, []
+    for caractere in texto:
+        if caractere == '(':
+            nivel += 1
+        elif caractere == ')':
+            nivel -= 1
+        if caractere == ',' and nivel == 0:
+            itens.append(''.join(atual).strip())
+            atual = []
+        else:
+            atual.append(caractere)
+    if ''.join(atual).strip():
+        itens.append(''.join(atual).strip())
+    return itens
+
+
+def _tipos(definicao):
+    # Tipos e atributos do MariaDB sem equivalente direto no SQLite
+    definicao = re.sub(r'\bINT\s+PRIMARY\s+KEY\s+AUTO_INCREMENT\b', 'INTEGER PRIMARY KEY AUTOINCREMENT', definicao,
+                       flags=re.I)
+    definicao = re.sub(r'\s+AUTO_INCREMENT\b', '', definicao, flags=re.I)
+    definicao = re.sub(r'\s+UNSIGNED\b', '', definicao, flags=re.I)
+    return re.sub(r'\bCOLLATE\s+utf8mb4_bin\b', 'COLLATE BINARY', definicao, flags=re.I)
+
+
+def _parametro(valor):
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, int) and valor >= 2 ** 63:
+        return valor - 2 ** 64
+    return valor
+
+
+def _parametros(args):
+    return () if args is None else tuple(_parametro(v) for v in args)
+
+
+class BancoSQLite:
+    """Arquivo SQLite compartilhado pelas conexões do benchmark; remover() apaga o arquivo ao final."""
+
+    def __init__(self, caminho=None):
+        if caminho is None:
+            descritor, caminho = tempfile.mkstemp(prefix='benchmark-', suffix='.sqlite')
+            os.close(descritor)
+        self.caminho = caminho
+        with sqlite3.connect(caminho) as db:
+            db.execute('PRAGMA journal_mode = WAL')
+
+    def conectar(self):
+        return ConexaoSQLite(self.caminho)
+
+    def remover(self):
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(self.caminho + sufixo):
+                os.remove(self.caminho + sufixo)
+
+
+class ConexaoSQLite:
+    """Conexão no estilo do MySQLdb: transação implícita nas alterações de dados, commit() e rollback() explícitos."""
+
+    closed = False
+    open = True
+
+    def __init__(self, caminho):
+        self.db = sqlite3.connect(caminho, timeout=TEMPO_ESPERA, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        # Como no MariaDB, renomear uma tabela não reescreve as views que a usam: elas passam a ver a nova dona do nome
+        self.db.execute('PRAGMA legacy_alter_table = ON')
+        self.db.executescript(_INFORMATION_SCHEMA)
+        self.em_transacao = False
+
+    def cursor(self):
+        return CursorSQLite(self)
+
+    def iniciar(self):
+        if not self.em_transacao:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.em_transacao = True
+
+    def commit(self):
+        if self.em_transacao:
+            self.db.execute('COMMIT')
+            self.em_transacao = False
+
+    def rollback(self):
+        if self.em_transacao:
+            self.db.execute('ROLLBACK')
+            self.em_transacao = False
+
+    def ping(self, *args, **kwargs):
+        self.db.execute('SELECT 1')
+
+    def close(self):
+        self.db.close()
+        self.closed, self.open = True, False
+
+
+class CursorSQLite:
+    """Cursor que traduz cada comando do dialeto do MariaDB e o executa no SQLite."""
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.db = conexao.db
+        self._cursor = self.db.cursor()
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def execute(self, query, args=None):
+        sql = query.strip().rstrip(';')
+        parametros = _parametros(args)
+        palavra = sql.split(None, 1)[0].upper()
+        if palavra == 'LOAD':
+            raise sqlite3.OperationalError('LOAD DATA LOCAL INFILE não é suportado pelo substituto SQLite')
+        if palavra in ('CREATE', 'DROP', 'ALTER', 'RENAME'):
+            # DDL confirma a transação pendente, como no MariaDB (exceto CREATE/DROP TEMPORARY TABLE)
+            if not re.match(r'(CREATE|DROP)\s+TEMPORARY\b', sql, re.I):
+                self.conexao.commit()
+            self._ddl(sql)
+            self.rowcount = 0
+            return self.rowcount
+        if palavra in _DML:
+            self.conexao.iniciar()
+        self._cursor.execute(self._traduzir(sql), parametros)
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, query, args):
+        sql = query.strip().rstrip(';')
+        if sql.split(None, 1)[0].upper() in _DML:
+            self.conexao.iniciar()
+        self._cursor.executemany(self._traduzir(sql), [_parametros(linha) for linha in args])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    # Comandos de dados e consultas
+
+    def _traduzir(self, sql):
+        sql = sql.replace('%s', '?')
+        sql = re.sub(r'information_schema\.TABLES\b', 'information_schema_tables', sql, flags=re.I)
+        sql = re.sub(r'information_schema\.COLUMNS\b', 'information_schema_columns', sql, flags=re.I)
+        sql = re.sub(r'\bDATABASE\(\)', "'main'", sql, flags=re.I)
+        sql = re.sub(r'^INSERT\s+IGNORE\s+INTO\b', 'INSERT OR IGNORE INTO', sql, flags=re.I)
+        duplicados = _DUPLICADOS.search(sql)
+        if duplicados:
+            atribuicoes = re.sub(r'VALUES\((`?[^`)]+`?)\)', r'excluded.\1', duplicados.group(1), flags=re.I)
+            insercao = sql[:duplicados.start()]
+            if re.search(r'\bSELECT\b', insercao, re.I) and not re.search(r'\bWHERE\b', insercao, re.I):
+                # No INSERT ... SELECT o SQLite exige um WHERE antes do ON CONFLICT, para não lê-lo como uma junção
+                insercao += ' WHERE true'
+            sql = insercao + ' ON CONFLICT DO UPDATE SET ' + atribuicoes
+        junta = _DELETE_JOIN.match(sql)
+        if junta:
+            # DELETE t FROM tabela t JOIN ... -> DELETE pelas linhas (rowid) que a junção seleciona
+            alias, tabela, resto = junta.groups()
+            sql = f'DELETE FROM "{tabela}" WHERE rowid IN (SELECT {alias}.rowid FROM "{tabela}" {alias} {resto})'
+        junta = _UPDATE_JOIN.match(sql)
+        if junta:
+            # UPDATE t JOIN d ON ... SET t.c = ... -> UPDATE ... FROM, com as colunas atribuídas sem o alias
+            tabela, alias, outra, alias_outra, condicao, atribuicoes = junta.groups()
+            atribuicoes = re.sub(rf'\b{alias}\.(`?\w+`?)\s*=', r'\1 =', atribuicoes)
+            sql = f'UPDATE "{tabela}" AS {alias} SET {atribuicoes} FROM "{outra}" AS {alias_outra} WHERE {condicao}'
+        return sql
+
+    # DDL
+
+    def _ddl(self, sql):
+        for padrao, tratar in ((_CREATE_LIKE, self._create_like), (_CREATE_TABLE, self._create_table),
+                               (_CREATE_VIEW, self._create_view), (_DROP_TABLE, self._drop_table),
+                               (_RENAME_TABLE, self._rename_table), (_ALTER_TABLE, self._alter_table)):
+            encontrado = padrao.match(sql)
+            if encontrado:
+                return tratar(*encontrado.groups())
+        self.db.execute(sql)
+
+    def _existe(self, nome, esquema='main'):
+        return self.db.execute(f"SELECT 1 FROM {esquema}.sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+                               (nome,)).fetchone() is not None
+
+    def _restricoes_em_uso(self, nomes, exceto=None):
+        # O InnoDB exige nomes de chave estrangeira únicos em todo o banco (errno 121)
+        em_uso = set()
+        for tabela, sql in self.db.execute("SELECT name, sql FROM main.sqlite_master WHERE type = 'table'"):
+            if tabela != exceto and sql:
+                em_uso.update(_RESTRICAO_FK.findall(sql))
+        return sorted(set(nomes) & em_uso)
+
+    def _nome_indice(self, tabela, nome):
+        # Índices do SQLite têm nomes globais; no MariaDB o nome é por tabela
+        candidato, n = f'{tabela}.{nome}', 1
+        while self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                              (candidato,)).fetchone():
+            n += 1
+            candidato = f'{tabela}.{nome}#{n}'
+        return candidato
+
+    def _tem_indice(self, tabela, nome):
+        return any(linha[1] == f'{tabela}.{nome}' or linha[1].startswith(f'{tabela}.{nome}#') or
+                   linha[1].endswith(f'.{nome}')
+                   for linha in self.db.execute(f'PRAGMA index_list("{tabela}")'))
+
+    def _criar_indice(self, tabela, nome, colunas, unico=False, se_nao_existe=False):
+        if se_nao_existe and self._tem_indice(tabela, nome):
+            return
+        self.db.execute(f'CREATE {"UNIQUE " if unico else ""}INDEX "{self._nome_indice(tabela, nome)}" '
+                        f'ON "{tabela}" ({colunas})')
+
+    def _create_table(self, temporaria, se_nao_existe, tabela, corpo):
+        esquema = 'temp' if temporaria else 'main'
+        if self._existe(tabela, esquema):
+            if se_nao_existe:
+                return
+            raise sqlite3.OperationalError(f"Table '{tabela}' already exists")
+        colunas, indices = [], []
+        for item in _itens(corpo):
+            indice = _INDICE.match(item)
+            if indice and not re.match(r'\s*PRIMARY\b', item, re.I):
+                unico, _, nome, campos = indice.groups()
+                if unico:
+                    colunas.append(f'UNIQUE ({campos})')
+                else:
+                    indices.append((nome, campos))
+            else:
+                colunas.append(_tipos(item))
+        if not temporaria:
+            duplicadas = self._restricoes_em_uso(_RESTRICAO_FK.findall(corpo))
+            if duplicadas:
+                raise sqlite3.IntegrityError(f"Can't create table `{tabela}` (errno: 121 \"Duplicate key on write or "
+                                             f"update\"): restrições {duplicadas} já existem")
+        self.db.execute(f'CREATE {"TEMP " if temporaria else ""}TABLE "{tabela}" ({", ".join(colunas)})')
+        for nome, campos in indices:
+            self._criar_indice(tabela, nome, campos)
+
+    def _create_like(self, temporaria, tabela, origem):
+        esquema = 'temp' if self._existe(origem, 'temp') else 'main'
+        sql, = self.db.execute(f"SELECT sql FROM {esquema}.sqlite_master WHERE type = 'table' AND name = ?",
+                               (origem,)).fetchone()
+        corpo = sql[sql.index('(') + 1:sql.rindex(')')]
+        # CREATE TABLE ... LIKE copia colunas e índices, mas não as chaves estrangeiras
+        colunas = [item for item in _itens(corpo) if not re.search(r'\bFOREIGN\s+KEY\b', item, re.I)]
+        self.db.execute(f'CREATE {"TEMP " if temporaria else ""}TABLE "{tabela}" ({", ".join(colunas)})')
+        indices = self.db.execute(f"SELECT name, sql FROM {esquema}.sqlite_master "
+                                  "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (origem,)).fetchall()
+        for nome, indice_sql in indices:
+            unico = bool(re.match(r'CREATE\s+UNIQUE', indice_sql, re.I))
+            campos = indice_sql[indice_sql.rindex('(') + 1:indice_sql.rindex(')')]
+            self._criar_indice(tabela, nome.split('.', 1)[-1].split('#')[0], campos, unico)
+
+    def _create_view(self, view, selecao):
+        self.db.execute(f'DROP VIEW IF EXISTS "{view}"')
+        self.db.execute(f'CREATE VIEW "{view}" AS {selecao}')
+
+    def _drop_table(self, temporaria, se_existe, nomes):
+        esquema = 'temp.' if temporaria else ''
+        for nome in _itens(nomes):
+            nome = nome.strip('`')
+            if not se_existe and not self._existe(nome, 'temp' if temporaria else 'main'):
+                raise sqlite3.OperationalError(f"Unknown table '{nome}'")
+            self.db.execute(f'DROP TABLE IF EXISTS {esquema}"{nome}"')
+
+    def _rename_table(self, pares):
+        # Todas as trocas em uma transação: leitores veem os nomes antigos ou os novos, nunca um meio-termo
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for par in _itens(pares):
+                antigo, novo = (n.strip().strip('`') for n in re.split(r'\s+TO\s+', par, flags=re.I))
+                if self._existe(novo):
+                    raise sqlite3.OperationalError(f"Table '{novo}' already exists")
+                self.db.execute(f'ALTER TABLE "{antigo}" RENAME TO "{novo}"')
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def _alter_table(self, tabela, alteracoes):
+        restricoes = []
+        for alteracao in _itens(alteracoes):
+            coluna = re.match(rf'ADD\s+COLUMN\s+(IF\s+NOT\s+EXISTS\s+)?{_NOME}\s+(.*)$', alteracao, re.I | re.S)
+            indice = re.match(r'ADD\s+(.*)$', alteracao, re.I | re.S)
+            remocao = re.match(rf'DROP\s+COLUMN\s+{_NOME}$', alteracao, re.I)
+            if coluna:
+                se_nao_existe, nome, definicao = coluna.groups()
+                existentes = {linha[1] for linha in self.db.execute(f'PRAGMA table_info("{tabela}")')}
+                if nome in existentes:
+                    if se_nao_existe:
+                        continue
+                    raise sqlite3.OperationalError(f"Duplicate column name '{nome}'")
+                self.db.execute(f'ALTER TABLE "{tabela}" ADD COLUMN "{nome}" {_tipos(definicao)}')
+            elif remocao:
+                self.db.execute(f'ALTER TABLE "{tabela}" DROP COLUMN "{remocao.group(1)}"')
+            elif indice and _INDICE.match(indice.group(1)):
+                unico, se_nao_existe, nome, campos = _INDICE.match(indice.group(1)).groups()
+                self._criar_indice(tabela, nome, campos, bool(unico), bool(se_nao_existe))
+            elif indice and re.search(r'\bFOREIGN\s+KEY\b', alteracao, re.I):
+                restricoes.append(indice.group(1))
+            else:
+                raise sqlite3.OperationalError(f"Alteração não suportada pelo substituto SQLite: {alteracao}")
+        if restricoes:
+            self._recriar_com_restricoes(tabela, restricoes)
+
+    def _recriar_com_restricoes(self, tabela, restricoes):
+        # O SQLite não acrescenta chaves estrangeiras com ALTER TABLE: a tabela é recriada com elas e os dados copiados
+        duplicadas = self._restricoes_em_uso([n for r in restricoes for n in _RESTRICAO_FK.findall(r)], exceto=tabela)
+        if duplicadas:
+            raise sqlite3.IntegrityError(f"Can't create table `{tabela}` (errno: 121 \"Duplicate key on write or "
+                                         f"update\"): restrições {duplicadas} já existem")
+        sql, = self.db.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (tabela,)).fetchone()
+        indices = self.db.execute("SELECT name, sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                  "AND sql IS NOT NULL", (tabela,)).fetchall()
+        temporaria = f'{tabela}__recriada'
+        corpo = sql[sql.index('(') + 1:sql.rindex(')')]
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute(f'CREATE TABLE "{temporaria}" ({", ".join(_itens(corpo) + restricoes)})')
+            self.db.execute(f'INSERT INTO "{temporaria}" SELECT * FROM "{tabela}"')
+            self.db.execute(f'DROP TABLE "{tabela}"')
+            self.db.execute(f'ALTER TABLE "{temporaria}" RENAME TO "{tabela}"')
+            for _, indice_sql in indices:
+                self.db.execute(indice_sql)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
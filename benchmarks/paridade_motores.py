@@ -0,0 +1,152 @@
+"""
+Paridade e desempenho dos motores de transformação (tasks.motores) nas camadas silver e gold.
+
+Para cada tamanho e semente, gera a aba "Geral" sintética do benchmark do pipeline, acrescenta casos de borda de texto
+(title case fora do ASCII, espaços, sentinelas, nulos, datas inválidas) e passa a bronze resultante pela limpeza
+silver e por todas as saídas de GOLD_TARGETS com cada motor. As saídas de todos os motores precisam ser idênticas à do
+motor 'pandas': mesmos valores, dtypes, categorias e índice, e o mesmo parquet byte a byte. A entrada de cada camada
+passa por um parquet em memória, como na leitura do MinIO.
+
+O relatório traz o tempo mediano de cada camada por motor; o script termina com código 1 se alguma saída divergir.
+
+Uso:
+    python benchmarks/paridade_motores.py
+    python benchmarks/paridade_motores.py --linhas 1000 100000 1000000 --repeticoes 5
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'dags'))
+
+from pipeline import gerar_planilha  # noqa: E402
+
+# Textos cuja normalização (strip + title) mais diverge entre implementações
+CASOS_TEXTO = [
+    '  país  ', 'ORGANIZAÇÃO', 'ªdécada', 'acordo nº 5', 'straße', 'ﬁnanças', 'ΣΊΣΥΦΟΣ', 'İstanbul', 'ǆemal',
+    "d'ávila", 'são-paulo', '1º protocolo', 'x y', '\tcaribe\n', '', '-', ' - ', None,
+]
+
+# Colunas de texto da aba que recebem os casos de borda
+COLUNAS_CASOS = ['Parceiro', 'Tipo de Parceiro', 'Continente', 'Região', 'Local de Assinatura', 'Tipo de Acordo',
+                 'Título', 'Recursos', 'Tipo de Documento']
+
+
+def gerar_bronze(linhas, seed):
+    """Camada bronze da aba sintética com os casos de borda, como a silver a lê do parquet."""
+    from tasks.bronze import _transformar
+    from tasks.sheets import registros
+
+    planilha = gerar_planilha(linhas, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    casos = np.array(CASOS_TEXTO, dtype=object)
+    for coluna in COLUNAS_CASOS:
+        linhas_casos = rng.random(linhas) < 0.05
+        planilha.loc[linhas_casos, coluna] = casos[rng.integers(0, len(casos), linhas_casos.sum())]
+    planilha.loc[rng.random(linhas) < 0.01, 'Data de Celebração'] = '31/02/2020'
+
+    # Mesmo caminho da extração: valores como texto da API, números convertidos e colunas normalizadas
+    texto = planilha.astype(object).where(planilha.notna(), '').astype(str)
+    valores = [list(planilha.columns)] + texto.to_numpy().tolist()
+    return _ida_e_volta(_transformar(pd.DataFrame(registros(valores, 'Geral')), 'Geral'))
+
+
+def _ida_e_volta(df):
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return pq.read_table(pa.BufferReader(buffer.getvalue())).to_pandas()
+
+
+def _parquet(df):
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df), buffer)
+    return buffer.getvalue()
+
+
+def silver(bronze, motor):
+    from tasks.silver import COLUNAS_ACORDOS, COLUNAS_BRONZE, limpar_acordos
+
+    return motor.sem_duplicadas(limpar_acordos(bronze[COLUNAS_BRONZE], motor=motor)[COLUNAS_ACORDOS])
+
+
+def gold(slv, motor):
+    from tasks.gold import GOLD_TARGETS
+
+    return {gld_name: alvo['build'](slv, motor) for gld_name, alvo in GOLD_TARGETS.items()}
+
+
+def divergencias(esperado, obtido):
+    """Descrição das diferenças entre dois DataFrames (vazia se forem idênticos, inclusive no parquet)."""
+    try:
+        pd.testing.assert_frame_equal(esperado, obtido, check_exact=True, check_categorical=True)
+    except AssertionError as e:
+        return str(e).splitlines()[0]
+    if _parquet(esperado) != _parquet(obtido):
+        return 'parquet gravado difere'
+    return ''
+
+
+def _medir(funcao, repeticoes):
+    tempos, resultado = [], None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, statistics.median(tempos)
+
+
+def executar(linhas, seed, repeticoes):
+    """Compara os motores sobre uma aba de `linhas` linhas. Retorna (linhas do relatório, divergências)."""
+    from tasks.dimensoes import como_categorias
+    from tasks.motores import MOTOR_PADRAO, MOTORES
+
+    bronze = gerar_bronze(linhas, seed)
+    relatorio, erros, referencia = [], [], {}
+    for nome, motor in sorted(MOTORES.items(), key=lambda item: item[0] != MOTOR_PADRAO):
+        slv, tempo_silver = _medir(lambda: silver(bronze, motor), repeticoes)
+        # A gold de todos os motores parte da mesma silver lida do parquet (a do motor de referência)
+        referencia.setdefault('entrada_gold', _ida_e_volta(como_categorias(slv)))
+        gld, tempo_gold = _medir(lambda: gold(referencia['entrada_gold'], motor), repeticoes)
+        saidas = {'slv_acordos': slv, **gld}
+        for saida, df in saidas.items():
+            esperado = referencia.setdefault(saida, df)
+            diferenca = divergencias(esperado, df)
+            if diferenca:
+                erros.append(f"{linhas} linhas, seed {seed}, motor '{nome}', {saida}: {diferenca}")
+        relatorio.append({'linhas': linhas, 'seed': seed, 'motor': nome, 'silver_s': round(tempo_silver, 4),
+                          'gold_s': round(tempo_gold, 4), 'linhas_silver': len(slv)})
+    return relatorio, erros
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--linhas', type=int, nargs='+', default=[1_000, 100_000])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--repeticoes', type=int, default=3, help='Execuções cronometradas por camada e motor')
+    args = parser.parse_args(argv)
+
+    relatorio, erros = [], []
+    for linhas in args.linhas:
+        for seed in args.seeds:
+            linhas_relatorio, erros_execucao = executar(linhas, seed, args.repeticoes)
+            relatorio.extend(linhas_relatorio)
+            erros.extend(erros_execucao)
+
+    print(pd.DataFrame(relatorio).to_string(index=False))
+    for erro in erros:
+        print(f"DIVERGÊNCIA: {erro}")
+    print('Saídas idênticas entre os motores' if not erros else f'{len(erros)} saída(s) divergente(s)')
+    return 1 if erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
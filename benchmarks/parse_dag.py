@@ -0,0 +1,91 @@
+"""
+Tempo de parse do arquivo da DAG (dag_main.py), como no loop do scheduler do Airflow.
+
+Cada medição roda em um processo Python novo: o diretório de DAGs entra no sys.path e os módulos do Airflow usados pela
+DAG são importados antes do cronômetro (no scheduler eles já estão carregados), de modo que o tempo medido é o custo
+do próprio arquivo e do que ele importa. O script falha (código 1) se a mediana passar do orçamento ou se o parse
+carregar alguma biblioteca de MODULOS_PESADOS, que só devem ser importadas na execução das tarefas.
+
+Para comparação, o relatório também traz o tempo de importar tasks.bronze, tasks.silver e tasks.gold, que o parse
+pagava quando a DAG importava as tarefas diretamente.
+
+Uso:
+    python benchmarks/parse_dag.py
+    python benchmarks/parse_dag.py --repeticoes 10 --orcamento-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DIRETORIO_DAGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow', 'dags')
+
+# Orçamento padrão do parse do arquivo da DAG, sem contar os módulos do Airflow
+ORCAMENTO_MS = 200
+
+# Bibliotecas que não podem ser carregadas no parse da DAG
+MODULOS_PESADOS = ['pandas', 'numpy', 'pyarrow', 'boto3', 'botocore', 'gspread', 'google.oauth2', 'MySQLdb',
+                   'airflow.providers.mysql']
+
+# Módulos do Airflow que o scheduler já tem carregados quando faz o parse
+MODULOS_AIRFLOW = ['airflow', 'airflow.decorators', 'airflow.operators.python', 'airflow.utils.task_group']
+
+_MEDICAO = """
+import importlib, json, runpy, sys, time
+diretorio, alvo, pesados, previos = sys.argv[1], sys.argv[2], json.loads(sys.argv[3]), json.loads(sys.argv[4])
+sys.path.insert(0, diretorio)
+for modulo in previos:
+    importlib.import_module(modulo)
+carregados = set(sys.modules)
+inicio = time.perf_counter()
+if alvo.endswith('.py'):
+    runpy.run_path(alvo, run_name='dag_main')
+else:
+    for modulo in alvo.split(','):
+        importlib.import_module(modulo)
+segundos = time.perf_counter() - inicio
+novos = [m for m in pesados if m in sys.modules and m not in carregados]
+print(json.dumps({'segundos': segundos, 'pesados': novos}))
+"""
+
+
+def medir(alvo, previos=MODULOS_AIRFLOW):
+    """Executa o parse do arquivo `alvo` (ou a importação dos módulos 'a,b,c') em um processo novo."""
+    saida = subprocess.run(
+        [sys.executable, '-c', _MEDICAO, DIRETORIO_DAGS, alvo, json.dumps(MODULOS_PESADOS), json.dumps(previos)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dag', default=os.path.join(DIRETORIO_DAGS, 'dag_main.py'))
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--orcamento-ms', type=float, default=ORCAMENTO_MS)
+    args = parser.parse_args(argv)
+
+    medicoes = [medir(os.path.abspath(args.dag)) for _ in range(args.repeticoes)]
+    parse_ms = statistics.median(m['segundos'] for m in medicoes) * 1000
+    pesados = sorted({modulo for m in medicoes for modulo in m['pesados']})
+    tarefas_ms = statistics.median(
+        medir('tasks.bronze,tasks.silver,tasks.gold')['segundos'] for _ in range(args.repeticoes)
+    ) * 1000
+
+    print(f"Parse de {os.path.basename(args.dag)}: {parse_ms:.1f} ms (mediana de {args.repeticoes}, "
+          f"orçamento {args.orcamento_ms:.0f} ms)")
+    print(f"Importação de tasks.bronze, tasks.silver e tasks.gold (evitada no parse): {tarefas_ms:.1f} ms")
+    erros = []
+    if parse_ms > args.orcamento_ms:
+        erros.append(f"parse acima do orçamento: {parse_ms:.1f} ms > {args.orcamento_ms:.0f} ms")
+    if pesados:
+        erros.append(f"bibliotecas pesadas carregadas no parse: {pesados}")
+    for erro in erros:
+        print(f"FALHA: {erro}")
+    return 1 if erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Fixtures dos testes: o MinIO é simulado pelo moto no próprio processo, o MariaDB pelo BancoSQLite de
+benchmarks/banco_local.py e o Google Sheets por um cliente gspread falso.
+
+Uso:
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(RAIZ, 'airflow', 'dags'))
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+BUCKETS = ['bronze', 'silver', 'gold']
+
+# Credenciais do MinIO simulado, passadas às tarefas como no DAG
+CREDENCIAIS = (None, 'teste', 'teste')
+
+
+class _RespostaDrive:
+    def __init__(self, corpo):
+        self._corpo = corpo
+
+    def json(self):
+        return self._corpo
+
+
+class PlanilhaFalsa:
+    """
+    Substituto do cliente gspread: serve `df` como a API (valores formatados como texto) e a revisão do Drive, que
+    muda a cada atribuição de `df`, como a cada edição da planilha.
+    """
+
+    id = 'teste'
+
+    def __init__(self, df):
+        self.versao = 0
+        self.df = df
+        self.http_client = self
+
+    @property
+    def df(self):
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        self._df = df.reset_index(drop=True)
+        self.versao += 1
+
+    def open_by_key(self, sheet_id):
+        return self
+
+    def request(self, method, endpoint, params=None, **kwargs):
+        return _RespostaDrive({'version': str(self.versao)})
+
+    def values_batch_get(self, ranges, params=None):
+        texto = self.df.astype(object).where(self.df.notna(), '').astype(str)
+        valores = [list(self.df.columns)] + texto.to_numpy().tolist()
+        return {'valueRanges': [{'range': r, 'values': valores} for r in ranges]}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """Cliente S3 do moto compartilhado com as tarefas, com os buckets das camadas criados."""
+    from moto import mock_aws
+
+    import tasks.storage
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    tasks.storage.get_client.cache_clear()
+    with mock_aws():
+        client = tasks.storage.get_client(*CREDENCIAIS)
+        for bucket in BUCKETS:
+            client.create_bucket(Bucket=bucket)
+        yield client
+    tasks.storage.get_client.cache_clear()
+
+
+@pytest.fixture
+def usar_banco(monkeypatch, tmp_path):
+    """
+    Função que aponta o pool de conexões das tarefas para um BancoSQLite (criado na primeira chamada de cada nome),
+    reiniciando o registro de esquema e o cache de chaves das dimensões, como um processo worker novo.
+    """
+    from banco_local import BancoSQLite
+
+    import tasks.conexoes
+    import tasks.dimensoes
+    import tasks.esquema
+
+    bancos = {}
+
+    def usar(nome='banco'):
+        if nome not in bancos:
+            bancos[nome] = BancoSQLite(str(tmp_path / f'{nome}.sqlite'))
+        banco = bancos[nome]
+
+        class Hook:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def get_conn(self):
+                return banco.conectar()
+
+        tasks.conexoes.get_pool().fechar()
+        tasks.conexoes.get_pool.cache_clear()
+        monkeypatch.setattr(tasks.conexoes, 'MySqlHook', Hook)
+        tasks.esquema.invalidar()
+        tasks.dimensoes._CACHE_CHAVES.clear()
+        return banco
+
+    yield usar
+    tasks.conexoes.get_pool().fechar()
+    tasks.conexoes.get_pool.cache_clear()
+    tasks.esquema.invalidar()
+    tasks.dimensoes._CACHE_CHAVES.clear()
+
+
+@pytest.fixture
+def planilha(monkeypatch):
+    """PlanilhaFalsa com a aba Geral sintética do benchmark do pipeline (120 linhas)."""
+    from pipeline import gerar_planilha
+
+    import tasks.sheets
+
+    falsa = PlanilhaFalsa(gerar_planilha(120, seed=1))
+    monkeypatch.setattr(tasks.sheets, 'get_sheets_client', lambda *args, **kwargs: falsa)
+    return falsa
+
+
+def consultar(banco, sql):
+    """Linhas e nomes das colunas de uma consulta ao BancoSQLite, como DataFrame."""
+    conexao = banco.conectar()
+    try:
+        with conexao.cursor() as cursor:
+            cursor.execute(sql)
+            colunas = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=colunas)
+    finally:
+        conexao.close()
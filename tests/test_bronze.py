@@ -0,0 +1,31 @@
+"""
+Uma aba com erro na leitura em lote (ex.: vazia) não interrompe as outras abas lidas na mesma requisição: elas são
+publicadas e a tarefa falha ao final listando a aba com erro.
+"""
+import pytest
+
+from conftest import CREDENCIAIS, consultar
+
+from tasks.bronze import google_sheets_to_minio_etl
+from tasks.snapshots import read_snapshot
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_aba_vazia_nao_interrompe_as_demais(s3, usar_banco, planilha, monkeypatch, streaming):
+    banco = usar_banco()
+    values_batch_get = planilha.values_batch_get
+
+    def com_aba_vazia(ranges, params=None):
+        resposta = values_batch_get(ranges, params)
+        for intervalo in resposta['valueRanges']:
+            if 'Vazia' in intervalo['range']:
+                intervalo['values'] = []
+        return resposta
+
+    monkeypatch.setattr(planilha, 'values_batch_get', com_aba_vazia)
+    with pytest.raises(RuntimeError, match='Vazia'):
+        google_sheets_to_minio_etl({'teste': ['Vazia', 'Geral', 'Outra']}, 'bronze', *CREDENCIAIS, streaming=streaming)
+
+    for aba in ('Geral', 'Outra'):
+        linhas = len(read_snapshot(s3, 'bronze', f'{aba}/brz_{aba}.parquet'))
+        assert linhas == consultar(banco, f"SELECT COUNT(*) AS n FROM brz_{aba}")['n'][0] == len(planilha.df)
@@ -0,0 +1,41 @@
+"""
+A migração de uma tabela criada antes da normalização troca as colunas VARCHAR de dimensão por chaves sem perder os
+valores: a view vw_<tabela> continua devolvendo o texto de cada linha.
+"""
+import pandas as pd
+
+from conftest import consultar
+
+from tasks.conexoes import conexao
+from tasks.esquema import garantir_tabela
+from tasks.silver import COLUNAS_ACORDOS, CREATE_TABLE_ACORDOS_SQL
+from tasks.dimensoes import DIMENSOES
+
+LINHAS = [
+    ('Parceiro A', 'País', 'Europa', 'Oeste', 'Cooperação', 'Sim', 'Acordo', '2010'),
+    ('Parceiro B', 'Organização', None, 'Leste', 'Cooperação', 'Não', 'Memorando', '2011'),
+    ('Parceiro C', 'País', 'Europa', None, 'Intercâmbio', 'Sim', 'Acordo', '2012'),
+]
+
+COLUNAS = ['parceiro', 'tipo_de_parceiro', 'continente', 'região', 'tipo_de_acordo', 'recursos', 'tipo_de_documento',
+           'ano']
+
+
+def test_migracao_preserva_as_dimensoes(usar_banco):
+    banco = usar_banco()
+    with conexao() as connection:
+        with connection.cursor() as cursor:
+            # slv_acordos como era antes da normalização, já com dados
+            cursor.execute("CREATE TABLE slv_acordos (cod_acordo INT PRIMARY KEY AUTO_INCREMENT, "
+                           + ', '.join(f"`{c}` VARCHAR(255)" for c in COLUNAS) + ")")
+            cursor.executemany(f"INSERT INTO slv_acordos ({', '.join(f'`{c}`' for c in COLUNAS)}) "
+                               f"VALUES ({', '.join(['%s'] * len(COLUNAS))})", LINHAS)
+        connection.commit()
+        garantir_tabela(connection, 'slv_acordos', CREATE_TABLE_ACORDOS_SQL, DIMENSOES,
+                        ['cod_acordo'] + [c for c in COLUNAS_ACORDOS if c in COLUNAS])
+
+    colunas = consultar(banco, "SELECT * FROM slv_acordos").columns
+    assert not set(DIMENSOES) & set(colunas)
+    migradas = consultar(banco, f"SELECT {', '.join(f'`{c}`' for c in COLUNAS)} FROM vw_slv_acordos ORDER BY parceiro")
+    migradas = [tuple(None if pd.isna(v) else str(v) for v in linha) for linha in migradas.itertuples(index=False)]
+    assert migradas == LINHAS
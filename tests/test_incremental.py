@@ -0,0 +1,106 @@
+"""
+O modo incremental precisa terminar no mesmo estado de uma carga completa da mesma planilha: a cada edição, a cadeia
+bronze -> silver -> gold incremental (buckets e banco próprios) é comparada com uma carga completa, nas tabelas do
+MariaDB e nos snapshots do MinIO.
+"""
+import pandas as pd
+
+from conftest import CREDENCIAIS, consultar
+
+from tasks.bronze import google_sheets_to_minio_etl
+from tasks.cache import STATUS_EM_DIA
+from tasks.cdc import delta_key
+from tasks.gold import GOLD_TARGETS, transform_and_load_gold
+from tasks.silver import transform_and_load_silver
+from tasks.snapshots import read_snapshot
+
+# Colunas técnicas, que dependem do modo de carga e não do conteúdo
+TECNICAS = {'cod_acordo', 'cod_local', '_chave', '_hash_linha', '_grupo'}
+
+TABELAS = ['slv_acordos'] + list(GOLD_TARGETS)
+
+
+def _executar(sufixo, incremental):
+    buckets = {camada: camada + sufixo for camada in ('bronze', 'silver', 'gold')}
+    google_sheets_to_minio_etl({'teste': ['Geral']}, buckets['bronze'], *CREDENCIAIS, incremental=incremental)
+    transform_and_load_silver(buckets['bronze'], 'Geral/brz_Geral.parquet', *CREDENCIAIS,
+                              bucket2_name=buckets['silver'], incremental=incremental, force=not incremental)
+    transform_and_load_gold(buckets['silver'], 'silver/slv_acordos.parquet', *CREDENCIAIS,
+                            bucket3_name=buckets['gold'], incremental=incremental, force=not incremental)
+
+
+def _linhas(df):
+    # Multiconjunto das linhas, com os valores como texto (o tipo do ano varia entre inteiro e texto no banco)
+    df = df.drop(columns=[c for c in df.columns if c in TECNICAS])
+    df = df[sorted(df.columns)]
+    return sorted(tuple('' if pd.isna(v) else str(v) for v in linha) for linha in df.itertuples(index=False))
+
+
+def _estado(s3, banco, sufixo):
+    estado = {}
+    for tabela in TABELAS:
+        # A view troca as chaves das dimensões pelos valores, que não dependem da ordem de inserção em cada banco
+        views = consultar(banco, f"SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_NAME = 'vw_{tabela}'")
+        estado[f'banco {tabela}'] = _linhas(consultar(banco, f"SELECT * FROM `{'vw_' if len(views) else ''}{tabela}`"))
+        camada = 'silver' if tabela.startswith('slv') else 'gold'
+        estado[f'snapshot {tabela}'] = _linhas(read_snapshot(s3, camada + sufixo, f'{camada}/{tabela}.parquet'))
+    return estado
+
+
+def _duplicar(df, linhas):
+    return pd.concat([df, df.iloc[linhas]], ignore_index=True)
+
+
+def _alterar(df, linha, coluna, valor):
+    df = df.copy()
+    df.loc[linha, coluna] = valor
+    return df
+
+
+def _copiar(df, origem, destino, **valores):
+    # A linha `destino` passa a repetir a `origem`, com os `valores` alterados
+    df = df.copy()
+    df.loc[destino] = df.loc[origem]
+    for coluna, valor in valores.items():
+        df.loc[destino, coluna] = valor
+    return df
+
+
+EDICOES = [
+    ('inicial com duplicadas', lambda df: _duplicar(df, [2, 2, 5])),
+    ('nova duplicada', lambda df: _duplicar(df, [7])),
+    ('remove a primeira ocorrência', lambda df: df.drop(index=[2])),
+    ('altera uma das duplicadas', lambda df: _alterar(df, 4, 'Objetivo', 'objetivo alterado')),
+    ('edição cria duplicada', lambda df: _copiar(df, 11, 10)),
+    ('duplicada só após a limpeza', lambda df: _copiar(df, 12, 13, Parceiro=f"  {df.loc[12, 'Parceiro'].upper()} ")),
+    ('remove todas as ocorrências', lambda df: df.drop(index=df.index[df['Link'] == df.loc[7, 'Link']])),
+]
+
+
+def test_incremental_igual_a_carga_completa(s3, usar_banco, planilha):
+    for bucket in ('bronze_completa', 'silver_completa', 'gold_completa'):
+        s3.create_bucket(Bucket=bucket)
+
+    for nome, editar in EDICOES:
+        planilha.df = editar(planilha.df)
+        banco = usar_banco('incremental')
+        _executar('', incremental=True)
+        incremental = _estado(s3, banco, '')
+
+        banco = usar_banco('completa')
+        _executar('_completa', incremental=False)
+        completa = _estado(s3, banco, '_completa')
+
+        diferentes = [parte for parte in completa if incremental[parte] != completa[parte]]
+        assert not diferentes, f"{nome}: incremental difere da carga completa em {diferentes}"
+
+
+def test_incremental_sem_delta_nao_esta_em_dia(s3, usar_banco, planilha):
+    # O delta é uma das entradas da linhagem das camadas incrementais: sem ele, a saída nunca está em dia
+    usar_banco()
+    google_sheets_to_minio_etl({'teste': ['Geral']}, 'bronze', *CREDENCIAIS, incremental=True)
+    s3.delete_object(Bucket='bronze', Key=delta_key('Geral/brz_Geral.parquet'))
+    for _ in range(2):
+        assert transform_and_load_silver('bronze', 'Geral/brz_Geral.parquet', *CREDENCIAIS,
+                                         incremental=True) != STATUS_EM_DIA
+    assert len(read_snapshot(s3, 'silver', 'silver/slv_acordos.parquet')) == len(planilha.df)
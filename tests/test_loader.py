@@ -0,0 +1,36 @@
+"""
+A carga 'infile' com on_duplicate_update atualiza as linhas existentes como o INSERT ... ON DUPLICATE KEY UPDATE dos
+outros métodos: o id AUTO_INCREMENT e as colunas fora da carga são mantidos.
+"""
+import pandas as pd
+
+from conftest import consultar
+
+import tasks.loader
+from tasks.conexoes import conexao
+from tasks.loader import bulk_load
+
+
+def test_infile_com_upsert_preserva_ids_e_colunas(usar_banco, monkeypatch):
+    banco = usar_banco()
+    # O substituto SQLite recusa LOAD DATA: o arquivo de cada lote é gravado na tabela com executemany
+    monkeypatch.setattr(tasks.loader, '_load_data',
+                        lambda cursor, tabela, colunas, lote: tasks.loader._carregar_executemany(cursor, tabela,
+                                                                                                 colunas, lote, False))
+    with conexao() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE acordos (id INT PRIMARY KEY AUTO_INCREMENT, chave VARCHAR(255), "
+                           "valor VARCHAR(255), nota VARCHAR(255), UNIQUE KEY uk_chave (chave))")
+            cursor.execute("INSERT INTO acordos (chave, valor, nota) VALUES ('a', 'antigo', 'manter'), "
+                           "('b', 'antigo', 'manter')")
+        connection.commit()
+        novos = pd.DataFrame({'chave': ['b', 'c'], 'valor': ['novo', 'novo']})
+        bulk_load(connection, 'acordos', novos, metodo='infile', on_duplicate_update=True)
+
+    # O id da linha nova não é verificado: o upsert pode consumir valores do AUTO_INCREMENT, como no InnoDB
+    linhas = consultar(banco, "SELECT id, chave, valor, nota FROM acordos ORDER BY chave")
+    assert linhas.astype(object).where(linhas.notna(), None).values.tolist()[:2] == [
+        [1, 'a', 'antigo', 'manter'],
+        [2, 'b', 'novo', 'manter'],
+    ]
+    assert linhas['chave'].tolist() == ['a', 'b', 'c'] and linhas['valor'].iloc[2] == 'novo'
@@ -0,0 +1,69 @@
+"""
+Métricas de uma tarefa instrumentada: o resumo das etapas vai para o XCom 'metricas' e para o StatsD (UDP), também
+quando a tarefa falha.
+"""
+import socket
+
+import pytest
+
+import airflow.operators.python
+import tasks.metricas
+from tasks.metricas import ETAPA_CARGA_DB, ETAPA_TRANSFORMACAO, XCOM_METRICAS, etapa, instrumentar
+
+
+class InstanciaFalsa:
+    def __init__(self):
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[key] = value
+
+
+@pytest.fixture
+def statsd(monkeypatch):
+    """Socket UDP local que recebe as métricas enviadas ao StatsD."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(1)
+        monkeypatch.setattr(tasks.metricas, 'STATSD_HOST', '127.0.0.1')
+        monkeypatch.setattr(tasks.metricas, 'STATSD_PORT', sock.getsockname()[1])
+        yield sock
+
+
+def _recebidas(sock):
+    linhas = []
+    try:
+        while True:
+            linhas.append(sock.recv(4096).decode('utf-8'))
+    except socket.timeout:
+        return linhas
+
+
+@pytest.mark.parametrize('falha', [False, True])
+def test_resumo_vai_para_xcom_e_statsd(statsd, monkeypatch, falha):
+    instancia = InstanciaFalsa()
+    monkeypatch.setattr(airflow.operators.python, 'get_current_context', lambda: {'ti': instancia}, raising=False)
+
+    @instrumentar('teste')
+    def tarefa():
+        with etapa(ETAPA_TRANSFORMACAO, linhas=10):
+            pass
+        with etapa(ETAPA_CARGA_DB) as medicao:
+            medicao.linhas = 10
+        if falha:
+            raise RuntimeError('falha simulada')
+
+    if falha:
+        with pytest.raises(RuntimeError):
+            tarefa()
+    else:
+        tarefa()
+
+    resumo = instancia.xcom[XCOM_METRICAS]
+    assert resumo['tarefa'] == 'teste' and resumo['status'] == ('erro' if falha else 'ok')
+    assert {nome: valores['linhas'] for nome, valores in resumo['etapas'].items()} == {
+        ETAPA_TRANSFORMACAO: 10, ETAPA_CARGA_DB: 10,
+    }
+    recebidas = _recebidas(statsd)
+    assert sorted(recebidas) == sorted(tasks.metricas.formatar_statsd(resumo))
+    assert f'{tasks.metricas.STATSD_PREFIXO}.teste.{ETAPA_CARGA_DB}.linhas:10|g' in recebidas
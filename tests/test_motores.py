@@ -0,0 +1,13 @@
+"""
+Paridade dos motores de transformação em uma aba pequena: as saídas silver e gold de cada motor de tasks.motores
+precisam ser idênticas às do motor 'pandas' (ver benchmarks/paridade_motores.py, que também mede o desempenho).
+"""
+import pytest
+
+from paridade_motores import executar
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_motores_produzem_saidas_identicas(seed):
+    _, erros = executar(500, seed, repeticoes=1)
+    assert not erros
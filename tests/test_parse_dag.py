@@ -0,0 +1,16 @@
+"""
+Parse do arquivo da DAG (ver benchmarks/parse_dag.py): dentro do orçamento de tempo e sem carregar as bibliotecas
+pesadas, que só devem ser importadas na execução das tarefas.
+"""
+import os
+import statistics
+
+from parse_dag import DIRETORIO_DAGS, ORCAMENTO_MS, medir
+
+REPETICOES = 3
+
+
+def test_parse_da_dag_dentro_do_orcamento():
+    medicoes = [medir(os.path.abspath(os.path.join(DIRETORIO_DAGS, 'dag_main.py'))) for _ in range(REPETICOES)]
+    assert not {modulo for m in medicoes for modulo in m['pesados']}
+    assert statistics.median(m['segundos'] for m in medicoes) * 1000 <= ORCAMENTO_MS